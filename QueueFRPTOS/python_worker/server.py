@@ -5,9 +5,13 @@ import time
 import os
 import uuid
 from uploader import TosUploader
+import tracing
+from tracing import TraceMiddleware, mark_error, trace, tracer
 import json 
 
+tracing.setup("s2v-queue-worker")
 app = FastAPI()
+app.add_middleware(TraceMiddleware)
 
 class GenerateRequest(BaseModel):
     task_id: str
@@ -27,6 +31,9 @@ async def generate_dispatch(req: GenerateRequest):
     print(f"Style: {req.params.get('style', 'default')}")
     
     output_filename = f"{req.task_id}.png" # 提前定义变量
+    span = trace.get_current_span()
+    span.set_attribute("task.id", req.task_id)
+    span.set_attribute("task.type", req.type)
 
     try:
         if req.type == "storyboard": ##LLM故事转分镜
@@ -38,11 +45,13 @@ async def generate_dispatch(req: GenerateRequest):
         
     except Exception as e:
         print(f"Task {req.task_id} failed: {e}")
+        mark_error(span, e)
         return GenerateResponse(status="failed", error=str(e))
 
 def handle_storyboard_task(req: GenerateRequest):
     print(f"Analying story: {req.prompt[:30]}...")
-    time.sleep(2) # 模拟 LLM 思考时间
+    with tracer.start_as_current_span("storyboard.llm"):
+        time.sleep(2) # 模拟 LLM 思考时间
     
     # 【模拟】这里应该调用 ChatGPT/DeepSeek API 分析 story_text
     # 构造符合 Go Processor 期望的 shots 列表结构
@@ -72,13 +81,14 @@ def handle_storyboard_task(req: GenerateRequest):
             json.dump({"shots": mock_shots}, f, ensure_ascii=False, indent=2)
             
         #上传
-        uploader = TosUploader()
-        if uploader.s3:
-            json_url = uploader.upload_file(filename, object_key=f"scripts/{req.task_id}.json")
-            print(f"Storyboard uploaded to: {json_url}")
-        else:
-            print("TOS uploader not configured, returning fake URL")
-            json_url = f"https://fake-url.com/{filename}"
+        with tracer.start_as_current_span("tos.upload", attributes={"tos.key": f"scripts/{req.task_id}.json"}):
+            uploader = TosUploader()
+            if uploader.s3:
+                json_url = uploader.upload_file(filename, object_key=f"scripts/{req.task_id}.json")
+                print(f"Storyboard uploaded to: {json_url}")
+            else:
+                print("TOS uploader not configured, returning fake URL")
+                json_url = f"https://fake-url.com/{filename}"
 
         return GenerateResponse(
             status="success",
@@ -90,6 +100,7 @@ def handle_storyboard_task(req: GenerateRequest):
             }
         )
     except Exception as e:
+        mark_error(trace.get_current_span(), e)
         return GenerateResponse(status="failed", error=f"Failed to process storyboard: {str(e)}")
     finally:
         if os.path.exists(filename):
@@ -104,23 +115,26 @@ def handle_shot_generation_task(req: GenerateRequest):
     output_filename = f"{req.task_id}.png"
     
     try:
-        time.sleep(3) 
+        with tracer.start_as_current_span("shot.generate", attributes={"shot.style": style}):
+            time.sleep(3) 
         
         # 创建一个假图片用于测试
         with open(output_filename, "w") as f:
             f.write(f"Fake Image Content for {req.task_id}")
             
-        try:
-            uploader = TosUploader()
-            cloud_object_key = f"generated/{req.task_id}.png"
-            if uploader.s3:
-                image_url = uploader.upload_file(output_filename, object_key=cloud_object_key)
-            else:
-                print("TOS uploader not configured, returning fake URL")
-                image_url = f"https://fake-url.com/{output_filename}"
-        except Exception as upload_err:
-            print(f"Upload warning: {upload_err}")
-            image_url = f"http://127.0.0.1:8080/temp/{output_filename}"
+        cloud_object_key = f"generated/{req.task_id}.png"
+        with tracer.start_as_current_span("tos.upload", attributes={"tos.key": cloud_object_key}) as upload_span:
+            try:
+                uploader = TosUploader()
+                if uploader.s3:
+                    image_url = uploader.upload_file(output_filename, object_key=cloud_object_key)
+                else:
+                    print("TOS uploader not configured, returning fake URL")
+                    image_url = f"https://fake-url.com/{output_filename}"
+            except Exception as upload_err:
+                print(f"Upload warning: {upload_err}")
+                mark_error(upload_span, upload_err)
+                image_url = f"http://127.0.0.1:8080/temp/{output_filename}"
 
         return GenerateResponse(
             status="success",
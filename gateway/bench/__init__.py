@@ -0,0 +1 @@
+"""End-to-end gateway benchmark: stub model services plus a load driver (`python -m gateway.bench`)."""
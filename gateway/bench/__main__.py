@@ -0,0 +1,313 @@
+"""Drive N concurrent `/render` jobs through a real gateway backed by stub model services.
+
+    python -m gateway.bench --jobs 20 --concurrency 4 --scenes 4 \
+        --latency "img2vid=lognormal:4:0.25,txt2img=fixed:0.8" --output bench.json
+
+Starts `gateway.bench.stubs:app` and `gateway.main:app` as uvicorn subprocesses in a scratch
+directory (SQLite store, outputs and stub artifacts all land there), follows each job over SSE and
+prints one JSON report: per-stage p50/p95/p99, jobs per minute, ffmpeg CPU time and gateway peak RSS.
+Gateway tuning variables (MAX_CONCURRENT_JOBS, FFMPEG_CONCURRENCY, ...) are passed through from the
+environment, so the same scenario can be rerun before and after a change.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from gateway.bench.stubs import SERVICES, parse_assignments, parse_distribution, percentiles
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+TERMINAL = {"finished", "failed", "cancelled"}
+# Progress messages that close a stage once their count reaches the scene total ("Images 4/4").
+STAGE_MESSAGES = {"Images": "image", "Videos": "video", "TTS": "audio", "Mux": "mux"}
+STAGES = ("queue", "storyboard", "image", "video", "audio", "mux", "concat", "total")
+_COUNT = re.compile(r"^(\w+) (\d+)/(\d+)$")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _spawn(module: str, port: int, env: Dict[str, str], cwd: Path, log: Path) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, env=env, cwd=str(cwd), stdout=log.open("wb"), stderr=subprocess.STDOUT)
+
+
+async def _wait_healthy(client: httpx.AsyncClient, url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with {proc.returncode} before becoming healthy")
+        try:
+            if (await client.get(url, timeout=2.0)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} not healthy after {timeout:.0f}s")
+
+
+def _proc_stats(pid: int) -> Dict:
+    """CPU of the process, CPU of its reaped children (ffmpeg/ffprobe) and peak RSS, from /proc (Linux)."""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return {}
+    tick = os.sysconf("SC_CLK_TCK")
+    # Fields after "(comm)": utime/stime/cutime/cstime are 14-17 in proc(5), i.e. offsets 11-14 here.
+    utime, stime, cutime, cstime = (int(v) / tick for v in fields[11:15])
+    hwm = re.search(r"VmHWM:\s+(\d+) kB", status)
+    return {
+        "cpu_seconds": round(utime + stime, 3),
+        "children_cpu_seconds": round(cutime + cstime, 3),
+        "peak_rss_mb": round(int(hwm.group(1)) / 1024, 1) if hwm else None,
+    }
+
+
+class JobTrace:
+    """Timeline of one render job as seen from its SSE progress stream."""
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.job_id = ""
+        self.submitted = 0.0
+        self.started: Optional[float] = None
+        self.marks: Dict[str, float] = {}
+        self.ended: Optional[float] = None
+        self.status = "unsent"
+        self.wait_seconds: Optional[float] = None
+        self.rejections = 0
+        self.error = ""
+        self.timings: Dict = {}
+
+    def observe(self, task: Dict, now: float) -> None:
+        """Record stage boundaries; snapshots may be coalesced, so a boundary lands on the first one showing it."""
+        self.status = task.get("status", self.status)
+        if task.get("waitSeconds") is not None:
+            self.wait_seconds = task["waitSeconds"]
+        if self.started is None and self.status != "pending":
+            self.started = now
+        progress = task.get("progress") or 0
+        if "storyboard" not in self.marks and (progress >= 10 or self.status == "finished"):
+            self.marks["storyboard"] = now
+        match = _COUNT.match(task.get("message") or "")
+        if match and match.group(1) in STAGE_MESSAGES and match.group(2) == match.group(3):
+            self.marks.setdefault(STAGE_MESSAGES[match.group(1)], now)
+        if self.status == "finished":
+            for stage in STAGE_MESSAGES.values():
+                self.marks.setdefault(stage, now)
+        if self.status in TERMINAL:
+            self.ended = now
+            self.error = task.get("error") or ""
+            self.timings = (task.get("result") or {}).get("timings") or {}
+
+    def stages(self) -> Dict[str, float]:
+        """Seconds per stage. Scene stages overlap, so each is measured from the end of the storyboard."""
+        if self.status != "finished" or self.started is None or self.ended is None:
+            return {}
+        board = self.marks.get("storyboard", self.started)
+        out = {
+            "queue": self.wait_seconds if self.wait_seconds is not None else self.started - self.submitted,
+            "storyboard": board - self.started,
+            "concat": self.ended - max(self.marks.get("mux", board), board),
+            "total": self.ended - self.submitted,
+        }
+        for stage in STAGE_MESSAGES.values():
+            out[stage] = self.marks.get(stage, self.ended) - board
+        return out
+
+
+async def _run_job(client: httpx.AsyncClient, base: str, payload: Dict, trace: JobTrace, timeout: float) -> None:
+    trace.submitted = time.perf_counter()
+    while True:
+        resp = await client.post(f"{base}/render", json=payload)
+        if resp.status_code != 429:
+            break
+        # Queue full: honour Retry-After and keep the original submit time, like a patient client.
+        trace.rejections += 1
+        await asyncio.sleep(float(resp.headers.get("Retry-After", "1")))
+    if resp.status_code >= 400:
+        trace.status, trace.error = "rejected", f"{resp.status_code} {resp.text[:200]}"
+        return
+    trace.job_id = resp.json()["job_id"]
+    try:
+        async with client.stream("GET", f"{base}/tasks/{trace.job_id}/stream", timeout=httpx.Timeout(timeout, connect=10.0)) as stream:
+            async for line in stream.aiter_lines():
+                if not line.startswith("data: ") or line == "data: {}":
+                    continue
+                trace.observe(json.loads(line[6:]), time.perf_counter())
+                if trace.status in TERMINAL:
+                    return
+    except httpx.HTTPError as exc:
+        trace.status, trace.error = "lost", f"progress stream: {exc}"
+
+
+async def _drive(args, base: str, stub_base: str, gateway: subprocess.Popen) -> Dict:
+    payload = {
+        "story": args.story,
+        "style": args.style,
+        "scenes": args.scenes,
+        "width": args.width,
+        "height": args.height,
+        "fps": args.fps,
+        "video_frames": args.video_frames,
+    }
+    traces = [JobTrace(i) for i in range(args.jobs)]
+    slots = asyncio.Semaphore(args.concurrency or args.jobs)
+    limits = httpx.Limits(max_connections=args.jobs * 2 + 8)
+    async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+        await _wait_healthy(client, f"{base}/health", gateway)
+        baseline = _proc_stats(gateway.pid)
+
+        async def _one(trace: JobTrace) -> None:
+            async with slots:
+                await _run_job(client, base, payload, trace, args.timeout)
+
+        started = time.perf_counter()
+        await asyncio.wait_for(asyncio.gather(*(_one(t) for t in traces)), args.timeout)
+        elapsed = time.perf_counter() - started
+        health = (await client.get(f"{base}/health")).json()
+        stubs = (await client.get(f"{stub_base}/health")).json()
+        final = _proc_stats(gateway.pid)
+
+    finished = [t for t in traces if t.status == "finished"]
+    per_stage: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    per_scene: Dict[str, List[float]] = {stage: [] for stage in STAGE_MESSAGES.values()}
+    for trace in finished:
+        for stage, seconds in trace.stages().items():
+            per_stage[stage].append(seconds)
+        for scene in (trace.timings.get("scenes") or {}).values():
+            for stage, seconds in scene.items():
+                per_scene.setdefault(stage, []).append(seconds)
+    children_cpu = None
+    if final and baseline:
+        children_cpu = round(final["children_cpu_seconds"] - baseline["children_cpu_seconds"], 3)
+    return {
+        "scenario": {**payload, "jobs": args.jobs, "concurrency": args.concurrency or args.jobs, "seed": args.seed},
+        "latency": stubs.get("services", {}),
+        "elapsed_seconds": round(elapsed, 3),
+        "jobs": {
+            "finished": len(finished),
+            "failed": [{"job_id": t.job_id, "status": t.status, "error": t.error} for t in traces if t.status != "finished"],
+            "rejections_429": sum(t.rejections for t in traces),
+            "per_minute": round(len(finished) * 60 / elapsed, 3) if elapsed > 0 else None,
+        },
+        "stages": {stage: percentiles(samples) for stage, samples in per_stage.items()},
+        # Per-scene durations the gateway recorded in result["timings"] (one sample per scene).
+        "scene_stages": {stage: percentiles(samples) for stage, samples in per_scene.items()},
+        # The gateway reaps its own ffmpeg/ffprobe processes, so their CPU shows up as its children's time.
+        "ffmpeg": {
+            "cpu_seconds": children_cpu,
+            "runner": health.get("ffmpeg"),
+        },
+        "gateway": {
+            "cpu_seconds": round(final["cpu_seconds"] - baseline["cpu_seconds"], 3) if final and baseline else None,
+            "peak_rss_mb": final.get("peak_rss_mb"),
+            "scheduler": health.get("scheduler"),
+        },
+    }
+
+
+async def _wait_stubs(base: str, proc: subprocess.Popen) -> None:
+    async with httpx.AsyncClient() as client:
+        await _wait_healthy(client, f"{base}/health", proc)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m gateway.bench", description="StoryToVideo gateway end-to-end benchmark")
+    parser.add_argument("--jobs", type=int, default=8, help="render jobs to submit")
+    parser.add_argument("--concurrency", type=int, default=0, help="jobs in flight from the client (0 = all at once)")
+    parser.add_argument("--scenes", type=int, default=4)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--fps", type=int, default=12)
+    parser.add_argument("--video-frames", type=int, default=16)
+    parser.add_argument("--story", default="A lighthouse keeper finds a message in a bottle.")
+    parser.add_argument("--style", default="watercolor")
+    parser.add_argument("--latency", default="", help='per-service distributions, e.g. "img2vid=lognormal:4:0.25,tts=fixed:0.5"')
+    parser.add_argument("--capacity", default="", help='per-service concurrent calls in the stubs, e.g. "txt2img=2" (default 1)')
+    parser.add_argument("--clip-size", default="1024x576", help="stub img2vid clip resolution")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--timeout", type=float, default=1800.0, help="overall run timeout (s)")
+    parser.add_argument("--workdir", default="", help="scratch directory (default: a temp dir, removed afterwards)")
+    parser.add_argument("--output", default="", help="write the JSON report here as well as stdout")
+    args = parser.parse_args(argv)
+
+    # Fail fast on typos before anything is started.
+    for spec in parse_assignments(args.latency).values():
+        parse_distribution(spec, random.Random())
+    if not shutil.which("ffmpeg"):
+        parser.error("ffmpeg not found in PATH (the gateway and the clip stub both need it)")
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="s2v-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    stub_port, gateway_port = _free_port(), _free_port()
+    stub_base = f"http://127.0.0.1:{stub_port}"
+    stub_env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")])),
+        "BENCH_LATENCY": args.latency,
+        "BENCH_CAPACITY": args.capacity,
+        "BENCH_SEED": str(args.seed),
+        "BENCH_OUTPUT_DIR": str(workdir / "stubs"),
+        "BENCH_CLIP_SIZE": args.clip_size,
+    }
+    gateway_env = {
+        **stub_env,
+        "LLM_URL": f"{stub_base}/llm/storyboard",
+        "TXT2IMG_URL": f"{stub_base}/txt2img/generate",
+        "IMG2VID_URL": f"{stub_base}/img2vid/generate",
+        "TTS_URL": f"{stub_base}/tts/narration",
+        "STATIC_ROOT": str(workdir),
+        "GATEWAY_DB": str(workdir / "gateway.db"),
+        "FINAL_DIR": str(workdir / "final"),
+        "CLIPS_DIR": str(workdir / "clips"),
+        "RESUME_ON_STARTUP": "0",
+        "JOB_QUEUE_SIZE": os.environ.get("JOB_QUEUE_SIZE", str(max(32, args.jobs))),
+    }
+    for name in SERVICES:
+        gateway_env.pop(f"{name.upper()}_CANCEL_URL", None)
+        gateway_env.pop(f"{name.upper()}_BATCH_URL", None)
+
+    stubs = _spawn("gateway.bench.stubs:app", stub_port, stub_env, workdir, workdir / "stubs.log")
+    gateway = None
+    try:
+        asyncio.run(_wait_stubs(stub_base, stubs))
+        gateway = _spawn("gateway.main:app", gateway_port, gateway_env, workdir, workdir / "gateway.log")
+        report = asyncio.run(_drive(args, f"http://127.0.0.1:{gateway_port}", stub_base, gateway))
+    finally:
+        for proc in (gateway, stubs):
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    return 0 if not report["jobs"]["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""Deterministic stand-ins for the four model services, for gateway benchmarks.
+
+Routes mirror the model node (`/llm/storyboard`, `/txt2img/generate[_batch]`, `/img2vid/generate`,
+`/tts/narration`) and return real artifacts: PNG keyframes, MP4 clips (ffmpeg) and WAV narration.
+Each call sleeps for a latency drawn from a per-service seeded distribution; `capacity` calls per
+service run at once and the rest queue, like the single-GPU workers behind the real services.
+
+Configured through environment variables so it can run under uvicorn:
+  BENCH_LATENCY  e.g. "llm=lognormal:1.5:0.3,txt2img=normal:0.8:0.1,img2vid=uniform:3:5,tts=fixed:0.4"
+  BENCH_CAPACITY e.g. "img2vid=1,txt2img=1" (default 1 each; 0 = unlimited)
+  BENCH_SEED, BENCH_OUTPUT_DIR, BENCH_CLIP_SIZE (WxH), BENCH_SPEECH_CPS (narration chars per second)
+"""
+
+import asyncio
+import math
+import os
+import random
+import shutil
+import struct
+import subprocess
+import time
+import wave
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+
+SERVICES = ("llm", "txt2img", "img2vid", "tts")
+DEFAULT_LATENCY = "llm=lognormal:1.5:0.3,txt2img=lognormal:0.8:0.2,img2vid=lognormal:4.0:0.25,tts=lognormal:0.5:0.3"
+SEED = int(os.getenv("BENCH_SEED", "1234"))
+OUTPUT_DIR = Path(os.getenv("BENCH_OUTPUT_DIR", "data/bench"))
+CLIP_SIZE = os.getenv("BENCH_CLIP_SIZE", "1024x576")
+SPEECH_CPS = float(os.getenv("BENCH_SPEECH_CPS", "5"))
+AUDIO_SAMPLE_RATE = 24000
+
+
+def parse_distribution(spec: str, rng: random.Random) -> Callable[[], float]:
+    """`kind:args` -> sampler of non-negative seconds.
+
+    fixed:S | uniform:A:B | normal:MEAN:SD | lognormal:MEDIAN:SIGMA | exp:MEAN
+    """
+    kind, *raw = spec.split(":")
+    try:
+        args = [float(v) for v in raw]
+        if kind == "fixed":
+            (value,) = args
+            return lambda: value
+        if kind == "uniform":
+            low, high = args
+            return lambda: rng.uniform(low, high)
+        if kind == "normal":
+            mean, sd = args
+            return lambda: max(0.0, rng.gauss(mean, sd))
+        if kind == "lognormal":
+            median, sigma = args
+            return lambda: rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        if kind == "exp":
+            (mean,) = args
+            return lambda: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+    except ValueError as exc:
+        raise ValueError(f"bad latency spec {spec!r}: {exc}") from exc
+    raise ValueError(f"unknown latency distribution {kind!r} (fixed/uniform/normal/lognormal/exp)")
+
+
+def parse_assignments(value: str) -> Dict[str, str]:
+    """"name=value,name=value" -> dict, rejecting unknown service names."""
+    out: Dict[str, str] = {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        name, _, spec = part.partition("=")
+        if name not in SERVICES or not spec:
+            raise ValueError(f"bad setting {part!r}; expected <{'|'.join(SERVICES)}>=<value>")
+        out[name] = spec
+    return out
+
+
+def percentiles(samples: List[float]) -> Dict:
+    """count/mean/p50/p95/p99/max (nearest-rank) of a sample list, in seconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": round(rank(50), 4),
+        "p95": round(rank(95), 4),
+        "p99": round(rank(99), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+class StubService:
+    """Latency sampler + concurrency cap + timing log for one stand-in service."""
+
+    def __init__(self, name: str, spec: str, capacity: int) -> None:
+        # Per-service RNG so one service's draw sequence doesn't depend on how calls interleave.
+        self.sample = parse_distribution(spec, random.Random(f"{SEED}:{name}"))
+        self.spec = spec
+        self.capacity = capacity
+        self._slot = asyncio.Semaphore(capacity) if capacity > 0 else None
+        self.waits: List[float] = []
+        self.service: List[float] = []
+
+    async def call(self, units: int = 1) -> None:
+        """Queue for a slot, then "compute" for `units` latency draws."""
+        queued = time.perf_counter()
+        if self._slot is not None:
+            await self._slot.acquire()
+        try:
+            started = time.perf_counter()
+            self.waits.append(started - queued)
+            await asyncio.sleep(sum(self.sample() for _ in range(units)))
+            self.service.append(time.perf_counter() - started)
+        finally:
+            if self._slot is not None:
+                self._slot.release()
+
+    def stats(self) -> Dict:
+        return {
+            "latency": self.spec,
+            "capacity": self.capacity,
+            "queue_wait": percentiles(self.waits),
+            "service_time": percentiles(self.service),
+        }
+
+
+def png_bytes(width: int, height: int, tint: int) -> bytes:
+    """Minimal RGB PNG (gradient) with the stdlib only."""
+    row_r = bytes((x * 255 // max(width - 1, 1)) for x in range(width))
+    raw = bytearray()
+    for y in range(height):
+        g = y * 255 // max(height - 1, 1)
+        raw.append(0)  # filter type: none
+        raw += bytes(b for r in row_r for b in (r, g, tint))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(bytes(raw), 1)) + chunk(b"IEND", b"")
+
+
+def write_wav(path: Path, seconds: float, pitch: float) -> None:
+    frames = max(1, int(seconds * AUDIO_SAMPLE_RATE))
+    step = 2 * math.pi * pitch / AUDIO_SAMPLE_RATE
+    samples = b"".join(struct.pack("<h", int(8000 * math.sin(i * step))) for i in range(frames))
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(AUDIO_SAMPLE_RATE)
+        wav.writeframes(samples)
+
+
+class ArtifactFactory:
+    """Renders each artifact shape once, then hands out per-request copies."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._templates: Dict[Tuple, Path] = {}
+
+    def _path(self, kind: str, name: str) -> Path:
+        folder = self.root / kind
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder / name
+
+    def _template(self, key: Tuple, build: Callable[[Path], None], suffix: str) -> Path:
+        path = self._templates.get(key)
+        if path is None or not path.exists():
+            path = self._path("templates", "_".join(str(k) for k in key) + suffix)
+            build(path)
+            self._templates[key] = path
+        return path
+
+    def image(self, name: str, width: int, height: int) -> Path:
+        template = self._template(("img", width, height), lambda p: p.write_bytes(png_bytes(width, height, 96)), ".png")
+        out = self._path("images", f"{name}.png")
+        shutil.copyfile(template, out)
+        return out
+
+    def clip(self, name: str, fps: int, frames: int) -> Path:
+        width, height = (int(v) for v in CLIP_SIZE.lower().split("x"))
+
+        def build(path: Path) -> None:
+            # mpeg4 at the model resolution, like the cv2 mp4v clips img2vid writes, so mux re-encodes.
+            cmd = [
+                "ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi",
+                "-i", f"testsrc2=size={width}x{height}:rate={fps}", "-frames:v", str(frames),
+                "-c:v", "mpeg4", "-pix_fmt", "yuv420p", str(path),
+            ]
+            subprocess.run(cmd, check=True)
+
+        template = self._template(("clip", width, height, fps, frames), build, ".mp4")
+        out = self._path("clips", f"{name}.mp4")
+        shutil.copyfile(template, out)
+        return out
+
+    def narration(self, name: str, text: str) -> Path:
+        seconds = round(max(len(text), 1) / SPEECH_CPS, 1)
+        template = self._template(("wav", seconds), lambda p: write_wav(p, seconds, 220.0), ".wav")
+        out = self._path("audio", f"{name}.wav")
+        shutil.copyfile(template, out)
+        return out
+
+
+class StoryboardRequest(BaseModel):
+    story: str
+    style: Optional[str] = None
+    scenes: int = Field(6, gt=0, le=20)
+
+
+class ImageItem(BaseModel):
+    prompt: str
+    scene_id: Optional[str] = None
+
+
+class GenerateRequest(ImageItem):
+    style: Dict = Field(default_factory=dict)
+    job_id: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[ImageItem]
+    style: Dict = Field(default_factory=dict)
+    job_id: Optional[str] = None
+
+
+class Img2VidRequest(BaseModel):
+    frame: str
+    scene_id: Optional[str] = None
+    job_id: Optional[str] = None
+    fps: int = 12
+    num_frames: int = 16
+    artifact_id: Optional[str] = None
+
+
+class NarrationLine(BaseModel):
+    scene_id: str
+    text: str
+
+
+class NarrationRequest(BaseModel):
+    lines: List[NarrationLine]
+    speaker: Optional[str] = None
+    speed: float = 1.0
+
+
+def create_app(latency: str = "", capacity: str = "") -> FastAPI:
+    specs = {**parse_assignments(DEFAULT_LATENCY), **parse_assignments(latency or os.getenv("BENCH_LATENCY", ""))}
+    caps = {name: int(v) for name, v in parse_assignments(capacity or os.getenv("BENCH_CAPACITY", "")).items()}
+    services = {name: StubService(name, specs[name], caps.get(name, 1)) for name in SERVICES}
+    factory = ArtifactFactory(OUTPUT_DIR)
+    counter = iter(range(1, 1 << 62))
+    app = FastAPI(title="StoryToVideo benchmark stubs")
+
+    def _name(job_id: Optional[str], scene_id: Optional[str]) -> str:
+        return f"{job_id or 'adhoc'}_{scene_id or 's'}_{next(counter)}"
+
+    def _images(items: List[ImageItem], style: Dict, job_id: Optional[str]) -> List[Dict]:
+        width, height = int(style.get("width", 768)), int(style.get("height", 512))
+        return [
+            {
+                "path": str(factory.image(_name(job_id, item.scene_id), width, height)),
+                "seed": SEED + idx,
+                "scene_id": item.scene_id,
+            }
+            for idx, item in enumerate(items)
+        ]
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "seed": SEED, "services": {name: svc.stats() for name, svc in services.items()}}
+
+    @app.post("/llm/storyboard")
+    async def storyboard(req: StoryboardRequest):
+        await services["llm"].call()
+        return {
+            "storyboard": [
+                {
+                    "scene_id": f"s{idx}",
+                    "title": f"Scene {idx}",
+                    "prompt": f"{req.style or 'cinematic'} shot {idx} of: {req.story[:60]}",
+                    "narration": f"{req.story[:40]} ({idx}/{req.scenes})",
+                }
+                for idx in range(1, req.scenes + 1)
+            ]
+        }
+
+    @app.post("/txt2img/generate")
+    async def txt2img(req: GenerateRequest):
+        await services["txt2img"].call()
+        return {"images": await asyncio.to_thread(_images, [req], req.style, req.job_id)}
+
+    @app.post("/txt2img/generate_batch")
+    async def txt2img_batch(req: BatchRequest):
+        if not req.items:
+            raise HTTPException(status_code=400, detail="items is empty")
+        await services["txt2img"].call(units=len(req.items))
+        return {"images": await asyncio.to_thread(_images, req.items, req.style, req.job_id)}
+
+    @app.post("/img2vid/generate")
+    async def img2vid(req: Img2VidRequest):
+        if not Path(req.frame).exists():
+            raise HTTPException(status_code=404, detail=f"frame not found: {req.frame}")
+        await services["img2vid"].call()
+        path = await asyncio.to_thread(factory.clip, _name(req.job_id, req.scene_id), req.fps, req.num_frames)
+        return {"video": str(path), "fps": req.fps, "seed": SEED}
+
+    @app.post("/tts/narration")
+    async def narration(req: NarrationRequest):
+        if not req.lines:
+            raise HTTPException(status_code=400, detail="lines is empty")
+        audios = []
+        for line in req.lines:
+            await services["tts"].call()
+            path = await asyncio.to_thread(factory.narration, _name(None, line.scene_id), line.text)
+            audios.append({"scene_id": line.scene_id, "audio": str(path), "sample_rate": AUDIO_SAMPLE_RATE})
+        return {"audios": audios}
+
+    @app.post("/txt2img/cancel")
+    @app.post("/img2vid/cancel")
+    async def cancel(payload: Dict):
+        return {"job_id": payload.get("job_id"), "cancelled": True}
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,152 @@
+"""Async ffmpeg executor: bounded process pool, `-progress pipe:1` parsing, per-command timeouts."""
+
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+from model.tracing import tracer
+
+
+class FFmpegTimeoutError(RuntimeError):
+    """Raised when an ffmpeg command exceeds its timeout (the process is killed)."""
+
+
+class FFmpegRunner:
+    """Run at most `max_procs` ffmpeg processes at once as asyncio subprocesses.
+
+    Callers that pass `duration` (seconds of output expected) get `on_progress(fraction)`
+    calls parsed from ffmpeg's machine-readable progress stream. Cancelling the caller
+    or hitting the timeout kills the process. Every call is traced as an `ffmpeg` span, and
+    `on_finish(desc, seconds, outcome)` is told how long each process ran and whether it
+    ended "ok", "failed", "timeout" or "cancelled".
+    """
+
+    def __init__(
+        self,
+        max_procs: int,
+        timeout: float,
+        on_finish: Optional[Callable[[str, float, str], None]] = None,
+    ) -> None:
+        self.max_procs = max(1, max_procs)
+        self.timeout = timeout
+        self.on_finish = on_finish
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_procs)
+        return self._slots
+
+    @staticmethod
+    def _argv(cmd: List[str]) -> List[str]:
+        # Global options must precede the first input; -nostats keeps stderr for real errors.
+        return [cmd[0], "-nostdin", "-progress", "pipe:1", "-nostats", *cmd[1:]]
+
+    async def run(
+        self,
+        cmd: List[str],
+        desc: str,
+        duration: Optional[float] = None,
+        on_progress: Optional[Callable[[float], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        with tracer.start_as_current_span("ffmpeg", attributes={"ffmpeg.desc": desc, "ffmpeg.argv": " ".join(cmd)}) as span:
+            limit = self.timeout if timeout is None else timeout
+            self.waiting += 1
+            try:
+                await self._semaphore().acquire()
+            finally:
+                self.waiting -= 1
+            span.add_event("slot acquired")
+            self.running += 1
+            started = time.perf_counter()
+            outcome = "failed"
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *self._argv(cmd),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                stderr_task = asyncio.ensure_future(proc.stderr.read())
+                try:
+                    await asyncio.wait_for(self._drive(proc, duration, on_progress), limit if limit > 0 else None)
+                except asyncio.TimeoutError as exc:
+                    stderr_task.cancel()
+                    self.timeouts += 1
+                    outcome = "timeout"
+                    await self._kill(proc)
+                    raise FFmpegTimeoutError(f"{desc} timed out after {limit:g}s") from exc
+                except asyncio.CancelledError:
+                    stderr_task.cancel()
+                    outcome = "cancelled"
+                    await self._kill(proc)
+                    raise
+                stderr = await stderr_task
+                if proc.returncode != 0:
+                    self.failed += 1
+                    raise RuntimeError(f"{desc} failed: {stderr.decode(errors='replace').strip()[-2000:]}")
+                self.completed += 1
+                outcome = "ok"
+            finally:
+                self.running -= 1
+                self._semaphore().release()
+                span.set_attribute("ffmpeg.outcome", outcome)
+                if self.on_finish is not None:
+                    try:
+                        self.on_finish(desc, time.perf_counter() - started, outcome)
+                    except Exception as exc:  # noqa: BLE001
+                        print(f"[WARN] ffmpeg finish callback failed: {exc}")
+
+    @staticmethod
+    async def _kill(proc: asyncio.subprocess.Process) -> None:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+    @staticmethod
+    async def _drive(
+        proc: asyncio.subprocess.Process,
+        duration: Optional[float],
+        on_progress: Optional[Callable[[float], None]],
+    ) -> None:
+        """Consume `key=value` progress lines until EOF, then reap the process."""
+        last = -1.0
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                break
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if not on_progress or not duration:
+                continue
+            if key in ("out_time_us", "out_time_ms"):  # both are microseconds
+                try:
+                    fraction = min(1.0, max(0.0, int(value) / 1_000_000 / duration))
+                except ValueError:
+                    continue
+            elif key == "progress" and value == "end":
+                fraction = 1.0
+            else:
+                continue
+            if fraction - last >= 0.01 or (fraction == 1.0 and last < 1.0):
+                last = fraction
+                try:
+                    on_progress(fraction)
+                except Exception as exc:  # noqa: BLE001
+                    print(f"[WARN] ffmpeg progress callback failed: {exc}")
+        await proc.wait()
+
+    def stats(self) -> Dict:
+        return {
+            "max_procs": self.max_procs,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "timeout": self.timeout,
+        }
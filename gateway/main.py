@@ -3,24 +3,38 @@
 import asyncio
 import json
 import os
-import subprocess
+import time
 import uuid
-from collections import defaultdict
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 import httpx
-from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
+from gateway import media, metrics
+from gateway.ffmpeg import FFmpegRunner
+from gateway.progress import ProgressHub, Subscriber
+from gateway.scheduler import JobScheduler, QueueFullError
+from gateway.store import create_store
+from model import tracing
+
 # Downstream service endpoints (can be overridden via env)
 LLM_URL = os.getenv("LLM_URL", "http://127.0.0.1:8001/storyboard")
 TXT2IMG_URL = os.getenv("TXT2IMG_URL", "http://127.0.0.1:8002/generate")
 IMG2VID_URL = os.getenv("IMG2VID_URL", "http://127.0.0.1:8003/img2vid")
 TTS_URL = os.getenv("TTS_URL", "http://127.0.0.1:8004/narration")
+DOWNSTREAM_URLS: Dict[str, str] = {
+    "llm": LLM_URL,
+    "txt2img": TXT2IMG_URL,
+    "img2vid": IMG2VID_URL,
+    "tts": TTS_URL,
+}
 # Final outputs
 FINAL_DIR = Path(os.getenv("FINAL_DIR", "data/final"))
 TMP_DIR = FINAL_DIR / "tmp"
@@ -33,6 +47,7 @@ TASK_STATUS_PROCESSING = "processing"
 TASK_STATUS_FINISHED = "finished"
 TASK_STATUS_FAILED = "failed"
 TASK_STATUS_CANCELLED = "cancelled"
+TASK_TERMINAL_STATUSES = {TASK_STATUS_FINISHED, TASK_STATUS_FAILED, TASK_STATUS_CANCELLED}
 
 # Task types
 TASK_TYPE_STORYBOARD = "generate_storyboard"
@@ -40,7 +55,70 @@ TASK_TYPE_SHOT = "generate_shot"
 TASK_TYPE_AUDIO = "generate_audio"
 TASK_TYPE_VIDEO = "generate_video"
 
-# Very small in-memory task store. For production replace with Redis/DB.
+# Per-downstream concurrency caps shared by all running jobs (env override)
+SERVICE_CONCURRENCY: Dict[str, int] = {
+    "txt2img": int(os.getenv("TXT2IMG_CONCURRENCY", "2")),
+    "img2vid": int(os.getenv("IMG2VID_CONCURRENCY", "1")),
+    "tts": int(os.getenv("TTS_CONCURRENCY", "2")),
+    "ffmpeg": int(os.getenv("FFMPEG_CONCURRENCY", str(os.cpu_count() or 2))),
+}
+# Per-command ffmpeg timeout in seconds (0 disables)
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "600"))
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _pool_settings(name: str, default_timeout: str) -> Dict:
+    """Connection pool knobs for one downstream, e.g. TXT2IMG_MAX_CONNECTIONS / TXT2IMG_HTTP2."""
+    prefix = name.upper()
+    max_connections = int(os.getenv(f"{prefix}_MAX_CONNECTIONS", "16"))
+    return {
+        "max_connections": max_connections,
+        "max_keepalive_connections": int(os.getenv(f"{prefix}_MAX_KEEPALIVE", str(max_connections))),
+        "keepalive_expiry": float(os.getenv(f"{prefix}_KEEPALIVE_EXPIRY", "30")),
+        "http2": _env_flag(f"{prefix}_HTTP2"),
+        "timeout": float(os.getenv(f"{prefix}_TIMEOUT", default_timeout)),
+        "connect_timeout": float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", "10")),
+    }
+
+
+# Long-lived client pool per downstream; img2vid keeps its historical IMG2VID_TIMEOUT default
+POOL_SETTINGS: Dict[str, Dict] = {
+    "llm": _pool_settings("llm", "600"),
+    "txt2img": _pool_settings("txt2img", "600"),
+    "img2vid": _pool_settings("img2vid", "120"),
+    "tts": _pool_settings("tts", "600"),
+}
+# Task/project persistence: "sqlite" (durable, WAL) or "memory"; progress writes are flushed in batches
+GATEWAY_STORE = os.getenv("GATEWAY_STORE", "sqlite")
+GATEWAY_DB = os.getenv("GATEWAY_DB", "state/gateway.db")
+RESUME_ON_STARTUP = _env_flag("RESUME_ON_STARTUP", "1")
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", "1.0"))
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", "1024"))
+# Job scheduler: concurrent orchestrations, max waiting jobs, default priority (lower runs first)
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+JOB_DEFAULT_PRIORITY = 5
+# Relative weight of each per-scene stage inside the 10..90 progress window of a full render
+STAGE_WEIGHTS: Dict[str, int] = {"image": 1, "video": 2, "audio": 1, "mux": 1}
+STAGE_LABELS: Dict[str, str] = {"image": "Images", "video": "Videos", "audio": "TTS", "mux": "Mux"}
+# On cancel, ask the diffusion services to stop at their next denoising step (POST <service>/cancel)
+CANCEL_SIGNAL_SERVICES = _env_flag("CANCEL_SIGNAL_SERVICES", "1")
+CANCEL_URLS: Dict[str, str] = {
+    name: os.getenv(f"{name.upper()}_CANCEL_URL", url.rsplit("/", 1)[0] + "/cancel")
+    for name, url in (("txt2img", TXT2IMG_URL), ("img2vid", IMG2VID_URL))
+}
+# Stamp downstream requests with a deadline (now + pool timeout) so model services drop work we gave up on
+SEND_DEADLINES = _env_flag("SEND_DEADLINES", "1")
+# Keyframes of a full render are requested in one /generate_batch call (TXT2IMG_BATCH=0: one call per scene)
+TXT2IMG_BATCH = _env_flag("TXT2IMG_BATCH", "1")
+TXT2IMG_BATCH_URL = os.getenv("TXT2IMG_BATCH_URL", TXT2IMG_URL.rsplit("/", 1)[0] + "/generate_batch")
+# Seconds DELETE /v1/api/jobs/{id} waits for the running job to unwind before answering
+CANCEL_GRACE_SECONDS = float(os.getenv("CANCEL_GRACE_SECONDS", "5"))
+
+# Task state as persisted in gateway.store and cached in `tasks`.
 class TaskState(BaseModel):
     id: str
     project_id: Optional[str] = None
@@ -52,23 +130,88 @@ class TaskState(BaseModel):
     result: Optional[Dict] = None
     error: Optional[str] = None
     estimatedDuration: int = 0
+    waitSeconds: Optional[float] = None
+    job: Optional[Dict] = None  # serialized (type, ctx) so the job can be re-queued after a restart
+    checkpoint: Optional[Dict] = None  # per-scene artifact manifest, see _record_artifact
     startedAt: Optional[str] = None
     finishedAt: Optional[str] = None
     createdAt: Optional[str] = None
     updatedAt: Optional[str] = None
 
 
+store = create_store(GATEWAY_STORE, GATEWAY_DB)
+# Hot cache of task state in front of `store`; finished tasks are evicted first when it overflows.
 tasks: Dict[str, TaskState] = {}
-progress_subs: Dict[str, List[asyncio.Queue]] = defaultdict(list)
-# Very small in-memory project/shot store to satisfy spec endpoints
-projects: Dict[str, Dict] = {}
-project_shots: Dict[str, Dict[str, Dict]] = defaultdict(dict)
+# SSE/WebSocket fan-out; each subscriber only keeps the newest undelivered snapshot
+progress_hub = ProgressHub(TASK_CACHE_SIZE)
+_background: List[asyncio.Task] = []
+# Set when a durable write is buffered so the flush task commits without waiting out STORE_FLUSH_INTERVAL;
+# futures in _flush_waiters resolve once that commit lands.
+_flush_wanted = asyncio.Event()
+_flush_waiters: List[asyncio.Future] = []
+_service_slots: Dict[str, asyncio.Semaphore] = {}
+_clients: Dict[str, httpx.AsyncClient] = {}
+# asyncio task of every running orchestration, so DELETE can cancel it
+_job_tasks: Dict[str, asyncio.Task] = {}
+# Keyframe path -> txt2img artifact_id, forwarded to img2vid so a shared model node skips the PNG round trip
+_frame_artifacts: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _ffmpeg_finished(desc: str, seconds: float, outcome: str) -> None:
+    # desc reads "mux s2" / "concat videos" / "fallback video for s1"; the first word is the operation.
+    metrics.FFMPEG_SECONDS.labels(desc.split()[0], outcome).observe(seconds)
+
+
+# Every ffmpeg invocation goes through this pool (FFMPEG_CONCURRENCY processes at most)
+ffmpeg_runner = FFmpegRunner(SERVICE_CONCURRENCY["ffmpeg"], FFMPEG_TIMEOUT, on_finish=_ffmpeg_finished)
 
 
 def _now_iso() -> str:
     return datetime.utcnow().isoformat()
 
 
+def _cache_task(state: TaskState) -> None:
+    tasks[state.id] = state
+    if len(tasks) <= TASK_CACHE_SIZE:
+        return
+    for task_id, cached in list(tasks.items()):
+        if cached.status in TASK_TERMINAL_STATUSES:
+            tasks.pop(task_id, None)
+            break
+
+
+def _get_task(task_id: str) -> Optional[TaskState]:
+    state = tasks.get(task_id)
+    if state is None:
+        row = store.get_task(task_id)
+        if row is None:
+            return None
+        state = TaskState(**row)
+        _cache_task(state)
+    return state
+
+
+def _save_task(state: TaskState, durable: bool = False) -> None:
+    """Cache and buffer the row; durable writes wake the flush task instead of committing on the loop."""
+    _cache_task(state)
+    store.save_task(state.dict())
+    if durable:
+        _flush_wanted.set()
+
+
+async def _commit_tasks() -> None:
+    """Wait until every task row buffered so far has been committed by the flush task."""
+    done = asyncio.get_running_loop().create_future()
+    _flush_waiters.append(done)
+    _flush_wanted.set()
+    await done
+
+
+async def _drop_task(task_id: str) -> None:
+    tasks.pop(task_id, None)
+    await asyncio.to_thread(store.delete_task, task_id)
+
+
 def _make_shot(project_id: str, order: int, shot_id: Optional[str] = None, title: str = "", prompt: str = "", transition: str = "") -> Dict:
     shot_id = shot_id or str(uuid.uuid4())
     now = _now_iso()
@@ -100,6 +243,7 @@ class RenderRequest(BaseModel):
     video_frames: int = Field(16, ge=8, le=64)
     speaker: Optional[str] = Field(None, description="TTS 说话人")
     speed: float = Field(1.0, ge=0.5, le=2.0, description="TTS 语速")
+    priority: int = Field(JOB_DEFAULT_PRIORITY, ge=0, le=9, description="调度优先级，数值越小越先执行")
 
 
 class RenderResponse(BaseModel):
@@ -120,6 +264,8 @@ class TaskSchema(BaseModel):
     result: Dict = Field(default_factory=dict)
     error: str = ""
     estimatedDuration: int = 0
+    queuePosition: Optional[int] = None
+    waitSeconds: Optional[float] = None
     startedAt: Optional[str] = None
     finishedAt: Optional[str] = None
     createdAt: Optional[str] = None
@@ -138,6 +284,8 @@ def _as_task_schema(state: TaskState) -> TaskSchema:
         result=state.result or {},
         error=state.error or "",
         estimatedDuration=state.estimatedDuration,
+        queuePosition=scheduler.position(state.id),
+        waitSeconds=state.waitSeconds if state.waitSeconds is not None else scheduler.wait_seconds(state.id),
         startedAt=state.startedAt,
         finishedAt=state.finishedAt,
         createdAt=state.createdAt,
@@ -191,6 +339,7 @@ class GeneratePayload(BaseModel):
     result: Optional[Dict] = None
     error: Optional[str] = None
     estimatedDuration: Optional[int] = None
+    priority: Optional[int] = Field(None, ge=0, le=9)
     startedAt: Optional[str] = None
     finishedAt: Optional[str] = None
     createdAt: Optional[str] = None
@@ -206,102 +355,606 @@ class TaskResponse(BaseModel):
     error: Optional[str] = None
 
 
+tracing.setup("s2v-gateway")
 app = FastAPI(title="StoryToVideo Gateway", version="0.1.0")
 STATIC_ROOT = Path(os.getenv("STATIC_ROOT", "data")).resolve()
 STATIC_ROOT.mkdir(parents=True, exist_ok=True)
 app.mount("/files", StaticFiles(directory=STATIC_ROOT), name="files")
+app.add_middleware(tracing.TraceMiddleware)
+
+
+@app.middleware("http")
+async def _count_requests(request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, so job ids don't explode the series count.
+        endpoint = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.REQUESTS.labels(request.method, endpoint, str(status)).inc()
+        metrics.REQUEST_SECONDS.labels(request.method, endpoint).observe(time.perf_counter() - start)
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    cfg = POOL_SETTINGS[name]
+    limits = httpx.Limits(
+        max_connections=cfg["max_connections"],
+        max_keepalive_connections=cfg["max_keepalive_connections"],
+        keepalive_expiry=cfg["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(cfg["timeout"], connect=cfg["connect_timeout"])
+    try:
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=cfg["http2"])
+    except ImportError:
+        # http2=True needs the optional `h2` package; keep serving over HTTP/1.1.
+        print(f"[WARN] HTTP/2 unavailable for {name} (pip install httpx[http2]); using HTTP/1.1")
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def _client(name: str) -> httpx.AsyncClient:
+    """Shared pooled client for a downstream service, created on first use if startup hasn't run."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client(name)
+        _clients[name] = client
+    return client
+
+
+def _pool_occupancy(client: httpx.AsyncClient) -> Optional[Tuple[int, int]]:
+    """(connections, idle) from the httpcore pool, or None when httpx internals don't look as expected.
+
+    httpx has no public API for pool occupancy, so every private attribute is looked up defensively
+    and an upgrade that moves them degrades to "unknown" rather than reporting zeros.
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    conns = getattr(pool, "connections", None)
+    if conns is None:
+        return None
+    try:
+        conns = list(conns)
+        idle = sum(1 for conn in conns if conn.is_idle())
+    except Exception:  # noqa: BLE001
+        return None
+    return len(conns), idle
+
+
+def _pool_stats(name: str) -> Dict:
+    cfg = POOL_SETTINGS[name]
+    stats = {
+        "url": DOWNSTREAM_URLS[name],
+        "max_connections": cfg["max_connections"],
+        "keepalive_expiry": cfg["keepalive_expiry"],
+        "http2": cfg["http2"],
+        "timeout": cfg["timeout"],
+        "connections": 0,
+        "active": 0,
+        "idle": 0,
+    }
+    client = _clients.get(name)
+    if client is None:
+        return stats
+    occupancy = _pool_occupancy(client)
+    if occupancy is None:
+        stats.update(connections="unknown", idle="unknown", active="unknown")
+        return stats
+    total, idle = occupancy
+    stats.update(connections=total, idle=idle, active=total - idle)
+    return stats
+
+
+@app.on_event("startup")
+async def _startup_clients() -> None:
+    for name in DOWNSTREAM_URLS:
+        _client(name)
+
+
+async def _flush_store_loop() -> None:
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wanted.wait(), STORE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wanted.clear()
+        waiters = _flush_waiters[:]
+        _flush_waiters.clear()
+        try:
+            await asyncio.to_thread(store.flush)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] task store flush failed: {exc}")
+            for done in waiters:
+                if not done.done():
+                    done.set_exception(exc)
+        else:
+            for done in waiters:
+                if not done.done():
+                    done.set_result(None)
+
+
+@app.on_event("startup")
+async def _startup_store() -> None:
+    # Jobs that were queued or running when the previous process died: resume from their
+    # checkpoint when possible, otherwise mark them failed.
+    for task_id in store.task_ids_by_status([TASK_STATUS_PENDING, TASK_STATUS_PROCESSING]):
+        state = _get_task(task_id)
+        if RESUME_ON_STARTUP and state is not None and state.job:
+            try:
+                await _resume_job(state)
+                continue
+            except HTTPException:
+                pass
+        _update_task(
+            task_id,
+            status=TASK_STATUS_FAILED,
+            message="interrupted by gateway restart",
+            error="interrupted by gateway restart",
+            finishedAt=_now_iso(),
+        )
+    _background.append(asyncio.ensure_future(_flush_store_loop()))
+
+
+@app.on_event("startup")
+async def _startup_scheduler() -> None:
+    scheduler.start()
+
+
+@app.on_event("shutdown")
+async def _shutdown_scheduler() -> None:
+    await scheduler.stop()
+
+
+@app.on_event("shutdown")
+async def _shutdown_clients() -> None:
+    for name, client in list(_clients.items()):
+        await client.aclose()
+        _clients.pop(name, None)
+
+
+@app.on_event("shutdown")
+async def _shutdown_store() -> None:
+    for job in _background:
+        job.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    _background.clear()
+    store.close()
 
 
 @app.get("/health")
-async def health() -> Dict[str, str]:
+async def health() -> Dict:
     return {
         "status": "ok",
         "llm": LLM_URL,
         "txt2img": TXT2IMG_URL,
         "img2vid": IMG2VID_URL,
         "tts": TTS_URL,
+        "pools": {name: _pool_stats(name) for name in DOWNSTREAM_URLS},
+        "scheduler": scheduler.stats(),
+        "ffmpeg": ffmpeg_runner.stats(),
+        "progress": progress_hub.stats(),
     }
 
 
-async def _call_json_api(client: httpx.AsyncClient, url: str, payload: Dict, timeout: float = 600.0) -> Dict:
-    resp = await client.post(url, json=payload, timeout=timeout)
+@app.get("/metrics")
+async def metrics_endpoint():
+    return metrics.metrics_response()
+
+
+class DownstreamError(HTTPException):
+    """A model service answered with an error status; reported as 500, `upstream_status` keeps the original."""
+
+    def __init__(self, url: str, upstream_status: int, text: str) -> None:
+        super().__init__(status_code=500, detail=f"API {url} failed: {upstream_status} {text}")
+        self.upstream_status = upstream_status
+
+
+async def _call_json_api(service: str, payload: Dict, url: Optional[str] = None) -> Dict:
+    url = url or DOWNSTREAM_URLS[service]
+    if SEND_DEADLINES:
+        payload = {**payload, "deadline": time.time() + POOL_SETTINGS[service]["timeout"]}
+    start = time.perf_counter()
+    with tracing.tracer.start_as_current_span(
+        f"POST {service}", kind=tracing.SpanKind.CLIENT, attributes={"http.url": url}
+    ) as span:
+        try:
+            resp = await _client(service).post(url, json=payload, headers=tracing.inject())
+        except Exception:
+            metrics.DOWNSTREAM_SECONDS.labels(service, "error").observe(time.perf_counter() - start)
+            raise
+        span.set_attribute("http.status_code", resp.status_code)
+    metrics.DOWNSTREAM_SECONDS.labels(service, str(resp.status_code)).observe(time.perf_counter() - start)
     if resp.status_code >= 400:
-        raise HTTPException(status_code=500, detail=f"API {url} failed: {resp.status_code} {resp.text}")
+        raise DownstreamError(url, resp.status_code, resp.text)
     try:
         return resp.json()
     except json.JSONDecodeError as exc:  # pragma: no cover
         raise HTTPException(status_code=500, detail=f"API {url} returned non-JSON: {resp.text}") from exc
 
 
-def _run_ffmpeg(cmd: List[str], desc: str) -> None:
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if proc.returncode != 0:
-        raise RuntimeError(f"{desc} failed: {proc.stderr.strip()}")
-
-
 def _update_task(task_id: str, **kwargs) -> None:
-    state = tasks.get(task_id)
+    state = _get_task(task_id)
     if not state:
         return
+    if state.status == TASK_STATUS_CANCELLED and "status" not in kwargs:
+        return  # late progress from a job that is still unwinding
+    if kwargs.get("status") in TASK_TERMINAL_STATUSES and state.status not in TASK_TERMINAL_STATUSES:
+        metrics.JOBS.labels(kwargs["status"]).inc()
     for k, v in kwargs.items():
         setattr(state, k, v)
     state.updatedAt = datetime.utcnow().isoformat()
-    tasks[task_id] = state
-    if progress_subs.get(task_id):
-        payload = _as_task_schema(state).dict(exclude_none=True)
-        for q in list(progress_subs[task_id]):
-            try:
-                q.put_nowait(payload)
-            except Exception:
-                pass
-
-
-def _frame_to_video_fallback(frame_path: str, scene_id: str, fps: int, num_frames: int) -> Path:
-    """If img2vid service is slow/unavailable, fallback to a static video via ffmpeg."""
+    # Status transitions hit disk immediately; progress/message ticks ride the batched flush.
+    _save_task(state, durable="status" in kwargs)
+    progress_hub.publish(task_id, lambda: _as_task_schema(state).dict(exclude_none=True))
+
+
+async def _frame_to_video_fallback(
+    task_id: str,
+    frame_path: str,
+    scene_id: str,
+    fps: int,
+    num_frames: int,
+    width: int,
+    height: int,
+    on_progress: Optional[Callable[[float], None]] = None,
+) -> Path:
+    """If img2vid service is slow/unavailable, fallback to a static video via ffmpeg.
+
+    The clip is encoded straight to the assembly target so the mux step can copy it.
+    """
     CLIPS_DIR.mkdir(parents=True, exist_ok=True)
-    out = CLIPS_DIR / f"{scene_id}_fallback.mp4"
+    out = CLIPS_DIR / f"{task_id}_{scene_id}_fallback.mp4"
     duration = max(num_frames / max(fps, 1), 0.5)
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-loop",
-        "1",
-        "-t",
-        f"{duration:.2f}",
-        "-i",
-        frame_path,
-        "-vf",
-        f"fps={fps}",
-        "-c:v",
-        "libx264",
-        "-pix_fmt",
-        "yuv420p",
-        "-movflags",
-        "+faststart",
-        str(out),
-    ]
-    _run_ffmpeg(cmd, f"fallback video for {scene_id}")
+    cmd = media.still_command(frame_path, str(out), duration, width, height, fps)
+    await ffmpeg_runner.run(cmd, f"fallback video for {scene_id}", duration=duration, on_progress=on_progress)
     return out
 
 
-async def _task_event_stream(task_id: str):
-    queue: asyncio.Queue = asyncio.Queue()
-    progress_subs[task_id].append(queue)
-    # push current state immediately if exists
-    current = tasks.get(task_id)
-    if current:
-        await queue.put(_as_task_schema(current).dict(exclude_none=True))
+def _subscribe_task(task_id: str, last_event_id: Optional[int]) -> Subscriber:
+    """Register a subscriber primed with the current snapshot, unless the client already has it."""
+    sub = progress_hub.subscribe(task_id)
+    latest = progress_hub.latest(task_id)
+    if latest is None:
+        state = _get_task(task_id)
+        if state is not None:
+            progress_hub.publish(task_id, lambda: _as_task_schema(state).dict(exclude_none=True))
+    elif last_event_id is None or latest.id > last_event_id:
+        sub.offer(latest)
+    return sub
+
+
+def _parse_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def _task_event_stream(task_id: str, last_event_id: Optional[int] = None):
+    sub = _subscribe_task(task_id, last_event_id)
     try:
         while True:
-            try:
-                data = await asyncio.wait_for(queue.get(), timeout=15.0)
-                yield f"data: {json.dumps(data)}\n\n"
-            except asyncio.TimeoutError:
+            event = await sub.next(timeout=15.0)
+            if event is None:
                 # keep-alive ping
                 yield "event: ping\ndata: {}\n\n"
+            else:
+                yield f"id: {event.id}\ndata: {event.data}\n\n"
     finally:
-        if queue in progress_subs.get(task_id, []):
-            progress_subs[task_id].remove(queue)
+        progress_hub.unsubscribe(task_id, sub)
+
+
+def _service_slot(name: str) -> asyncio.Semaphore:
+    """Return the process-wide semaphore capping concurrent calls to one downstream."""
+    sem = _service_slots.get(name)
+    if sem is None:
+        sem = asyncio.Semaphore(max(1, SERVICE_CONCURRENCY.get(name, 1)))
+        _service_slots[name] = sem
+    return sem
+
+
+class _StageProgress:
+    """Fold per-scene stage completions into one monotonic task progress value."""
+
+    def __init__(self, task_id: str, total: int, start: int = 10, end: int = 90) -> None:
+        self.task_id = task_id
+        self.total = max(total, 1)
+        self.start = start
+        self.end = end
+        self.done: Dict[str, int] = {stage: 0 for stage in STAGE_WEIGHTS}
+        # (stage, scene_id) -> fraction for stages reporting live progress (ffmpeg encodes)
+        self.partial: Dict[tuple, float] = {}
+        self.progress = start
+
+    def _progress(self) -> int:
+        total_units = sum(STAGE_WEIGHTS.values()) * self.total
+        done_units = sum(STAGE_WEIGHTS[name] * count for name, count in self.done.items())
+        done_units += sum(STAGE_WEIGHTS[stage] * frac for (stage, _), frac in self.partial.items())
+        # Never step backwards, e.g. when a partially encoded clip is retried.
+        self.progress = max(self.progress, self.start + int((self.end - self.start) * done_units / total_units))
+        return self.progress
+
+    def mark(self, stage: str, scene_id: Optional[str] = None) -> None:
+        self.partial.pop((stage, scene_id), None)
+        self.done[stage] += 1
+        _update_task(self.task_id, progress=self._progress(), message=f"{STAGE_LABELS[stage]} {self.done[stage]}/{self.total}")
+
+    def partial_update(self, stage: str, scene_id: str) -> Callable[[float], None]:
+        """Progress callback for one scene's in-flight stage."""
+
+        def _update(fraction: float) -> None:
+            self.partial[(stage, scene_id)] = fraction
+            before = self.progress
+            if self._progress() != before:
+                _update_task(self.task_id, progress=self.progress, message=f"{STAGE_LABELS[stage]} {scene_id} {int(fraction * 100)}%")
+
+        return _update
+
+
+async def _gather_or_cancel(coros) -> List:
+    """Run coroutines concurrently; on the first failure cancel the rest and re-raise."""
+    pending = [asyncio.ensure_future(c) for c in coros]
+    try:
+        return await asyncio.gather(*pending)
+    except BaseException:
+        for fut in pending:
+            fut.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        raise
+
+
+def _scene_id(item: Dict, idx: int) -> str:
+    return item.get("scene_id") or item.get("id") or f"s{idx+1}"
+
+
+def _image_style(req: RenderRequest) -> Dict:
+    return {
+        "width": req.width,
+        "height": req.height,
+        "num_inference_steps": req.img_steps,
+        "guidance_scale": req.cfg_scale,
+    }
+
+
+def _scene_prompt(item: Dict) -> str:
+    return item.get("prompt") or item.get("description") or ""
+
+
+def _frame_path(image: Dict) -> str:
+    """Keyframe path from a txt2img result, remembering its in-process artifact id if any."""
+    path = image["path"]
+    if image.get("artifact_id"):
+        _frame_artifacts[path] = image["artifact_id"]
+        while len(_frame_artifacts) > TASK_CACHE_SIZE:
+            _frame_artifacts.popitem(last=False)
+    return path
+
+
+async def _scene_frame(task_id: str, req: RenderRequest, scene_id: str, prompt: str) -> str:
+    payload_img = {
+        "prompt": prompt,
+        "scene_id": scene_id,
+        "job_id": task_id,
+        "style": _image_style(req),
+    }
+    async with _service_slot("txt2img"):
+        img_data = await _call_json_api("txt2img", payload_img)
+    images = img_data.get("images") or []
+    if not images:
+        raise RuntimeError(f"No image for scene {scene_id}")
+    return _frame_path(images[0])
+
+
+async def _scene_frames(task_id: str, req: RenderRequest, scenes: List[tuple]) -> Dict[str, str]:
+    """Keyframes for several (scene_id, prompt) pairs in one batched txt2img call.
+
+    Falls back to one /generate call per scene only when the batch endpoint is missing (404/405)
+    or unreachable, i.e. an older service; cancellation (409), deadlines (504) and model errors propagate.
+    """
+    payload = {
+        "items": [{"prompt": prompt, "scene_id": scene_id} for scene_id, prompt in scenes],
+        "style": _image_style(req),
+        "job_id": task_id,
+    }
+    try:
+        async with _service_slot("txt2img"):
+            data = await _call_json_api("txt2img", payload, url=TXT2IMG_BATCH_URL)
+        images = data.get("images") or []
+        if len(images) != len(scenes):
+            raise RuntimeError(f"txt2img batch returned {len(images)} images for {len(scenes)} scenes")
+        return {scene_id: _frame_path(image) for (scene_id, _), image in zip(scenes, images)}
+    except DownstreamError as exc:
+        if exc.upstream_status not in (404, 405):
+            raise
+        print(f"[WARN] txt2img has no batch endpoint, falling back to per-scene calls for {task_id}: {exc.detail}")
+    except httpx.ConnectError as exc:
+        print(f"[WARN] batched keyframes failed for {task_id}, falling back to per-scene calls: {exc}")
+    paths = await _gather_or_cancel(_scene_frame(task_id, req, scene_id, prompt) for scene_id, prompt in scenes)
+    return {scene_id: path for (scene_id, _), path in zip(scenes, paths)}
+
+
+async def _scene_clip(task_id: str, req: RenderRequest, scene_id: str, frame_path: str, tracker: _StageProgress) -> str:
+    payload_vid = {
+        "frame": frame_path,
+        "scene_id": scene_id,
+        "job_id": task_id,
+        "fps": req.fps,
+        "num_frames": req.video_frames,
+    }
+    artifact_id = _frame_artifacts.pop(frame_path, None)
+    if artifact_id:
+        payload_vid["artifact_id"] = artifact_id
+    try:
+        async with _service_slot("img2vid"):
+            vid_data = await _call_json_api("img2vid", payload_vid)
+        video = vid_data.get("video")
+        if not video:
+            raise RuntimeError(f"No video for scene {scene_id}")
+    except Exception:
+        # Fallback: generate static video locally to keep pipeline moving.
+        fallback = await _frame_to_video_fallback(
+            task_id,
+            frame_path,
+            scene_id,
+            req.fps,
+            req.video_frames,
+            req.width,
+            req.height,
+            on_progress=tracker.partial_update("video", scene_id),
+        )
+        video = str(fallback)
+    return video
+
+
+async def _scene_audio(req: RenderRequest, scene_id: str, text: str) -> Dict:
+    payload_tts = {"lines": [{"scene_id": scene_id, "text": text}], "speaker": req.speaker or None, "speed": req.speed}
+    async with _service_slot("tts"):
+        tts_data = await _call_json_api("tts", payload_tts)
+    audios = tts_data.get("audios") or []
+    if len(audios) != 1:
+        raise RuntimeError(f"TTS count mismatch for scene {scene_id}")
+    return audios[0]
+
+
+async def _mux_scene(
+    task_id: str, req: RenderRequest, scene_id: str, video: str, audio: str, tracker: _StageProgress
+) -> Path:
+    """Mux clip + narration into a segment normalized for stream-copy concat.
+
+    The video is only re-encoded when the clip doesn't already match the target codec/size/fps.
+    """
+    out_clip = TMP_DIR / f"{task_id}_{scene_id}_mux.mp4"
+    probe = await asyncio.to_thread(media.probe_media, video)
+    copy_video = not media.ASSEMBLY_NORMALIZE or media.matches_target(probe, req.width, req.height, req.fps)
+    cmd = media.mux_command(video, audio, str(out_clip), req.width, req.height, req.fps, copy_video)
+    await ffmpeg_runner.run(
+        cmd,
+        f"mux {scene_id}",
+        duration=(probe or {}).get("duration"),
+        on_progress=tracker.partial_update("mux", scene_id),
+    )
+    return out_clip
+
+
+async def _concat_segments(task_id: str, segments: List[Path], final_path: Path) -> None:
+    """Stream-copy the segments when ffprobe confirms identical parameters, else re-encode once."""
+    list_file = TMP_DIR / f"concat_{task_id}.txt"
+    with list_file.open("w", encoding="utf-8") as f:
+        for path in segments:
+            f.write(f"file '{path.resolve().as_posix()}'\n")
+    probes = await asyncio.gather(*(asyncio.to_thread(media.probe_media, str(path)) for path in segments))
+    total = sum((probe or {}).get("duration") or 0.0 for probe in probes)
+
+    def _on_progress(fraction: float) -> None:
+        _update_task(task_id, progress=90 + int(9 * fraction), message=f"Concat {int(fraction * 100)}%")
+
+    if media.can_stream_copy(list(probes)):
+        try:
+            cmd = media.concat_command(str(list_file), str(final_path), True)
+            await ffmpeg_runner.run(cmd, "concat videos", duration=total, on_progress=_on_progress)
+            return
+        except RuntimeError as exc:
+            print(f"[WARN] stream-copy concat failed for {task_id}, re-encoding: {exc}")
+    cmd = media.concat_command(str(list_file), str(final_path), False)
+    await ffmpeg_runner.run(cmd, "concat videos", duration=total, on_progress=_on_progress)
+
+
+def _stage_time(timings: Dict, stage: str, started: float) -> None:
+    """Store a stage's wall time in the task's `result.timings` and the stage histogram."""
+    seconds = round(time.perf_counter() - started, 3)
+    timings[stage] = seconds
+    metrics.STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def _stage(timings: Dict, stage: str, **attributes):
+    """Trace one pipeline stage as a span; when it succeeds, record its wall time like `_stage_time`."""
+    started = time.perf_counter()
+    with tracing.tracer.start_as_current_span(stage, attributes=attributes):
+        yield
+    _stage_time(timings, stage, started)
+
+
+def _artifact_ok(path: Optional[str]) -> bool:
+    return bool(path) and Path(path).exists()
+
+
+def _record_artifact(task_id: str, scene_id: Optional[str], stage: str, value) -> None:
+    """Write one finished stage output into the task's checkpoint manifest (durably).
+
+    Manifest layout: {"storyboard": [...], "scenes": {scene_id: {"frame", "clip", "audio", "mux"}}}.
+    """
+    state = _get_task(task_id)
+    if state is None:
+        return
+    manifest = state.checkpoint or {}
+    if scene_id is None:
+        manifest[stage] = value
+    else:
+        manifest.setdefault("scenes", {}).setdefault(scene_id, {})[stage] = value
+    state.checkpoint = manifest
+    _save_task(state, durable=True)
+
+
+async def _render_scene(
+    task_id: str,
+    req: RenderRequest,
+    idx: int,
+    item: Dict,
+    tracker: _StageProgress,
+    done: Dict,
+    times: Dict,
+    frames: Optional[asyncio.Future] = None,
+) -> Path:
+    """One scene of the render DAG: keyframe -> clip, narration alongside, then mux.
+
+    `done` is this scene's checkpoint entry; stages whose artifact still exists are skipped.
+    `times` collects the seconds each stage that actually ran took (image/video/audio/mux).
+    `frames` is the storyboard-wide keyframe batch (scene_id -> path), when one was started.
+    """
+    scene_id = _scene_id(item, idx)
+    prompt = _scene_prompt(item)
+    text = item.get("narration") or item.get("prompt") or ""
+    if _artifact_ok(done.get("mux")):
+        for stage in STAGE_WEIGHTS:
+            tracker.mark(stage)
+        return Path(done["mux"])
+
+    async def _audio() -> str:
+        audio_path = done.get("audio")
+        if not _artifact_ok(audio_path):
+            with _stage(times, "audio", scene_id=scene_id):
+                audio_path = (await _scene_audio(req, scene_id, text))["audio"]
+            _record_artifact(task_id, scene_id, "audio", audio_path)
+        tracker.mark("audio")
+        return audio_path
+
+    audio_task = asyncio.ensure_future(_audio())
+    try:
+        video = done.get("clip")
+        if not _artifact_ok(video):
+            frame_path = done.get("frame")
+            if not _artifact_ok(frame_path):
+                with _stage(times, "image", scene_id=scene_id):
+                    batched = (await asyncio.shield(frames)) if frames is not None else {}
+                    frame_path = batched.get(scene_id) or await _scene_frame(task_id, req, scene_id, prompt)
+                _record_artifact(task_id, scene_id, "frame", frame_path)
+            tracker.mark("image")
+            with _stage(times, "video", scene_id=scene_id):
+                video = await _scene_clip(task_id, req, scene_id, frame_path, tracker)
+            _record_artifact(task_id, scene_id, "clip", video)
+        else:
+            tracker.mark("image")
+        tracker.mark("video", scene_id)
+        audio_path = await audio_task
+    except BaseException:
+        audio_task.cancel()
+        raise
+    with _stage(times, "mux", scene_id=scene_id):
+        out_clip = await _mux_scene(task_id, req, scene_id, video, audio_path, tracker)
+    _record_artifact(task_id, scene_id, "mux", str(out_clip))
+    tracker.mark("mux", scene_id)
+    return out_clip
 
 
 async def _orchestrate(task_id: str, task_type: str, ctx: Dict) -> None:
@@ -321,13 +974,15 @@ async def _orchestrate(task_id: str, task_type: str, ctx: Dict) -> None:
     story: str = ctx.get("story") or ""
     style: str = ctx.get("style") or ""
     scenes: int = ctx.get("scenes") or 1
+    # Full-video runs fill this in stage by stage; it lands in result["timings"], also on failure.
+    timings: Dict = {}
+    pipeline_start = time.perf_counter()
 
     try:
         # --- Storyboard only ---
         if task_type == TASK_TYPE_STORYBOARD:
-            async with httpx.AsyncClient() as client:
-                payload_sb = {"story": story, "style": style, "scenes": scenes}
-                sb_data = await _call_json_api(client, LLM_URL, payload_sb)
+            payload_sb = {"story": story, "style": style, "scenes": scenes}
+            sb_data = await _call_json_api("llm", payload_sb)
             storyboard = sb_data.get("storyboard") or sb_data.get("shots") or []
             _update_task(
                 task_id,
@@ -341,18 +996,18 @@ async def _orchestrate(task_id: str, task_type: str, ctx: Dict) -> None:
 
         # --- Shot (txt2img) only ---
         if task_type == TASK_TYPE_SHOT:
-            async with httpx.AsyncClient() as client:
-                payload_img = {
-                    "prompt": prompt_text or story,
-                    "scene_id": "s1",
-                    "style": {
-                        "width": render_req.width if render_req else 768,
-                        "height": render_req.height if render_req else 512,
-                        "num_inference_steps": render_req.img_steps if render_req else 4,
-                        "guidance_scale": render_req.cfg_scale if render_req else 1.5,
-                    },
-                }
-                img_data = await _call_json_api(client, TXT2IMG_URL, payload_img)
+            payload_img = {
+                "prompt": prompt_text or story,
+                "scene_id": "s1",
+                "job_id": task_id,
+                "style": {
+                    "width": render_req.width if render_req else 768,
+                    "height": render_req.height if render_req else 512,
+                    "num_inference_steps": render_req.img_steps if render_req else 4,
+                    "guidance_scale": render_req.cfg_scale if render_req else 1.5,
+                },
+            }
+            img_data = await _call_json_api("txt2img", payload_img)
             images = img_data.get("images") or []
             _update_task(
                 task_id,
@@ -367,13 +1022,12 @@ async def _orchestrate(task_id: str, task_type: str, ctx: Dict) -> None:
         # --- Audio (tts) only ---
         if task_type == TASK_TYPE_AUDIO:
             text = prompt_text or story
-            async with httpx.AsyncClient() as client:
-                payload_tts = {
-                    "lines": [{"scene_id": "s1", "text": text}],
-                    "speaker": ctx.get("speaker"),
-                    "speed": ctx.get("speed") or 1.0,
-                }
-                tts_data = await _call_json_api(client, TTS_URL, payload_tts)
+            payload_tts = {
+                "lines": [{"scene_id": "s1", "text": text}],
+                "speaker": ctx.get("speaker"),
+                "speed": ctx.get("speed") or 1.0,
+            }
+            tts_data = await _call_json_api("tts", payload_tts)
             audios = tts_data.get("audios") or []
             _update_task(
                 task_id,
@@ -387,181 +1041,232 @@ async def _orchestrate(task_id: str, task_type: str, ctx: Dict) -> None:
 
         # --- Full video pipeline (default) ---
         req = render_req
-        async with httpx.AsyncClient() as client:
-            # 1) Storyboard
-            payload_sb = {"story": req.story, "style": req.style, "scenes": req.scenes}
-            sb_data = await _call_json_api(client, LLM_URL, payload_sb)
-            storyboard = sb_data.get("storyboard") or sb_data.get("shots")
-            if not storyboard:
-                raise RuntimeError("Storyboard empty")
-            _update_task(task_id, progress=10, message="Storyboard ready")
-
-            # 2) TXT2IMG
-            frames: List[Dict] = []
-            for idx, item in enumerate(storyboard):
-                scene_id = item.get("scene_id") or item.get("id") or f"s{idx+1}"
-                prompt = item.get("prompt") or item.get("description") or ""
-                payload_img = {
-                    "prompt": prompt,
-                    "scene_id": scene_id,
-                    "style": {
-                        "width": req.width,
-                        "height": req.height,
-                        "num_inference_steps": req.img_steps,
-                        "guidance_scale": req.cfg_scale,
-                    },
-                }
-                img_data = await _call_json_api(client, TXT2IMG_URL, payload_img)
-                images = img_data.get("images") or []
-                if not images:
-                    raise RuntimeError(f"No image for scene {scene_id}")
-                frames.append({"scene_id": scene_id, "path": images[0]["path"]})
-                _update_task(task_id, progress=20 + int(20 * (idx + 1) / len(storyboard)), message=f"Images {idx+1}/{len(storyboard)}")
-
-            # 3) IMG2VID
-            clips: List[Dict] = []
-            for idx, frame in enumerate(frames):
-                payload_vid = {
-                    "frame": frame["path"],
-                    "scene_id": frame["scene_id"],
-                    "fps": req.fps,
-                    "num_frames": req.video_frames,
-                }
-                try:
-                    vid_data = await _call_json_api(
-                        client,
-                        IMG2VID_URL,
-                        payload_vid,
-                        timeout=float(os.getenv("IMG2VID_TIMEOUT", "120")),
-                    )
-                    video = vid_data.get("video")
-                    if not video:
-                        raise RuntimeError(f"No video for scene {frame['scene_id']}")
-                except Exception:
-                    # Fallback: generate static video locally to keep pipeline moving.
-                    video = str(_frame_to_video_fallback(frame["path"], frame["scene_id"], req.fps, req.video_frames))
-                clips.append({"scene_id": frame["scene_id"], "video": video})
-                _update_task(task_id, progress=40 + int(20 * (idx + 1) / len(frames)), message=f"Videos {idx+1}/{len(frames)}")
-
-            # 4) TTS
-            lines = [{"scene_id": item.get("scene_id") or item.get("id") or f"s{idx+1}", "text": item.get("narration") or item.get("prompt") or ""} for idx, item in enumerate(storyboard)]
-            payload_tts = {"lines": lines, "speaker": req.speaker or None, "speed": req.speed}
-            tts_data = await _call_json_api(client, TTS_URL, payload_tts)
-            audios = tts_data.get("audios") or []
-            if len(audios) != len(lines):
-                raise RuntimeError("TTS count mismatch")
-            audio_map = {a["scene_id"]: a for a in audios}
-            _update_task(task_id, progress=70, message="TTS ready")
-
-        # 5) Mux clips and audio
-        muxed: List[Path] = []
-        for idx, clip in enumerate(clips):
-            scene_id = clip["scene_id"]
-            audio = audio_map.get(scene_id)
-            if not audio:
-                raise RuntimeError(f"Missing audio for scene {scene_id}")
-            out_clip = TMP_DIR / f"{scene_id}_mux.mp4"
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-i",
-                clip["video"],
-                "-i",
-                audio["audio"],
-                "-c:v",
-                "copy",
-                "-c:a",
-                "aac",
-                "-shortest",
-                str(out_clip),
-            ]
-            await asyncio.to_thread(_run_ffmpeg, cmd, f"mux {scene_id}")
-            muxed.append(out_clip)
-            _update_task(task_id, progress=75 + int(15 * (idx + 1) / len(clips)), message=f"Mux {idx+1}/{len(clips)}")
-
-        # 6) Concat
-        list_file = TMP_DIR / f"concat_{task_id}.txt"
-        with list_file.open("w", encoding="utf-8") as f:
-            for path in muxed:
-                f.write(f"file '{path.resolve().as_posix()}'\n")
+        state = _get_task(task_id)
+        manifest = (state.checkpoint if state else None) or {}
+        timings.update(queue=state.waitSeconds if state else None, scenes={})
+        # 1) Storyboard (reused from the checkpoint when resuming)
+        storyboard = manifest.get("storyboard")
+        if not storyboard:
+            with _stage(timings, "storyboard"):
+                payload_sb = {"story": req.story, "style": req.style, "scenes": req.scenes}
+                sb_data = await _call_json_api("llm", payload_sb)
+                storyboard = sb_data.get("storyboard") or sb_data.get("shots")
+                if not storyboard:
+                    raise RuntimeError("Storyboard empty")
+            _record_artifact(task_id, None, "storyboard", storyboard)
+        _update_task(task_id, progress=10, message="Storyboard ready")
+
+        # 2-5) Per-scene DAG: txt2img -> img2vid, TTS in parallel, mux once both exist
+        tracker = _StageProgress(task_id, len(storyboard))
+        scene_done = manifest.get("scenes") or {}
+        missing = []
+        for idx, item in enumerate(storyboard):
+            done = scene_done.get(_scene_id(item, idx)) or {}
+            if not any(_artifact_ok(done.get(stage)) for stage in ("frame", "clip", "mux")):
+                missing.append((_scene_id(item, idx), _scene_prompt(item)))
+        # All missing keyframes go to txt2img as one batch; scenes pick their frame up as it lands.
+        frames = asyncio.ensure_future(_scene_frames(task_id, req, missing)) if TXT2IMG_BATCH and missing else None
+        try:
+            muxed: List[Path] = await _gather_or_cancel(
+                _render_scene(
+                    task_id,
+                    req,
+                    idx,
+                    item,
+                    tracker,
+                    scene_done.get(_scene_id(item, idx)) or {},
+                    timings["scenes"].setdefault(_scene_id(item, idx), {}),
+                    frames,
+                )
+                for idx, item in enumerate(storyboard)
+            )
+        finally:
+            if frames is not None and not frames.done():
+                frames.cancel()
+
+        # 6) Concat (stream copy; segments were normalized at mux time)
         final_path = FINAL_DIR / f"final_{task_id}.mp4"
-        cmd_concat = [
-            "ffmpeg",
-            "-y",
-            "-f",
-            "concat",
-            "-safe",
-            "0",
-            "-i",
-            str(list_file),
-            "-c:v",
-            "libx264",
-            "-pix_fmt",
-            "yuv420p",
-            "-profile:v",
-            "main",
-            "-c:a",
-            "aac",
-            "-b:a",
-            "128k",
-            "-movflags",
-            "+faststart",
-            str(final_path),
-        ]
-        await asyncio.to_thread(_run_ffmpeg, cmd_concat, "concat videos")
+        with _stage(timings, "concat", segments=len(muxed)):
+            await _concat_segments(task_id, muxed, final_path)
+        _stage_time(timings, "total", pipeline_start)
 
         _update_task(
             task_id,
             status=TASK_STATUS_FINISHED,
             progress=100,
             message="done",
-            result={"video": str(final_path)},
+            result={"video": str(final_path), "timings": timings},
             finishedAt=datetime.utcnow().isoformat(),
         )
     except Exception as exc:  # noqa: BLE001
+        extra = {}
+        if timings:
+            timings["total"] = round(time.perf_counter() - pipeline_start, 3)
+            extra["result"] = {"timings": timings}
         _update_task(
             task_id,
             status=TASK_STATUS_FAILED,
             message=f"failed: {exc}",
             error=str(exc),
+            **extra,
         )
 
 
+def _discard_partials(task_id: str) -> None:
+    """Remove gateway-owned intermediates of a cancelled job (muxed segments, fallback clips, partial output).
+
+    Keyframes/clips/narration produced by the model services stay, so a resume can reuse them.
+    """
+    leftovers = [TMP_DIR / f"concat_{task_id}.txt", FINAL_DIR / f"final_{task_id}.mp4"]
+    leftovers += list(TMP_DIR.glob(f"{task_id}_*")) + list(CLIPS_DIR.glob(f"{task_id}_*"))
+    for path in leftovers:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            print(f"[WARN] could not remove {path}: {exc}")
+
+
+async def _signal_cancel(task_id: str, clear: bool = False) -> None:
+    """Best effort: tell txt2img/img2vid to abort this job's diffusion loop at the next step.
+
+    clear=True withdraws the cancellation (DELETE <service>/cancel/{id}) before a resume,
+    otherwise the services would keep refusing the job id until the mark expires.
+    """
+    for name, url in CANCEL_URLS.items():
+        try:
+            if clear:
+                resp = await _client(name).delete(f"{url}/{task_id}", timeout=5.0, headers=tracing.inject())
+                resp.raise_for_status()
+            else:
+                await _client(name).post(url, json={"job_id": task_id}, timeout=5.0, headers=tracing.inject())
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] {'cancel clear' if clear else 'cancel signal'} to {name} failed: {exc}")
+
+
+async def _run_job(task_id: str, task_type: str, ctx: Dict) -> None:
+    state = _get_task(task_id)
+    if state is None or state.status == TASK_STATUS_CANCELLED:
+        return
+    span = tracing.tracer.start_span(
+        f"job {task_type}",
+        context=tracing.extract(ctx.get("trace")),
+        attributes={"task.id": task_id, "task.queue_wait_s": state.waitSeconds or 0.0},
+    )
+    # The orchestration task copies the current context, so every stage span nests under the job.
+    with tracing.use_span(span):
+        job = asyncio.ensure_future(_orchestrate(task_id, task_type, ctx))
+    _job_tasks[task_id] = job
+    try:
+        await asyncio.wait({job})
+    except asyncio.CancelledError:
+        # Gateway shutdown: stop the job but leave it "processing" so startup can resume it.
+        job.cancel()
+        await asyncio.gather(job, return_exceptions=True)
+        raise
+    finally:
+        _job_tasks.pop(task_id, None)
+        final = _get_task(task_id)
+        span.set_attribute("task.status", final.status if final else "unknown")
+        if final is not None and final.status == TASK_STATUS_FAILED:
+            span.set_status(tracing.Status(tracing.StatusCode.ERROR, final.error or ""))
+        span.end()
+    if job.cancelled():
+        await asyncio.to_thread(_discard_partials, task_id)
+
+
+def _on_job_start(task_id: str, waited: float) -> None:
+    metrics.STAGE_SECONDS.labels("queue").observe(waited)
+    _update_task(task_id, waitSeconds=round(waited, 3))
+    # Everyone still waiting moved up one slot; refresh live subscribers.
+    for queued_id in scheduler.queued_ids():
+        if progress_hub.has_subscribers(queued_id):
+            _update_task(queued_id)
+
+
+scheduler = JobScheduler(_run_job, MAX_CONCURRENT_JOBS, JOB_QUEUE_SIZE, on_start=_on_job_start)
+metrics.watch(scheduler, ffmpeg_runner, progress_hub, lambda: {name: _pool_stats(name) for name in DOWNSTREAM_URLS})
+
+
+def _job_spec(task_type: str, ctx: Dict) -> Dict:
+    """JSON-safe copy of an orchestration's inputs, stored on the task for resume."""
+    spec_ctx = dict(ctx)
+    if spec_ctx.get("render_req") is not None:
+        spec_ctx["render_req"] = spec_ctx["render_req"].dict()
+    return {"type": task_type, "ctx": spec_ctx}
+
+
+def _job_from_spec(spec: Dict):
+    ctx = dict(spec.get("ctx") or {})
+    if ctx.get("render_req") is not None:
+        ctx["render_req"] = RenderRequest(**ctx["render_req"])
+    return spec.get("type") or TASK_TYPE_VIDEO, ctx
+
+
+async def _submit_job(task_id: str, task_type: str, ctx: Dict, priority: int, drop_on_reject: bool = True) -> None:
+    """Queue an orchestration or answer 429 with Retry-After when the queue is full."""
+    try:
+        scheduler.submit(task_id, task_type, ctx, priority=priority)
+    except QueueFullError as exc:
+        if drop_on_reject:
+            await _drop_task(task_id)
+        raise HTTPException(
+            status_code=429,
+            detail=f"job queue full ({scheduler.max_queue} waiting)",
+            headers={"Retry-After": str(exc.retry_after)},
+        ) from exc
+
+
+async def _resume_job(state: TaskState) -> None:
+    """Re-queue a job from its stored spec; _orchestrate skips artifacts already in the checkpoint."""
+    task_type, ctx = _job_from_spec(state.job)
+    render_req = ctx.get("render_req")
+    priority = render_req.priority if render_req is not None else JOB_DEFAULT_PRIORITY
+    if state.status == TASK_STATUS_CANCELLED and CANCEL_SIGNAL_SERVICES:
+        await _signal_cancel(state.id, clear=True)
+    await _submit_job(state.id, task_type, ctx, priority, drop_on_reject=False)
+    _update_task(state.id, status=TASK_STATUS_PENDING, message="resume queued", error="", finishedAt=None)
+
+
 @app.post("/render", response_model=RenderResponse)
-async def render(req: RenderRequest, background_tasks: BackgroundTasks):
+async def render(req: RenderRequest):
     task_id = str(uuid.uuid4())
     now = datetime.utcnow().isoformat()
-    tasks[task_id] = TaskState(
-        id=task_id,
-        status=TASK_STATUS_PENDING,
-        progress=0,
-        message="queued",
-        parameters={},
-        result={},
-        error="",
-        createdAt=now,
-        updatedAt=now,
-        type=TASK_TYPE_VIDEO,
-    )
-    background_tasks.add_task(
-        _orchestrate,
-        task_id,
-        TASK_TYPE_VIDEO,
-        {
-            "render_req": req,
-            "story": req.story,
-            "style": req.style,
-            "scenes": req.scenes,
-            "prompt_text": "",
-            "speaker": req.speaker,
-            "speed": req.speed,
-        },
+    ctx = {
+        "render_req": req,
+        "story": req.story,
+        "style": req.style,
+        "scenes": req.scenes,
+        "prompt_text": "",
+        "speaker": req.speaker,
+        "speed": req.speed,
+        # W3C trace context of this request; the queued job (and any resume) continues the trace.
+        "trace": tracing.inject(),
+    }
+    _save_task(
+        TaskState(
+            id=task_id,
+            status=TASK_STATUS_PENDING,
+            progress=0,
+            message="queued",
+            parameters={},
+            result={},
+            error="",
+            job=_job_spec(TASK_TYPE_VIDEO, ctx),
+            createdAt=now,
+            updatedAt=now,
+            type=TASK_TYPE_VIDEO,
+        ),
+        durable=True,
     )
+    await _commit_tasks()
+    await _submit_job(task_id, TASK_TYPE_VIDEO, ctx, req.priority)
     return RenderResponse(job_id=task_id, message="accepted", error="")
 
 
 @app.post("/v1/api/generate", response_model=RenderResponse)
-async def generate_vi(req: GeneratePayload, background_tasks: BackgroundTasks):
+async def generate_vi(req: GeneratePayload):
     params = req.parameters or GenerateParameters()
     shot_defaults = params.shot_defaults or ShotDefaults()
     shot = params.shot or ShotParam()
@@ -595,58 +1300,103 @@ async def generate_vi(req: GeneratePayload, background_tasks: BackgroundTasks):
         video_frames=16,
         speaker=tts.voice,
         speed=1.0,
+        priority=req.priority if req.priority is not None else JOB_DEFAULT_PRIORITY,
     )
     task_id = str(uuid.uuid4())
     now = datetime.utcnow().isoformat()
-    tasks[task_id] = TaskState(
-        id=task_id,
-        project_id=req.project_id,
-        type=req.type or TASK_TYPE_VIDEO,
-        status=TASK_STATUS_PENDING,
-        progress=0,
-        message=req.message or "queued",
-        parameters=params.model_dump(by_alias=True, exclude_none=True) if hasattr(params, "model_dump") else {},
-        result=req.result or {},
-        error=req.error or "",
-        estimatedDuration=req.estimatedDuration or 0,
-        createdAt=now,
-        updatedAt=now,
-    )
-    background_tasks.add_task(
-        _orchestrate,
-        task_id,
-        req.type or TASK_TYPE_VIDEO,
-        {
-            "render_req": render_req,
-            "story": story,
-            "style": style,
-            "scenes": scenes,
-            "prompt_text": prompt_text,
-            "speaker": tts.voice,
-            "speed": 1.0,
-        },
+    task_type = req.type or TASK_TYPE_VIDEO
+    ctx = {
+        "render_req": render_req,
+        "story": story,
+        "style": style,
+        "scenes": scenes,
+        "prompt_text": prompt_text,
+        "speaker": tts.voice,
+        "speed": 1.0,
+        "trace": tracing.inject(),
+    }
+    _save_task(
+        TaskState(
+            id=task_id,
+            project_id=req.project_id,
+            type=task_type,
+            status=TASK_STATUS_PENDING,
+            progress=0,
+            message=req.message or "queued",
+            parameters=params.model_dump(by_alias=True, exclude_none=True) if hasattr(params, "model_dump") else {},
+            result=req.result or {},
+            error=req.error or "",
+            estimatedDuration=req.estimatedDuration or 0,
+            job=_job_spec(task_type, ctx),
+            createdAt=now,
+            updatedAt=now,
+        ),
+        durable=True,
     )
+    await _commit_tasks()
+    await _submit_job(task_id, task_type, ctx, render_req.priority)
     return RenderResponse(job_id=task_id, message="accepted", error="")
 
 
 @app.get("/tasks/{task_id}", response_model=TaskResponse)
 async def task_status(task_id: str):
-    state = tasks.get(task_id)
+    state = _get_task(task_id)
     if not state:
         raise HTTPException(status_code=404, detail="task not found")
     return state
 
 
 @app.get("/tasks/{task_id}/stream")
-async def task_stream(task_id: str):
-    if task_id not in tasks:
+async def task_stream(task_id: str, last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    if _get_task(task_id) is None:
         raise HTTPException(status_code=404, detail="task not found")
-    return StreamingResponse(_task_event_stream(task_id), media_type="text/event-stream")
+    return StreamingResponse(
+        _task_event_stream(task_id, _parse_event_id(last_event_id)),
+        media_type="text/event-stream",
+    )
+
+
+@app.websocket("/tasks/{task_id}/ws")
+async def task_ws(websocket: WebSocket, task_id: str):
+    """WebSocket variant of /stream: frames are {"id", "task"} snapshots; resume with ?last_event_id=."""
+    await websocket.accept()
+    if _get_task(task_id) is None:
+        await websocket.close(code=4404, reason="task not found")
+        return
+    sub = _subscribe_task(task_id, _parse_event_id(websocket.query_params.get("last_event_id")))
+    # Incoming frames are ignored; reading them is how a client disconnect is noticed.
+    reader = asyncio.ensure_future(_drain_ws(websocket))
+    try:
+        while True:
+            getter = asyncio.ensure_future(sub.next(timeout=15.0))
+            await asyncio.wait({getter, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if reader.done():
+                getter.cancel()
+                break
+            event = getter.result()
+            if event is None:
+                await websocket.send_text('{"event": "ping"}')
+            else:
+                # Wrap the shared serialized snapshot without re-encoding it.
+                await websocket.send_text(f'{{"id": {event.id}, "task": {event.data}}}')
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        reader.cancel()
+        progress_hub.unsubscribe(task_id, sub)
+
+
+async def _drain_ws(websocket: WebSocket) -> None:
+    try:
+        while True:
+            await websocket.receive_text()
+    except (WebSocketDisconnect, RuntimeError):
+        return
 
 # Spec-compatible task query
 @app.get("/v1/api/tasks/{task_id}")
 async def task_status_v1(task_id: str):
-    state = tasks.get(task_id)
+    state = _get_task(task_id)
     if not state:
         raise HTTPException(status_code=404, detail="task not found")
     return {"task": _as_task_schema(state)}
@@ -654,7 +1404,7 @@ async def task_status_v1(task_id: str):
 
 @app.get("/v1/api/jobs/{job_id}", response_model=TaskSchema)
 async def job_status(job_id: str):
-    state = tasks.get(job_id)
+    state = _get_task(job_id)
     if not state:
         raise HTTPException(status_code=404, detail="task not found")
     return _as_task_schema(state)
@@ -662,34 +1412,60 @@ async def job_status(job_id: str):
 
 @app.delete("/v1/api/jobs/{job_id}")
 async def stop_job(job_id: str):
-    state = tasks.get(job_id)
+    state = _get_task(job_id)
     if not state:
         raise HTTPException(status_code=404, detail="task not found")
     now = _now_iso()
+    scheduler.discard(job_id)
     _update_task(job_id, status=TASK_STATUS_CANCELLED, message="stopped by user", finishedAt=now)
+    job = _job_tasks.get(job_id)
+    if job is not None:
+        # Cancelling the orchestration aborts in-flight HTTP calls and kills running ffmpeg processes.
+        job.cancel()
+        if CANCEL_SIGNAL_SERVICES:
+            signal = asyncio.ensure_future(_signal_cancel(job_id))
+            _background.append(signal)
+            signal.add_done_callback(lambda fut: fut in _background and _background.remove(fut))
+        await asyncio.wait({job}, timeout=CANCEL_GRACE_SECONDS)
     return {"success": True, "deleteAT": now, "error": ""}
 
 
+@app.post("/v1/api/jobs/{job_id}/resume", response_model=RenderResponse)
+async def resume_job(job_id: str):
+    state = _get_task(job_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="task not found")
+    if state.status not in TASK_TERMINAL_STATUSES or scheduler.is_running(job_id):
+        raise HTTPException(status_code=409, detail="job is still queued or running")
+    if state.status == TASK_STATUS_FINISHED:
+        raise HTTPException(status_code=409, detail="job already finished")
+    if not state.job:
+        raise HTTPException(status_code=409, detail="job has no stored parameters to resume from")
+    await _resume_job(state)
+    return RenderResponse(job_id=job_id, message="resumed", error="")
+
+
 # ---- Project & shot endpoints (spec stubs) ----
 def _get_or_404_project(project_id: str) -> Dict:
-    project = projects.get(project_id)
+    project = store.get_project(project_id)
     if not project:
         raise HTTPException(status_code=404, detail="project not found")
     return project
 
 
 def _recent_task_for_project(project_id: str) -> Dict:
-    for t in tasks.values():
-        if t.project_id == project_id:
-            ts = _as_task_schema(t).dict()
-            ts.setdefault("parameters", {})
-            ts.setdefault("result", {})
-            ts.setdefault("error", "")
-            ts.setdefault("estimatedDuration", 0)
-            ts.setdefault("startedAt", ts.get("createdAt") or _now_iso())
-            ts.setdefault("finishedAt", ts.get("finishedAt") or _now_iso())
-            ts.setdefault("updatedAt", ts.get("updatedAt") or _now_iso())
-            return ts
+    row = store.recent_task(project_id)
+    if row is not None:
+        t = tasks.get(row["id"]) or TaskState(**row)
+        ts = _as_task_schema(t).dict()
+        ts.setdefault("parameters", {})
+        ts.setdefault("result", {})
+        ts.setdefault("error", "")
+        ts.setdefault("estimatedDuration", 0)
+        ts.setdefault("startedAt", ts.get("createdAt") or _now_iso())
+        ts.setdefault("finishedAt", ts.get("finishedAt") or _now_iso())
+        ts.setdefault("updatedAt", ts.get("updatedAt") or _now_iso())
+        return ts
     now = _now_iso()
     return {
         "id": str(uuid.uuid4()),
@@ -734,12 +1510,9 @@ async def create_project(Title: Optional[str] = None, StoryText: Optional[str] =
         "createdAt": now,
         "updatedAt": now,
     }
-    projects[project_id] = project
-    shots: Dict[str, Dict] = {}
-    for i in range(shot_count):
-        shot = _make_shot(project_id, i + 1)
-        shots[shot["id"]] = shot
-    project_shots[project_id] = shots
+    # Store writes commit immediately; keep them off the event loop.
+    await asyncio.to_thread(store.save_project, project)
+    await asyncio.to_thread(store.save_shots, [_make_shot(project_id, i + 1) for i in range(shot_count)])
     shot_task_ids = [str(uuid.uuid4()) for _ in range(shot_count)]
     text_task_id = str(uuid.uuid4())
     return {"project_id": project_id, "shot_task_ids": shot_task_ids, "text_task_id": text_task_id}
@@ -753,25 +1526,23 @@ async def update_project(project_id: str, Title: Optional[str] = None, Descripti
     if Description is not None:
         project["description"] = Description
     project["updatedAt"] = _now_iso()
-    projects[project_id] = project
+    await asyncio.to_thread(store.save_project, project)
     return {"id": project_id, "updateAT": project["updatedAt"]}
 
 
 @app.delete("/v1/api/projects/{project_id}")
 async def delete_project(project_id: str):
-    deleted = project_id in projects
-    projects.pop(project_id, None)
-    project_shots.pop(project_id, None)
+    deleted = await asyncio.to_thread(store.delete_project, project_id)
     return {"success": deleted, "deleteAt": _now_iso(), "message": "deleted" if deleted else "not found"}
 
 
 @app.get("/v1/api/projects/{project_id}")
 async def get_project(project_id: str):
     project = _get_or_404_project(project_id)
-    shots = list(project_shots.get(project_id, {}).values()) or None
+    shots = store.list_shots(project_id) or None
     recent_task = _recent_task_for_project(project_id)
     project_detail = project.copy()
-    project_detail["shotCount"] = len(project_shots.get(project_id, {}))
+    project_detail["shotCount"] = len(shots or [])
     return {
         "project_detail": project_detail,
         "recent_task": recent_task,
@@ -782,17 +1553,14 @@ async def get_project(project_id: str):
 @app.get("/v1/api/projects/{project_id}/shots")
 async def list_shots(project_id: str):
     _get_or_404_project(project_id)
-    shots = list(project_shots.get(project_id, {}).values())
+    shots = store.list_shots(project_id)
     return {"project_id": project_id, "total_shots": len(shots), "shots": shots}
 
 
 @app.post("/v1/api/projects/{project_id}/shots/{shot_id}")
 async def update_shot(project_id: str, shot_id: str, title: Optional[str] = None, prompt: Optional[str] = None, transition: Optional[str] = None):
     _get_or_404_project(project_id)
-    shots = project_shots[project_id]
-    if shot_id not in shots:
-        shots[shot_id] = _make_shot(project_id, len(shots) + 1, shot_id=shot_id)
-    shot = shots[shot_id]
+    shot = store.get_shot(project_id, shot_id) or _make_shot(project_id, store.count_shots(project_id) + 1, shot_id=shot_id)
     if title is not None:
         shot["title"] = title
     if prompt is not None:
@@ -800,7 +1568,7 @@ async def update_shot(project_id: str, shot_id: str, title: Optional[str] = None
     if transition is not None:
         shot["transition"] = transition
     shot["updatedAt"] = _now_iso()
-    shots[shot_id] = shot
+    await asyncio.to_thread(store.save_shots, [shot])
     task_id = str(uuid.uuid4())
     return {"shot_id": shot_id, "task_id": task_id, "message": "updated"}
 
@@ -808,7 +1576,7 @@ async def update_shot(project_id: str, shot_id: str, title: Optional[str] = None
 @app.get("/v1/api/projects/{project_id}/shots/{shot_id}")
 async def get_shot(project_id: str, shot_id: str):
     _get_or_404_project(project_id)
-    shot = project_shots[project_id].get(shot_id)
+    shot = store.get_shot(project_id, shot_id)
     if not shot:
         raise HTTPException(status_code=404, detail="shot not found")
     return {"shot_detail": shot}
@@ -817,8 +1585,7 @@ async def get_shot(project_id: str, shot_id: str):
 @app.delete("/v1/api/proejcts/{project_id}/shot/{shot_id}")
 async def delete_shot(project_id: str, shot_id: str):
     # Note: path spelling kept as provided in spec ("proejcts")
-    shots = project_shots.get(project_id, {})
-    existed = shots.pop(shot_id, None) is not None
+    existed = await asyncio.to_thread(store.delete_shot, project_id, shot_id)
     return {"message": "deleted" if existed else "not found", "shot_id": shot_id, "project_id": project_id}
 
 
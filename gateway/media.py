@@ -0,0 +1,128 @@
+"""ffmpeg/ffprobe command builders for final assembly.
+
+Every per-scene mux output is normalized to one set of codec parameters
+(H.264 Main yuv420p at the render size/fps, AAC 44.1 kHz stereo, 90 kHz
+track timescale). The concat step can then stream-copy instead of
+re-encoding the whole film. Clips that already match the target are only
+remuxed. The old re-encoding concat is kept as the fallback whenever
+ffprobe cannot confirm that all segments are identical.
+"""
+
+import json
+import os
+import subprocess
+from fractions import Fraction
+from typing import Dict, List, Optional
+
+# Optional libx264 preset for normalization encodes (empty = ffmpeg default)
+X264_PRESET = os.getenv("FFMPEG_X264_PRESET", "")
+# Set ASSEMBLY_NORMALIZE=0 to mux with -c:v copy regardless of the clip's codec (old behaviour).
+ASSEMBLY_NORMALIZE = os.getenv("ASSEMBLY_NORMALIZE", "1").strip().lower() in ("1", "true", "yes", "on")
+
+AUDIO_ARGS = ["-c:a", "aac", "-b:a", "128k", "-ar", "44100", "-ac", "2"]
+TRACK_TIMESCALE = "90000"
+
+
+def _even(value: int) -> int:
+    return max(2, int(value) - int(value) % 2)
+
+
+def _rate(value: Optional[str]) -> Optional[Fraction]:
+    try:
+        rate = Fraction(value or "")
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def probe_media(path: str) -> Optional[Dict]:
+    """First video/audio stream parameters (+ container duration) via ffprobe, or None if it can't be read."""
+    cmd = ["ffprobe", "-v", "error", "-show_streams", "-show_format", "-of", "json", str(path)]
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0:
+        return None
+    try:
+        data = json.loads(proc.stdout)
+    except json.JSONDecodeError:
+        return None
+    streams = data.get("streams") or []
+    info: Dict = {}
+    for stream in streams:
+        kind = stream.get("codec_type")
+        if kind == "video" and "video" not in info:
+            info["video"] = {
+                "codec": stream.get("codec_name"),
+                "profile": stream.get("profile"),
+                "pix_fmt": stream.get("pix_fmt"),
+                "width": stream.get("width"),
+                "height": stream.get("height"),
+                "fps": str(_rate(stream.get("avg_frame_rate")) or _rate(stream.get("r_frame_rate"))),
+            }
+        elif kind == "audio" and "audio" not in info:
+            info["audio"] = {
+                "codec": stream.get("codec_name"),
+                "sample_rate": stream.get("sample_rate"),
+                "channels": stream.get("channels"),
+            }
+    if info:
+        try:
+            info["duration"] = float((data.get("format") or {}).get("duration"))
+        except (TypeError, ValueError):
+            info["duration"] = None
+    return info or None
+
+
+def matches_target(probe: Optional[Dict], width: int, height: int, fps: int) -> bool:
+    """True when a clip's video stream can be copied as-is into a normalized segment."""
+    video = (probe or {}).get("video")
+    if not video:
+        return False
+    return (
+        video["codec"] == "h264"
+        and video["profile"] == "Main"
+        and video["pix_fmt"] == "yuv420p"
+        and video["width"] == _even(width)
+        and video["height"] == _even(height)
+        and _rate(video["fps"]) == Fraction(fps)
+    )
+
+
+def normalize_video_args(width: int, height: int, fps: int) -> List[str]:
+    w, h = _even(width), _even(height)
+    vf = f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps}"
+    args = ["-vf", vf, "-c:v", "libx264"]
+    if X264_PRESET:
+        args += ["-preset", X264_PRESET]
+    return args + ["-pix_fmt", "yuv420p", "-profile:v", "main", "-r", str(fps)]
+
+
+def mux_command(video: str, audio: str, out: str, width: int, height: int, fps: int, copy_video: bool) -> List[str]:
+    cmd = ["ffmpeg", "-y", "-i", video, "-i", audio, "-map", "0:v:0", "-map", "1:a:0"]
+    cmd += ["-c:v", "copy"] if copy_video else normalize_video_args(width, height, fps)
+    return cmd + AUDIO_ARGS + ["-video_track_timescale", TRACK_TIMESCALE, "-shortest", str(out)]
+
+
+def still_command(frame: str, out: str, duration: float, width: int, height: int, fps: int) -> List[str]:
+    """Static clip from one frame, encoded straight to the normalized target."""
+    cmd = ["ffmpeg", "-y", "-loop", "1", "-t", f"{duration:.2f}", "-i", frame]
+    return cmd + normalize_video_args(width, height, fps) + ["-video_track_timescale", TRACK_TIMESCALE, "-movflags", "+faststart", str(out)]
+
+
+def can_stream_copy(probes: List[Optional[Dict]]) -> bool:
+    """All segments probed fine and share identical video+audio parameters."""
+    if not probes or any(not p or "video" not in p or "audio" not in p for p in probes):
+        return False
+    first = probes[0]
+    return all(p["video"] == first["video"] and p["audio"] == first["audio"] for p in probes[1:])
+
+
+def concat_command(list_file: str, out: str, stream_copy: bool) -> List[str]:
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file)]
+    if stream_copy:
+        cmd += ["-c", "copy"]
+    else:
+        cmd += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-profile:v", "main", "-c:a", "aac", "-b:a", "128k"]
+    return cmd + ["-movflags", "+faststart", str(out)]
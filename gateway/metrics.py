@@ -0,0 +1,83 @@
+"""Prometheus metrics for the gateway (`GET /metrics`).
+
+Request, downstream, ffmpeg and stage timings are recorded as they happen; job, ffmpeg-pool,
+subscriber and connection-pool gauges are read from the live objects at scrape time.
+"""
+
+from typing import Callable, Dict
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Seconds; from status polls up to full renders.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+REQUESTS = Counter("s2v_gateway_requests_total", "HTTP requests handled", ["method", "endpoint", "status"])
+REQUEST_SECONDS = Histogram(
+    "s2v_gateway_request_seconds",
+    "HTTP request latency until the response starts",
+    ["method", "endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+DOWNSTREAM_SECONDS = Histogram(
+    "s2v_gateway_downstream_seconds",
+    "Model service call latency",
+    ["service", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+FFMPEG_SECONDS = Histogram(
+    "s2v_gateway_ffmpeg_seconds",
+    "ffmpeg command wall time, excluding the wait for a pool slot",
+    ["op", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "s2v_gateway_stage_seconds",
+    "Pipeline stage time (per scene for image/video/audio/mux, per job otherwise)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+JOBS = Counter("s2v_gateway_jobs_total", "Jobs reaching a terminal status", ["status"])
+
+
+class GatewayCollector:
+    """Scrape-time gauges from the scheduler, ffmpeg runner, progress hub and downstream pools."""
+
+    def __init__(self, scheduler, runner, hub, pools: Callable[[], Dict[str, Dict]]) -> None:
+        self.scheduler = scheduler
+        self.runner = runner
+        self.hub = hub
+        self.pools = pools
+
+    def collect(self):
+        sched = self.scheduler.stats()
+        yield GaugeMetricFamily("s2v_gateway_jobs_active", "Orchestrations running", value=sched["running"])
+        yield GaugeMetricFamily("s2v_gateway_jobs_queued", "Jobs waiting in the scheduler queue", value=sched["queued"])
+        yield CounterMetricFamily("s2v_gateway_jobs_rejected", "Submissions refused with 429", value=sched["rejected"])
+
+        ffmpeg = self.runner.stats()
+        yield GaugeMetricFamily("s2v_gateway_ffmpeg_running", "ffmpeg processes running", value=ffmpeg["running"])
+        yield GaugeMetricFamily("s2v_gateway_ffmpeg_waiting", "ffmpeg commands waiting for a slot", value=ffmpeg["waiting"])
+
+        hub = self.hub.stats()
+        yield GaugeMetricFamily("s2v_gateway_progress_subscribers", "Open SSE/WebSocket subscribers", value=hub["subscribers"])
+        yield GaugeMetricFamily("s2v_gateway_progress_tasks", "Tasks with at least one subscriber", value=hub["tasks"])
+        yield CounterMetricFamily("s2v_gateway_progress_published", "Progress snapshots published", value=hub["published"])
+        yield CounterMetricFamily("s2v_gateway_progress_coalesced", "Snapshots skipped for slow subscribers", value=hub["coalesced"])
+
+        conns = GaugeMetricFamily("s2v_gateway_pool_connections", "Downstream connections", labels=["service", "state"])
+        for service, stats in self.pools().items():
+            if not isinstance(stats["active"], int):
+                continue  # pool internals unavailable ("unknown")
+            conns.add_metric([service, "active"], stats["active"])
+            conns.add_metric([service, "idle"], stats["idle"])
+        yield conns
+
+
+def watch(scheduler, runner, hub, pools: Callable[[], Dict[str, Dict]]) -> None:
+    REGISTRY.register(GatewayCollector(scheduler, runner, hub, pools))
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,101 @@
+"""Task progress fan-out for SSE / WebSocket subscribers.
+
+Every event is a full task snapshot, so subscribers only ever need the newest
+one: each subscriber holds a single pending slot and newer snapshots replace
+older undelivered ones (a slow client costs O(1) memory). A snapshot is
+serialized once per update and the same string is shared by all subscribers.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+
+class ProgressEvent(NamedTuple):
+    id: int  # monotonic per task, millisecond based so ids stay increasing across restarts
+    data: str  # JSON-serialized task snapshot
+
+
+class Subscriber:
+    """Latest-state-wins mailbox for one connected client."""
+
+    def __init__(self, hub: "ProgressHub") -> None:
+        self._hub = hub
+        self._pending: Optional[ProgressEvent] = None
+        self._ready = asyncio.Event()
+
+    def offer(self, event: ProgressEvent) -> None:
+        if self._pending is not None:
+            self._hub.coalesced += 1
+        self._pending = event
+        self._ready.set()
+
+    async def next(self, timeout: float) -> Optional[ProgressEvent]:
+        """Newest undelivered snapshot, or None when nothing arrived within `timeout`."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        event, self._pending = self._pending, None
+        self._ready.clear()
+        return event
+
+
+class ProgressHub:
+    """Per-task subscriber registry plus the last snapshot sent for each task (for Last-Event-ID)."""
+
+    def __init__(self, max_tasks: int = 1024) -> None:
+        self.max_tasks = max(1, max_tasks)
+        self._subs: Dict[str, List[Subscriber]] = defaultdict(list)
+        self._latest: "OrderedDict[str, ProgressEvent]" = OrderedDict()
+        self.published = 0
+        self.coalesced = 0
+
+    def has_subscribers(self, task_id: str) -> bool:
+        return bool(self._subs.get(task_id))
+
+    def subscribe(self, task_id: str) -> Subscriber:
+        sub = Subscriber(self)
+        self._subs[task_id].append(sub)
+        return sub
+
+    def unsubscribe(self, task_id: str, sub: Subscriber) -> None:
+        subs = self._subs.get(task_id)
+        if subs and sub in subs:
+            subs.remove(sub)
+        if not subs:
+            self._subs.pop(task_id, None)
+
+    def latest(self, task_id: str) -> Optional[ProgressEvent]:
+        return self._latest.get(task_id)
+
+    def publish(self, task_id: str, snapshot: Callable[[], Dict]) -> Optional[ProgressEvent]:
+        """Serialize `snapshot()` once and hand it to every subscriber of the task.
+
+        Without subscribers nothing is serialized; the stale cached event is dropped so a
+        reconnecting client is sent a fresh snapshot instead of a skipped one.
+        """
+        if not self._subs.get(task_id):
+            self._latest.pop(task_id, None)
+            return None
+        previous = self._latest.get(task_id)
+        event_id = max(int(time.time() * 1000), previous.id + 1 if previous else 0)
+        event = ProgressEvent(event_id, json.dumps(snapshot(), ensure_ascii=False))
+        self._latest[task_id] = event
+        self._latest.move_to_end(task_id)
+        while len(self._latest) > self.max_tasks:
+            self._latest.popitem(last=False)
+        self.published += 1
+        for sub in list(self._subs[task_id]):
+            sub.offer(event)
+        return event
+
+    def stats(self) -> Dict:
+        return {
+            "tasks": len(self._subs),
+            "subscribers": sum(len(subs) for subs in self._subs.values()),
+            "published": self.published,
+            "coalesced": self.coalesced,
+        }
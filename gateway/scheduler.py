@@ -0,0 +1,128 @@
+"""Bounded priority job scheduler for the gateway (replaces unbounded BackgroundTasks)."""
+
+import asyncio
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+class QueueFullError(Exception):
+    """Raised by JobScheduler.submit when the pending queue is at capacity."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"job queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobScheduler:
+    """Run at most `max_jobs` jobs at once, keep at most `max_queue` waiting.
+
+    Lower priority values run first; equal priorities run in submission order.
+    Workers are started lazily on the first submit (or explicitly via start()).
+    """
+
+    def __init__(
+        self,
+        runner: Callable[..., Awaitable[None]],
+        max_jobs: int,
+        max_queue: int,
+        on_start: Optional[Callable[[str, float], None]] = None,
+        default_runtime: float = 30.0,
+    ) -> None:
+        self.runner = runner
+        self.max_jobs = max(1, max_jobs)
+        self.max_queue = max(1, max_queue)
+        self.on_start = on_start
+        self.avg_runtime = default_runtime
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        # job_id -> (priority, seq, enqueued_at, args); only jobs still waiting
+        self._pending: Dict[str, Tuple[int, int, float, tuple]] = {}
+        self._running: Set[str] = set()
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.max_jobs)]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def submit(self, job_id: str, *args, priority: int = 5) -> int:
+        """Enqueue a job and return its 1-based queue position."""
+        if len(self._pending) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(self.retry_after())
+        self.start()
+        seq = next(self._seq)
+        self._pending[job_id] = (priority, seq, time.monotonic(), args)
+        self._queue.put_nowait((priority, seq, job_id))
+        return self.position(job_id) or 1
+
+    def discard(self, job_id: str) -> bool:
+        """Drop a job that has not started yet; its heap entry is skipped by the workers."""
+        return self._pending.pop(job_id, None) is not None
+
+    def is_running(self, job_id: str) -> bool:
+        return job_id in self._running
+
+    def queued_ids(self) -> List[str]:
+        return [job_id for job_id, _ in sorted(self._pending.items(), key=lambda kv: kv[1][:2])]
+
+    def position(self, job_id: str) -> Optional[int]:
+        entry = self._pending.get(job_id)
+        if entry is None:
+            return None
+        key = entry[:2]
+        return 1 + sum(1 for other in self._pending.values() if other[:2] < key)
+
+    def wait_seconds(self, job_id: str) -> Optional[float]:
+        entry = self._pending.get(job_id)
+        if entry is None:
+            return None
+        return round(time.monotonic() - entry[2], 3)
+
+    def retry_after(self) -> int:
+        """Rough seconds until a queue slot frees up, from the moving-average job runtime."""
+        return max(1, int(self.avg_runtime * max(len(self._pending), 1) / self.max_jobs))
+
+    def stats(self) -> Dict:
+        return {
+            "max_jobs": self.max_jobs,
+            "max_queue": self.max_queue,
+            "queued": len(self._pending),
+            "running": len(self._running),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_runtime": round(self.avg_runtime, 3),
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            entry = self._pending.pop(job_id, None)
+            if entry is None:
+                continue  # discarded while waiting
+            started = time.monotonic()
+            self._running.add(job_id)
+            if self.on_start:
+                try:
+                    self.on_start(job_id, started - entry[2])
+                except Exception as exc:  # noqa: BLE001
+                    print(f"[WARN] scheduler on_start hook failed for {job_id}: {exc}")
+            try:
+                await self.runner(job_id, *entry[3])
+            except Exception as exc:  # noqa: BLE001
+                print(f"[WARN] job {job_id} crashed in scheduler: {exc}")
+            finally:
+                self._running.discard(job_id)
+                self.completed += 1
+                self.avg_runtime = 0.8 * self.avg_runtime + 0.2 * (time.monotonic() - started)
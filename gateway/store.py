@@ -0,0 +1,281 @@
+"""Task/project/shot persistence for the gateway.
+
+Two interchangeable backends share one interface:
+- MemoryStore: plain dicts, nothing survives a restart (the old behaviour).
+- SqliteStore: SQLite in WAL mode; progress writes are buffered and flushed in batches.
+
+Rows are plain dicts (TaskState.dict(), project/shot dicts) so the store stays
+independent of the API models in gateway.main.
+"""
+
+import json
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+class MemoryStore:
+    """Dict-backed store; also the reference for the SqliteStore interface."""
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, Dict] = {}
+        self._project_tasks: Dict[str, List[str]] = defaultdict(list)
+        self._projects: Dict[str, Dict] = {}
+        self._shots: Dict[str, Dict[str, Dict]] = defaultdict(dict)
+
+    # ---- tasks ----
+    def get_task(self, task_id: str) -> Optional[Dict]:
+        return self._tasks.get(task_id)
+
+    def save_task(self, row: Dict, flush: bool = False) -> None:
+        task_id = row["id"]
+        if task_id not in self._tasks and row.get("project_id"):
+            self._project_tasks[row["project_id"]].append(task_id)
+        self._tasks[task_id] = row
+
+    def delete_task(self, task_id: str) -> None:
+        row = self._tasks.pop(task_id, None)
+        if row and row.get("project_id"):
+            ids = self._project_tasks.get(row["project_id"], [])
+            if task_id in ids:
+                ids.remove(task_id)
+
+    def recent_task(self, project_id: str) -> Optional[Dict]:
+        ids = self._project_tasks.get(project_id)
+        return self._tasks.get(ids[-1]) if ids else None
+
+    def task_ids_by_status(self, statuses: Iterable[str]) -> List[str]:
+        wanted = set(statuses)
+        return [task_id for task_id, row in self._tasks.items() if row.get("status") in wanted]
+
+    # ---- projects ----
+    def get_project(self, project_id: str) -> Optional[Dict]:
+        return self._projects.get(project_id)
+
+    def save_project(self, row: Dict) -> None:
+        self._projects[row["id"]] = row
+
+    def delete_project(self, project_id: str) -> bool:
+        self._shots.pop(project_id, None)
+        return self._projects.pop(project_id, None) is not None
+
+    # ---- shots ----
+    def list_shots(self, project_id: str) -> List[Dict]:
+        return sorted(self._shots.get(project_id, {}).values(), key=lambda shot: shot.get("order", 0))
+
+    def count_shots(self, project_id: str) -> int:
+        return len(self._shots.get(project_id, {}))
+
+    def get_shot(self, project_id: str, shot_id: str) -> Optional[Dict]:
+        return self._shots.get(project_id, {}).get(shot_id)
+
+    def save_shots(self, rows: Iterable[Dict]) -> None:
+        for row in rows:
+            self._shots[row["projectId"]][row["id"]] = row
+
+    def delete_shot(self, project_id: str, shot_id: str) -> bool:
+        return self._shots.get(project_id, {}).pop(shot_id, None) is not None
+
+    def flush(self) -> None:
+        return None
+
+    def close(self) -> None:
+        return None
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    project_id TEXT,
+    status TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_project ON tasks(project_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shots (
+    project_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    ord INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_shots_order ON shots(project_id, ord);
+"""
+
+
+class SqliteStore:
+    """SQLite (WAL) store with write-behind batching for task progress.
+
+    save_task(flush=False) only buffers the latest row per task; flush() writes the
+    buffer in one transaction. Reads consult the buffer first, so callers always
+    see their own writes. The buffer has its own lock, so buffering never waits for
+    a commit running on another thread; call flush() off the event loop.
+    """
+
+    def __init__(self, path: str) -> None:
+        db_path = Path(path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = db_path
+        self._lock = threading.Lock()  # the connection
+        self._buffer_lock = threading.Lock()  # _dirty/_flushing; never held across disk I/O
+        self._dirty: Dict[str, Dict] = {}
+        self._flushing: Dict[str, Dict] = {}  # rows of the commit in progress, still visible to reads
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def _task_params(row: Dict):
+        return (row["id"], row.get("project_id"), row.get("status"), row.get("createdAt") or "", json.dumps(row, ensure_ascii=False))
+
+    def _buffered(self, task_id: str) -> Optional[Dict]:
+        with self._buffer_lock:
+            row = self._dirty.get(task_id)
+            return row if row is not None else self._flushing.get(task_id)
+
+    def _flush_locked(self) -> None:
+        with self._buffer_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            pending = list(self._flushing.values())
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tasks (id, project_id, status, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                [self._task_params(row) for row in pending],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            # Keep unwritten rows buffered (newer saves win) for the next flush.
+            with self._buffer_lock:
+                for row in pending:
+                    self._dirty.setdefault(row["id"], row)
+            raise
+        finally:
+            with self._buffer_lock:
+                self._flushing = {}
+
+    # ---- tasks ----
+    def get_task(self, task_id: str) -> Optional[Dict]:
+        row = self._buffered(task_id)
+        if row is not None:
+            return row
+        with self._lock:
+            cur = self._conn.execute("SELECT data FROM tasks WHERE id = ?", (task_id,))
+            found = cur.fetchone()
+        return json.loads(found[0]) if found else None
+
+    def save_task(self, row: Dict, flush: bool = False) -> None:
+        with self._buffer_lock:
+            self._dirty[row["id"]] = row
+        if flush:
+            self.flush()
+
+    def delete_task(self, task_id: str) -> None:
+        with self._lock:
+            # Under the connection lock, so a commit in progress can't re-insert the row afterwards.
+            with self._buffer_lock:
+                self._dirty.pop(task_id, None)
+            self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+    def recent_task(self, project_id: str) -> Optional[Dict]:
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT id, data FROM tasks WHERE project_id = ? ORDER BY created_at DESC LIMIT 1",
+                (project_id,),
+            )
+            found = cur.fetchone()
+        if not found:
+            return None
+        row = self._buffered(found[0])
+        return row if row is not None else json.loads(found[1])
+
+    def task_ids_by_status(self, statuses: Iterable[str]) -> List[str]:
+        wanted = list(statuses)
+        if not wanted:
+            return []
+        self.flush()
+        marks = ",".join("?" for _ in wanted)
+        with self._lock:
+            cur = self._conn.execute(f"SELECT id FROM tasks WHERE status IN ({marks}) ORDER BY created_at", wanted)
+            return [found[0] for found in cur.fetchall()]
+
+    # ---- projects ----
+    def get_project(self, project_id: str) -> Optional[Dict]:
+        with self._lock:
+            found = self._conn.execute("SELECT data FROM projects WHERE id = ?", (project_id,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def save_project(self, row: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO projects (id, data) VALUES (?, ?)",
+                (row["id"], json.dumps(row, ensure_ascii=False)),
+            )
+
+    def delete_project(self, project_id: str) -> bool:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM shots WHERE project_id = ?", (project_id,))
+            cur = self._conn.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+            self._conn.execute("COMMIT")
+        return cur.rowcount > 0
+
+    # ---- shots ----
+    def list_shots(self, project_id: str) -> List[Dict]:
+        with self._lock:
+            cur = self._conn.execute("SELECT data FROM shots WHERE project_id = ? ORDER BY ord", (project_id,))
+            return [json.loads(found[0]) for found in cur.fetchall()]
+
+    def count_shots(self, project_id: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM shots WHERE project_id = ?", (project_id,)).fetchone()[0]
+
+    def get_shot(self, project_id: str, shot_id: str) -> Optional[Dict]:
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT data FROM shots WHERE project_id = ? AND id = ?", (project_id, shot_id)
+            ).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def save_shots(self, rows: Iterable[Dict]) -> None:
+        params = [
+            (row["projectId"], row["id"], int(row.get("order") or 0), json.dumps(row, ensure_ascii=False)) for row in rows
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO shots (project_id, id, ord, data) VALUES (?, ?, ?, ?)", params)
+            self._conn.execute("COMMIT")
+
+    def delete_shot(self, project_id: str, shot_id: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM shots WHERE project_id = ? AND id = ?", (project_id, shot_id))
+        return cur.rowcount > 0
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+def create_store(backend: str, path: str):
+    """Build the configured backend: "sqlite" (default) or "memory"."""
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "sqlite":
+        return SqliteStore(path)
+    raise ValueError(f"Unknown GATEWAY_STORE backend: {backend}")
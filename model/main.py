@@ -4,8 +4,12 @@ from datetime import datetime
 from typing import Dict
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 from model.services import img2vid, llm, tts, txt2img
+from model.services.metrics import metrics_response
+from model.tracing import TraceMiddleware
+from model.services.utils import readiness, residency, wait_eager_loads
 
 SERVICE_PREFIXES: Dict[str, str] = {
     "llm": "/llm",
@@ -15,6 +19,7 @@ SERVICE_PREFIXES: Dict[str, str] = {
 }
 
 app = FastAPI(title="StoryToVideo Model Node", version="0.2.0")
+app.add_middleware(TraceMiddleware)
 
 
 @app.get("/")
@@ -31,7 +36,25 @@ async def health():
     return {"status": "ok", "ts": datetime.utcnow().isoformat()}
 
 
+@app.get("/ready")
+async def ready():
+    """Per-model load state; 503 until every eager/background model has loaded once."""
+    ok, states = readiness()
+    return JSONResponse(
+        {"ready": ok, "models": states, "residency": residency.stats()},
+        status_code=200 if ok else 503,
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus exposition for every service in this process."""
+    return metrics_response()
+
+
 llm.register_app(app, prefix=SERVICE_PREFIXES["llm"])
 txt2img.register_app(app, prefix=SERVICE_PREFIXES["txt2img"])
 img2vid.register_app(app, prefix=SERVICE_PREFIXES["img2vid"])
 tts.register_app(app, prefix=SERVICE_PREFIXES["tts"])
+# After every service's startup hook has started its loads, so eager models load in parallel.
+app.add_event_handler("startup", wait_eager_loads)
@@ -27,10 +27,11 @@ import sys
 import tempfile
 import time
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import requests
 import soundfile as sf
+from gateway.media import AUDIO_ARGS, TRACK_TIMESCALE, can_stream_copy, matches_target, probe_media
 from model.services.utils import resolve_project_root
 
 PROJECT_ROOT = resolve_project_root()
@@ -41,6 +42,8 @@ LLM_URL = os.getenv("LLM_URL", f"{DEFAULT_BASE_URL}/llm/storyboard")
 TXT2IMG_URL = os.getenv("TXT2IMG_URL", f"{DEFAULT_BASE_URL}/txt2img/generate")
 IMG2VID_URL = os.getenv("IMG2VID_URL", f"{DEFAULT_BASE_URL}/img2vid/generate")
 TTS_URL = os.getenv("TTS_URL", f"{DEFAULT_BASE_URL}/tts/narration")
+# Used when img2vid /health does not report max_frames (older servers clipped at 48 frames).
+FALLBACK_MAX_FRAMES = 48
 
 
 def set_endpoints(
@@ -129,6 +132,20 @@ def step_img2vid(frames: List[Tuple[str, str]], fps: int, num_frames: int) -> Li
     return results
 
 
+def img2vid_max_frames(override: int) -> int:
+    """img2vid 单次请求允许的最大帧数：优先命令行，其次服务 /health 的 max_frames。"""
+    if override > 0:
+        return override
+    health_url = IMG2VID_URL.rsplit("/", 1)[0] + "/health"
+    try:
+        resp = requests.get(health_url, timeout=10)
+        resp.raise_for_status()
+        return int(resp.json()["max_frames"])
+    except Exception as exc:  # noqa: BLE001
+        print(f"[WARN] max_frames unavailable from {health_url} ({exc}); clamping clips to {FALLBACK_MAX_FRAMES} frames")
+        return FALLBACK_MAX_FRAMES
+
+
 def step_tts(storyboard: List[Dict], speaker: str, speed: float) -> List[Tuple[str, str, int]]:
     """TTS 旁白，返回 (scene_id, audio_path, sample_rate)。"""
     lines = [{"scene_id": item["scene_id"], "text": item["narration"]} for item in storyboard]
@@ -141,21 +158,23 @@ def step_tts(storyboard: List[Dict], speaker: str, speed: float) -> List[Tuple[s
     return [(a["scene_id"], a["audio"], a.get("sample_rate", 44100)) for a in audios]
 
 
-def mux_clip_with_audio(clip: str, audio: str, out_path: Path) -> None:
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i",
-        clip,
-        "-i",
-        audio,
-        "-c:v",
-        "copy",
-        "-c:a",
-        "aac",
-        "-shortest",
-        str(out_path),
-    ]
+def mux_clip_with_audio(
+    clip: str, audio: str, out_path: Path, width: int, height: int, fps: int, pad_seconds: float = 0.0
+) -> None:
+    """复用时统一编码参数（H.264 Main yuv420p / AAC 44.1k 立体声），使拼接可直接 stream copy。
+
+    片段本身已符合目标参数时只复制视频流，不重新编码。pad_seconds > 0 时定格末帧补足到旁白结束。
+    """
+    w, h = max(2, width - width % 2), max(2, height - height % 2)
+    if matches_target(probe_media(clip), width, height, fps) and pad_seconds <= 0:
+        vargs = ["-c:v", "copy"]
+    else:
+        vf = f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps}"
+        if pad_seconds > 0:
+            vf += f",tpad=stop_mode=clone:stop_duration={pad_seconds:.3f}"
+        vargs = ["-vf", vf, "-c:v", "libx264", "-pix_fmt", "yuv420p", "-profile:v", "main", "-r", str(fps)]
+    cmd = ["ffmpeg", "-y", "-i", clip, "-i", audio, "-map", "0:v:0", "-map", "1:a:0", *vargs, *AUDIO_ARGS]
+    cmd += ["-video_track_timescale", TRACK_TIMESCALE, "-shortest", str(out_path)]
     run_ffmpeg(cmd, f"mux {clip} + {audio}")
 
 
@@ -194,33 +213,20 @@ def normalize_storyboard(scenes: int, storyboard: List[Dict]) -> List[Dict]:
 
 
 def concat_videos(video_paths: List[Path], out_path: Path) -> None:
+    """参数一致时 stream copy 拼接（零重编码），否则回退到一次性重编码。"""
     with tempfile.NamedTemporaryFile("w", delete=False) as tf:
         for path in video_paths:
             tf.write(f"file '{path.resolve().as_posix()}'\n")
         list_path = tf.name
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-f",
-        "concat",
-        "-safe",
-        "0",
-        "-i",
-        list_path,
-        "-c:v",
-        "libx264",
-        "-pix_fmt",
-        "yuv420p",
-        "-profile:v",
-        "main",
-        "-c:a",
-        "aac",
-        "-b:a",
-        "128k",
-        "-movflags",
-        "+faststart",
-        str(out_path),
-    ]
+    base = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    tail = ["-movflags", "+faststart", str(out_path)]
+    if can_stream_copy([probe_media(str(path)) for path in video_paths]):
+        try:
+            run_ffmpeg(base + ["-c", "copy"] + tail, "concat videos (stream copy)")
+            return
+        except RuntimeError as exc:
+            print(f"[WARN] stream-copy concat failed, re-encoding: {exc}")
+    cmd = base + ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-profile:v", "main", "-c:a", "aac", "-b:a", "128k"] + tail
     run_ffmpeg(cmd, "concat videos")
 
 
@@ -254,15 +260,21 @@ def orchestrate(args) -> Path:
 
     print("4) IMG2VID ...")
     effective_fps = min(max(args.fps, 4), 30)
+    max_frames = img2vid_max_frames(args.max_video_frames)
     clips: List[Tuple[str, str]] = []
+    pads: Dict[str, float] = {}
     for scene_id, frame_path in frames:
         audio_meta = audio_map.get(scene_id)
         if not audio_meta:
             raise RuntimeError(f"Missing audio for scene {scene_id}")
         # 使用音频时长确保视频不短于旁白
         desired_frames = max(args.video_frames, math.ceil(audio_meta["duration"] * effective_fps))
-        num_frames = min(desired_frames, 48)  # API 上限 48
-        clip = step_img2vid([(scene_id, frame_path)], effective_fps, num_frames)[0]
+        # 超过单窗口长度时 img2vid 服务按重叠窗口分段生成；超过服务上限的部分在 mux 时定格末帧补足
+        clip_frames = min(desired_frames, max_frames)
+        if clip_frames < desired_frames:
+            pads[scene_id] = audio_meta["duration"] - clip_frames / effective_fps
+            print(f"[WARN] {scene_id}: narration needs {desired_frames} frames, img2vid max is {max_frames}; padding {pads[scene_id]:.1f}s")
+        clip = step_img2vid([(scene_id, frame_path)], effective_fps, clip_frames)[0]
         clips.append(clip)
 
     print("5) Mux and concat ...")
@@ -274,7 +286,9 @@ def orchestrate(args) -> Path:
             raise RuntimeError(f"Missing audio for scene {scene_id}")
         audio_path = audio_map[scene_id]["path"]
         out_clip = tmp_dir / f"{scene_id}_mux.mp4"
-        mux_clip_with_audio(clip_path, audio_path, out_clip)
+        mux_clip_with_audio(
+            clip_path, audio_path, out_clip, args.width, args.height, effective_fps, pads.get(scene_id, 0.0)
+        )
         muxed_paths.append(out_clip)
 
     final_dir = DATA_ROOT / "final"
@@ -295,6 +309,7 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--cfg-scale", type=float, default=1.5, help="guidance scale")
     p.add_argument("--fps", type=int, default=12, help="生成视频 fps")
     p.add_argument("--video-frames", type=int, default=16, help="生成视频总帧数")
+    p.add_argument("--max-video-frames", type=int, default=0, help="单个片段最大帧数（默认读取 img2vid /health 的 max_frames）")
     p.add_argument("--speaker", default="", help="TTS 说话人，不填则用默认")
     p.add_argument("--speed", type=float, default=1.0, help="TTS 语速 0.5~2.0")
     p.add_argument("--base-url", default=DEFAULT_BASE_URL, help="模型节点基础地址（默认 env MODEL_BASE_URL 或 http://localhost:8000）")
@@ -13,7 +13,8 @@ if command -v conda >/dev/null 2>&1; then
 fi
 
 export MODEL_ID="${MODEL_ID:-stabilityai/sd-turbo}"
-export DEVICE="${DEVICE:-cuda}"
+export DEVICE="${DEVICE:-}"
+export TXT2IMG_PROFILE="${TXT2IMG_PROFILE:-auto}"
 export OUTPUT_DIR="${OUTPUT_DIR:-data/frames}"
 
 uvicorn model.services.txt2img:app --host 0.0.0.0 --port 8002
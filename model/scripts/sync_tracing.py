@@ -0,0 +1,42 @@
+"""
+Regenerate the queue worker's copy of model/tracing.py, or check that it is up to date.
+重新生成队列 worker 中的 tracing.py 副本，或检查其是否与 model/tracing.py 一致。
+
+QueueFRPTOS/python_worker is deployed without the rest of the repo, so it ships a generated copy.
+Run after editing model/tracing.py:
+    python -m model.scripts.sync_tracing          # rewrite the copy
+    python -m model.scripts.sync_tracing --check  # exit 1 if the copy is stale
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SOURCE = REPO_ROOT / "model" / "tracing.py"
+COPIES = [REPO_ROOT / "QueueFRPTOS" / "python_worker" / "tracing.py"]
+HEADER = "# Generated from model/tracing.py by `python -m model.scripts.sync_tracing`; do not edit.\n"
+
+
+def render() -> str:
+    return HEADER + SOURCE.read_text(encoding="utf-8")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Sync generated copies of model/tracing.py")
+    p.add_argument("--check", action="store_true", help="只检查，不写文件；副本过期时返回 1")
+    args = p.parse_args()
+
+    expected = render()
+    stale = [path for path in COPIES if not path.exists() or path.read_text(encoding="utf-8") != expected]
+    if args.check:
+        for path in stale:
+            print(f"[ERROR] {path.relative_to(REPO_ROOT)} is out of date; run python -m model.scripts.sync_tracing", file=sys.stderr)
+        sys.exit(1 if stale else 0)
+    for path in stale:
+        path.write_text(expected, encoding="utf-8")
+        print(f"updated {path.relative_to(REPO_ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
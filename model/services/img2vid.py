@@ -1,38 +1,88 @@
 """FastAPI image-to-video service using Stable-Video-Diffusion-Img2Vid (diffusers)."""
 
+import asyncio
+import hashlib
 import os
 import time
 import uuid
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
+import numpy as np
 import torch
 from diffusers import StableVideoDiffusionPipeline
 from diffusers.utils import export_to_video
 from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from PIL import Image
 from pydantic import BaseModel, Field
-from model.services.utils import resolve_project_root
-
-router = APIRouter()
+from model.services.metrics import metered_route, metrics_response, watch
+from model.tracing import TraceMiddleware
+from model.services.utils import (
+    ArtifactCache,
+    CancelRegistry,
+    DeadlineExceeded,
+    InferenceWorker,
+    JobCancelled,
+    ManagedModel,
+    SingleFlight,
+    artifacts,
+    release_accelerator_memory,
+    resolve_project_root,
+    wait_eager_loads,
+)
+
+router = APIRouter(route_class=metered_route("img2vid"))
 
 PROJECT_ROOT = resolve_project_root()
 MODEL_ID = os.getenv("MODEL_ID", "stabilityai/stable-video-diffusion-img2vid")
 DEVICE = os.getenv("DEVICE", "cuda")
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", PROJECT_ROOT / "data/clips"))
+# Clip cache bounded by total bytes; IMG2VID_CACHE_MAX_MB=0 disables it.
+CACHE_DIR = Path(os.getenv("IMG2VID_CACHE_DIR", PROJECT_ROOT / "data/cache/clips"))
+CACHE_MAX_MB = int(os.getenv("IMG2VID_CACHE_MAX_MB", "8192"))
+# Unseeded requests are re-sampled every time (regenerating a clip must give a new one); 1 caches them too.
+CACHE_UNSEEDED = os.getenv("IMG2VID_CACHE_UNSEEDED", "0").strip().lower() in ("1", "true", "yes", "on")
+# Longer clips are generated as overlapping windows of WINDOW_FRAMES, each conditioned on a frame
+# near the end of the previous one, and streamed into the MP4 so memory does not grow with length.
+MAX_FRAMES = max(8, int(os.getenv("IMG2VID_MAX_FRAMES", "1200")))
+WINDOW_FRAMES = max(8, int(os.getenv("IMG2VID_WINDOW_FRAMES", "25")))
+WINDOW_OVERLAP = max(1, min(int(os.getenv("IMG2VID_WINDOW_OVERLAP", "2")), WINDOW_FRAMES // 2))
+# Frames per VAE decode call; smaller keeps peak memory flat at some speed cost (0 = decode all at once).
+DECODE_CHUNK = max(0, int(os.getenv("IMG2VID_DECODE_CHUNK", "8")))
+# Sequential CPU offload keeps SVD small on the GPU but is slow; set 0 when MODEL_MEMORY_BUDGET_MB
+# (or a dedicated GPU) already guarantees room for the whole pipeline.
+CPU_OFFLOAD = os.getenv("IMG2VID_CPU_OFFLOAD", "1").strip().lower() in ("1", "true", "yes", "on")
 
 pipe = None  # lazy loaded
+clip_cache = ArtifactCache(CACHE_DIR, ".mp4", max_bytes=CACHE_MAX_MB * 1024 * 1024, enabled=CACHE_MAX_MB > 0)
+inflight = SingleFlight()
+cancels = CancelRegistry()
+# All pipeline work runs on this thread, one call at a time; the event loop only does I/O.
+worker = InferenceWorker("img2vid")
+# eager | background | lazy (see ManagedModel); IMG2VID_IDLE_UNLOAD seconds > 0 frees an unused model.
+LOAD_POLICY = os.getenv("IMG2VID_LOAD_POLICY", os.getenv("MODEL_LOAD_POLICY", "background")).strip().lower()
+IDLE_UNLOAD = float(os.getenv("IMG2VID_IDLE_UNLOAD", os.getenv("MODEL_IDLE_UNLOAD", "0")))
+# Expected resident size (SVD fp16 weights) for MODEL_MEMORY_BUDGET_MB; refined by measurement after loading.
+MEMORY_MB = float(os.getenv("IMG2VID_MEMORY_MB", "4600"))
 
 
 class GenerateRequest(BaseModel):
     frame: str = Field(..., description="输入单帧图片路径（PNG/JPG）")
+    artifact_id: Optional[str] = Field(None, description="同进程 txt2img 返回的 artifact_id；可解析时直接使用内存中的图像，否则读取 frame")
     scene_id: Optional[str] = Field(None, description="用于输出文件命名")
     fps: int = Field(12, ge=4, le=30)
-    num_frames: int = Field(14, ge=8, le=48)
+    num_frames: int = Field(14, ge=8, le=MAX_FRAMES)
     motion_bucket_id: int = Field(127, ge=1, le=255)
     noise_aug_strength: float = Field(0.1, ge=0.0, le=1.0)
     num_inference_steps: int = Field(25, ge=5, le=50)
     seed: Optional[int] = None
+    job_id: Optional[str] = Field(None, description="网关任务 ID，用于 /cancel 中断")
+    deadline: Optional[float] = Field(None, description="Unix 时间戳（秒）；排队超过该时间的请求不再推理")
+
+
+class CancelRequest(BaseModel):
+    job_id: str
 
 
 class GenerateResponse(BaseModel):
@@ -62,6 +112,8 @@ def load_pipeline():
     except Exception:
         pass
     try:
+        if not CPU_OFFLOAD:
+            raise RuntimeError("cpu offload disabled")
         p.enable_sequential_cpu_offload()
     except Exception:
         try:
@@ -72,6 +124,15 @@ def load_pipeline():
     pipe = p
 
 
+def unload_pipeline():
+    global pipe  # noqa: PLW0603
+    pipe = None
+    release_accelerator_memory()
+
+
+loader = ManagedModel("img2vid", load_pipeline, unload_pipeline, worker, LOAD_POLICY, IDLE_UNLOAD, MEMORY_MB)
+
+
 def _slug(text: str) -> str:
     keep = []
     for ch in text:
@@ -91,64 +152,285 @@ def load_image(path: str) -> Image.Image:
         raise HTTPException(status_code=400, detail=f"Failed to open image: {exc}") from exc
 
 
-def save_video(frames, fps: int, scene_id: Optional[str], seed: Optional[int]) -> str:
+def _output_path(scene_id: Optional[str], seed: Optional[int]) -> Path:
     ensure_output_dir()
     base = scene_id or _slug(str(uuid.uuid4())[:8])
     ts = int(time.time())
-    filename = f"{base}_{seed or 'seed'}_{ts}.mp4"
-    out_path = OUTPUT_DIR / filename
+    return OUTPUT_DIR / f"{base}_{seed or 'seed'}_{ts}.mp4"
+
+
+def save_video(frames, fps: int, scene_id: Optional[str], seed: Optional[int]) -> str:
+    out_path = _output_path(scene_id, seed)
     export_to_video(frames, out_path, fps=fps)
     return str(out_path)
 
 
+class ClipWriter:
+    """Append PIL frames to an MP4 as windows finish (same OpenCV mp4v writer export_to_video uses)."""
+
+    def __init__(self, path: Path, fps: int) -> None:
+        import cv2  # required by diffusers.utils.export_to_video as well
+
+        self._cv2 = cv2
+        self.path = path
+        self.fps = fps
+        self.frames = 0
+        self._writer = None
+
+    def write(self, frames: List[Image.Image]) -> None:
+        for frame in frames:
+            rgb = np.asarray(frame.convert("RGB"))
+            if self._writer is None:
+                height, width = rgb.shape[:2]
+                fourcc = self._cv2.VideoWriter_fourcc(*"mp4v")
+                self._writer = self._cv2.VideoWriter(str(self.path), fourcc, self.fps, (width, height))
+            self._writer.write(self._cv2.cvtColor(rgb, self._cv2.COLOR_RGB2BGR))
+            self.frames += 1
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+def _pixel_digest(image: Image.Image) -> str:
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _cached(req: GenerateRequest, key: str) -> Optional[Dict]:
+    """Cache hit exported to a fresh OUTPUT_DIR path, or None on a miss."""
+    cached = clip_cache.get(key)
+    if not cached:
+        return None
+    src, meta = cached
+    seed = meta.get("seed", req.seed)
+    path = _output_path(req.scene_id, seed)
+    if not clip_cache.export(src, path):
+        return None
+    return {"video": str(path), "fps": req.fps, "seed": seed}
+
+
+def cache_key(req: GenerateRequest, image: Optional[Image.Image] = None) -> Optional[str]:
+    """Hash of the input frame (file bytes, or pixels for an in-memory artifact) plus every
+    sampling parameter; None when caching is off."""
+    if not clip_cache.enabled or (req.seed is None and not CACHE_UNSEEDED):
+        return None
+    if image is not None:
+        frame_digest = _pixel_digest(image)
+    else:
+        try:
+            frame_digest = ArtifactCache.file_digest(Path(req.frame))
+        except OSError as exc:
+            raise HTTPException(status_code=400, detail=f"Failed to open image: {exc}") from exc
+    return ArtifactCache.make_key(
+        frame_digest,
+        req.fps,
+        req.num_frames,
+        req.motion_bucket_id,
+        req.noise_aug_strength,
+        req.num_inference_steps,
+        req.seed,
+        MODEL_ID,
+        # Windowing changes the pixels; single-pass keys stay as they were.
+        *((WINDOW_FRAMES, WINDOW_OVERLAP) if req.num_frames > WINDOW_FRAMES else ()),
+    )
+
+
 async def _startup():
-    load_pipeline()
+    # Only the app actually being served runs this, so txt2img hands off in memory only when co-hosted.
+    artifacts.attach("img2vid")
+    loader.start()
+
+
+async def _shutdown():
+    loader.stop()
+
+
+@router.get("/ready")
+async def ready():
+    return JSONResponse(loader.status(), status_code=200 if loader.ready else 503)
 
 
 @router.get("/health")
 async def health():
-    return {"status": "ok", "model": MODEL_ID, "device": DEVICE, "output_dir": str(OUTPUT_DIR)}
+    return {
+        "status": "ok",
+        "model": MODEL_ID,
+        "device": DEVICE,
+        "output_dir": str(OUTPUT_DIR),
+        "cache": clip_cache.stats(),
+        "inflight": len(inflight),
+        "coalesced": inflight.coalesced,
+        "interrupted": cancels.interrupted,
+        "max_frames": MAX_FRAMES,
+        "window_frames": WINDOW_FRAMES,
+        "window_overlap": WINDOW_OVERLAP,
+        "decode_chunk": DECODE_CHUNK,
+        "queue": worker.stats(),
+        "model_state": loader.status(),
+        "artifacts": artifacts.stats(),
+    }
+
+
+@router.post("/cancel")
+async def cancel(req: CancelRequest):
+    """Stop generation for a gateway job at the next denoising step."""
+    cancels.cancel(req.job_id)
+    return {"job_id": req.job_id, "cancelled": True}
+
+
+@router.delete("/cancel/{job_id}")
+async def uncancel(job_id: str):
+    """Forget a cancellation so a resumed job with the same id runs again."""
+    return {"job_id": job_id, "cleared": cancels.clear(job_id)}
 
 
 @router.post("/generate", response_model=GenerateResponse, name="img2vid_generate")
 @router.post("/img2vid", response_model=GenerateResponse, include_in_schema=False)
 async def generate(req: GenerateRequest):
-    if pipe is None:
-        load_pipeline()
-    image = load_image(req.frame)
-    gen = None
-    if req.seed is not None:
-        try:
-            gen = torch.Generator(device=DEVICE).manual_seed(int(req.seed))
-        except Exception:
-            gen = torch.Generator().manual_seed(int(req.seed))
+    # Keyframe still in memory when txt2img runs in this process: skip the PNG decode (and disk read).
+    shared = artifacts.get(req.artifact_id)
+    image = shared.convert("RGB") if shared is not None else None
+    # Hashing the frame and copying clips in/out of the cache is disk-bound; keep it off the event loop.
+    key = await asyncio.to_thread(cache_key, req, image)
+    if key is None:
+        return await _generate(req, image)
+    cached = await asyncio.to_thread(_cached, req, key)
+    if cached:
+        return cached
+
+    async def _generate_and_cache():
+        result = await _generate(req, image)
+        await asyncio.to_thread(clip_cache.put, key, Path(result["video"]), {"seed": result["seed"], "frame": req.frame})
+        return result
+
+    # Identical concurrent requests share one inference.
+    return await inflight.run(key, _generate_and_cache)
+
+
+def _infer(kwargs: Dict, job_id: Optional[str]):
+    """Runs on the inference thread."""
+    if cancels.is_cancelled(job_id):
+        raise JobCancelled(job_id)
+    return pipe(**kwargs)
+
+
+def _generator(seed: Optional[int]):
+    if seed is None:
+        return None
+    try:
+        return torch.Generator(device=DEVICE).manual_seed(int(seed))
+    except Exception:
+        return torch.Generator().manual_seed(int(seed))
+
+
+def _infer_windows(kwargs: Dict, total: int, seed: Optional[int], job_id: Optional[str], out_path: Path, fps: int) -> int:
+    """Runs on the inference thread: generate `total` frames as overlapping windows into `out_path`.
+
+    Window n+1 is conditioned on the first of the last WINDOW_OVERLAP frames of window n; those
+    frames are cross-faded with the start of window n+1, so only WINDOW_OVERLAP frames are held
+    between windows. Returns the number of frames written.
+    """
+    writer = ClipWriter(out_path, fps)
+    image = kwargs["image"]
+    tail: List[Image.Image] = []
+    written = 0
+    index = 0
+    try:
+        while written < total:
+            remaining = total - written  # includes the held-back tail
+            count = min(WINDOW_FRAMES, max(remaining, 8))
+            window_kwargs = dict(kwargs, image=image, num_frames=count, generator=_generator(None if seed is None else seed + index))
+            result = _infer(window_kwargs, job_id)
+            frames = list(result.frames[0]) if hasattr(result, "frames") else []
+            if len(frames) <= len(tail):
+                raise RuntimeError(f"window {index} returned {len(frames)} frames")
+            if tail:
+                steps = len(tail) + 1
+                frames[: len(tail)] = [
+                    Image.blend(old, new.resize(old.size), (pos + 1) / steps)
+                    for pos, (old, new) in enumerate(zip(tail, frames))
+                ]
+            if count >= remaining:
+                writer.write(frames[:remaining])
+                written += remaining
+                break
+            writer.write(frames[:-WINDOW_OVERLAP])
+            written += len(frames) - WINDOW_OVERLAP
+            tail = frames[-WINDOW_OVERLAP:]
+            image = tail[0]
+            index += 1
+    except BaseException:
+        writer.close()
+        out_path.unlink(missing_ok=True)
+        raise
+    writer.close()
+    return written
+
+
+async def _generate(req: GenerateRequest, image: Optional[Image.Image] = None):
+    if image is None:
+        image = load_image(req.frame)
+    kwargs = {
+        "image": image,
+        "num_frames": req.num_frames,
+        "fps": req.fps,
+        "motion_bucket_id": req.motion_bucket_id,
+        "noise_aug_strength": req.noise_aug_strength,
+        "num_inference_steps": req.num_inference_steps,
+        "generator": _generator(req.seed),
+    }
+    if DECODE_CHUNK:
+        kwargs["decode_chunk_size"] = DECODE_CHUNK
+    callback = cancels.step_callback(req.job_id)
+    if callback:
+        kwargs["callback_on_step_end"] = callback
+    windowed = req.num_frames > WINDOW_FRAMES
     try:
-        result = pipe(
-            image=image,
-            num_frames=req.num_frames,
-            fps=req.fps,
-            motion_bucket_id=req.motion_bucket_id,
-            noise_aug_strength=req.noise_aug_strength,
-            num_inference_steps=req.num_inference_steps,
-            generator=gen,
-        )
+        async with loader.use(req.deadline):
+            if windowed:
+                out_path = _output_path(req.scene_id, req.seed)
+                await worker.submit(
+                    _infer_windows, kwargs, req.num_frames, req.seed, req.job_id, out_path, req.fps, deadline=req.deadline
+                )
+            else:
+                result = await worker.submit(_infer, kwargs, req.job_id, deadline=req.deadline)
+    except JobCancelled as exc:
+        raise HTTPException(status_code=409, detail=f"Job cancelled: {exc}") from exc
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail=str(exc)) from exc
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Generation failed: {exc}") from exc
+    if windowed:
+        return {"video": str(out_path), "fps": req.fps, "seed": req.seed}
     frames = result.frames[0] if hasattr(result, "frames") else []
     if not frames:
         raise HTTPException(status_code=500, detail="No frames generated")
-    video_path = save_video(frames, req.fps, req.scene_id, req.seed)
+    video_path = await asyncio.to_thread(save_video, frames, req.fps, req.scene_id, req.seed)
     return {"video": video_path, "fps": req.fps, "seed": req.seed}
 
 
+watch("img2vid", worker=worker, caches={"clip": clip_cache, "artifacts": artifacts}, loader=loader)
+
+
+@router.get("/metrics")
+async def metrics():
+    return metrics_response()
+
+
 def register_app(app: FastAPI, prefix: str = "") -> None:
     app.include_router(router, prefix=prefix)
     app.add_event_handler("startup", _startup)
+    app.add_event_handler("shutdown", _shutdown)
 
 
 def create_app() -> FastAPI:
     app = FastAPI(title="IMG2VID Service (SVD Img2Vid)", version="0.1.0")
     register_app(app)
+    app.add_event_handler("startup", wait_eager_loads)
+    app.add_middleware(TraceMiddleware)
     return app
 
 
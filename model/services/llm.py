@@ -7,11 +7,20 @@ from typing import List, Optional
 import httpx
 from fastapi import APIRouter, FastAPI, HTTPException
 from pydantic import BaseModel, Field
+from model.services.metrics import INFERENCE_SECONDS, metered_route, metrics_response, watch
+from model.tracing import SpanKind, TraceMiddleware, inject, tracer
+from model.services.utils import ArtifactCache, SingleFlight, TTLCache
 
-router = APIRouter()
+router = APIRouter(route_class=metered_route("llm"))
 
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5:0.5b")
+# Memoized storyboards (LLM_CACHE_SIZE=0 or LLM_CACHE_TTL=0 disables)
+CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+
+storyboard_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+inflight = SingleFlight()
 
 
 class StoryboardRequest(BaseModel):
@@ -62,8 +71,9 @@ async def call_ollama(req: StoryboardRequest) -> List[StoryboardItem]:
         "stream": False,
     }
     url = f"{OLLAMA_HOST}/api/chat"
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        resp = await client.post(url, json=payload)
+    with tracer.start_as_current_span("POST ollama", kind=SpanKind.CLIENT, attributes={"llm.model": LLM_MODEL}):
+        async with httpx.AsyncClient(timeout=120.0) as client:
+            resp = await client.post(url, json=payload, headers=inject())
     if resp.status_code != 200:
         raise HTTPException(status_code=502, detail=f"Ollama error: {resp.text}")
     data = resp.json()
@@ -99,20 +109,64 @@ async def call_ollama(req: StoryboardRequest) -> List[StoryboardItem]:
     return sanitized
 
 
+def storyboard_key(req: StoryboardRequest) -> str:
+    """Key on the whitespace-normalized request plus the model that will answer it."""
+    story = " ".join(req.story.split())
+    style = " ".join((req.style or "").split())
+    return ArtifactCache.make_key(story, style, req.scenes, LLM_MODEL)
+
+
+async def cached_storyboard(req: StoryboardRequest) -> List[StoryboardItem]:
+    """call_ollama behind a TTL/LRU cache; identical in-flight requests share one Ollama call.
+
+    Only storyboards with exactly `req.scenes` items are cached, so callers that retry
+    on a scene-count mismatch (run_pipeline.py) still get a fresh sample.
+    """
+    key = storyboard_key(req)
+    items = storyboard_cache.get(key)
+    if items is None:
+
+        async def _fetch() -> List[StoryboardItem]:
+            with INFERENCE_SECONDS.labels("llm").time():
+                fresh = await call_ollama(req)
+            if len(fresh) == req.scenes:
+                storyboard_cache.put(key, fresh)
+            return fresh
+
+        items = await inflight.run(key, _fetch)
+    # Hand out copies so per-request fixups never touch the cached/shared list.
+    return [item.copy() for item in items]
+
+
 @router.get("/health")
 async def health():
-    return {"status": "ok", "model": LLM_MODEL, "ollama": OLLAMA_HOST}
+    return {
+        "status": "ok",
+        "model": LLM_MODEL,
+        "ollama": OLLAMA_HOST,
+        "cache": storyboard_cache.stats(),
+        "inflight": len(inflight),
+        "coalesced": inflight.coalesced,
+    }
 
 
 @router.post("/storyboard", response_model=StoryboardResponse)
 async def generate_storyboard(req: StoryboardRequest):
-    items = await call_ollama(req)
+    items = await cached_storyboard(req)
     for idx, item in enumerate(items, start=1):
         if not item.scene_id:
             item.scene_id = f"s{idx}"
     return {"storyboard": items}
 
 
+watch("llm", caches={"storyboard": storyboard_cache})
+
+
+@router.get("/metrics")
+async def metrics():
+    return metrics_response()
+
+
 def register_app(app: FastAPI, prefix: str = "") -> None:
     app.include_router(router, prefix=prefix)
 
@@ -120,6 +174,7 @@ def register_app(app: FastAPI, prefix: str = "") -> None:
 def create_app() -> FastAPI:
     app = FastAPI(title="LLM Storyboard Service", version="0.1.0")
     register_app(app)
+    app.add_middleware(TraceMiddleware)
     return app
 
 
@@ -0,0 +1,138 @@
+"""Prometheus metrics for the model services (`GET <prefix>/metrics`).
+
+Services imported into one process (model/main.py) share the default registry, so each
+`/metrics` route exposes the whole process; every series carries a `service` (or `model`) label.
+Queue, cache, batch and model-state numbers are read from the live objects at scrape time.
+"""
+
+import time
+from typing import Callable, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.exceptions import HTTPException
+
+# Seconds; covers cache hits through multi-minute video generations.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REQUESTS = Counter("s2v_requests_total", "HTTP requests handled", ["service", "method", "endpoint", "status"])
+REQUEST_SECONDS = Histogram(
+    "s2v_request_seconds",
+    "HTTP request latency until the response starts",
+    ["service", "method", "endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+INFERENCE_SECONDS = Histogram(
+    "s2v_inference_seconds",
+    "Wall time of one call on the inference worker (model loads included)",
+    ["service"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def metered_route(service: str) -> type:
+    """APIRoute class that counts and times every request to a router's endpoints."""
+
+    class MeteredRoute(APIRoute):
+        def get_route_handler(self) -> Callable:
+            handler = super().get_route_handler()
+            endpoint = self.path
+
+            async def metered(request: Request) -> Response:
+                start = time.perf_counter()
+                status = 500
+                try:
+                    response = await handler(request)
+                    status = response.status_code
+                    return response
+                except HTTPException as exc:
+                    status = exc.status_code
+                    raise
+                finally:
+                    REQUESTS.labels(service, request.method, endpoint, str(status)).inc()
+                    REQUEST_SECONDS.labels(service, request.method, endpoint).observe(time.perf_counter() - start)
+
+            return metered
+
+    return MeteredRoute
+
+
+class _ServiceCollector:
+    """Scrape-time view of the registered workers, caches, batchers and managed models."""
+
+    def __init__(self) -> None:
+        self.workers: Dict[str, object] = {}
+        self.caches: Dict[tuple, object] = {}
+        self.batchers: Dict[str, object] = {}
+        self.models: Dict[str, object] = {}
+
+    def collect(self):
+        depth = GaugeMetricFamily("s2v_inference_queue_depth", "Calls waiting for the inference worker", labels=["service"])
+        busy = GaugeMetricFamily("s2v_inference_busy", "1 while the inference worker runs a call", labels=["service"])
+        jobs = CounterMetricFamily("s2v_inference_jobs", "Inference calls by outcome", labels=["service", "outcome"])
+        for service, worker in self.workers.items():
+            depth.add_metric([service], worker.depth())
+            busy.add_metric([service], 1 if worker.busy else 0)
+            for outcome in ("processed", "failed", "expired", "abandoned"):
+                jobs.add_metric([service, outcome], getattr(worker, outcome))
+        yield from (depth, busy, jobs)
+
+        hits = CounterMetricFamily("s2v_cache_hits", "Cache lookups that hit", labels=["service", "cache"])
+        misses = CounterMetricFamily("s2v_cache_misses", "Cache lookups that missed", labels=["service", "cache"])
+        ratio = GaugeMetricFamily("s2v_cache_hit_ratio", "Hits / lookups since start", labels=["service", "cache"])
+        for (service, name), cache in self.caches.items():
+            lookups = cache.hits + cache.misses
+            hits.add_metric([service, name], cache.hits)
+            misses.add_metric([service, name], cache.misses)
+            ratio.add_metric([service, name], cache.hits / lookups if lookups else 0.0)
+        yield from (hits, misses, ratio)
+
+        batches = CounterMetricFamily("s2v_batches", "Micro-batches run", labels=["service"])
+        items = CounterMetricFamily("s2v_batch_items", "Items run through micro-batches", labels=["service"])
+        pending = GaugeMetricFamily("s2v_batch_pending", "Items waiting in an open batch window", labels=["service"])
+        for service, batcher in self.batchers.items():
+            stats = batcher.stats()
+            batches.add_metric([service], stats["batches"])
+            items.add_metric([service], stats["items"])
+            pending.add_metric([service], stats["pending"])
+        yield from (batches, items, pending)
+
+        resident = GaugeMetricFamily("s2v_model_resident", "1 while the model is loaded", labels=["model"])
+        active = GaugeMetricFamily("s2v_model_active", "Requests currently holding the model", labels=["model"])
+        loads = CounterMetricFamily("s2v_model_loads", "Model loads since start", labels=["model"])
+        load_seconds = GaugeMetricFamily("s2v_model_load_seconds", "Duration of the last model load", labels=["model"])
+        for name, model in self.models.items():
+            status = model.status()
+            resident.add_metric([name], 1 if model.resident else 0)
+            active.add_metric([name], status["active"])
+            loads.add_metric([name], status["loads"])
+            load_seconds.add_metric([name], status["load_seconds"] or 0.0)
+        yield from (resident, active, loads, load_seconds)
+
+
+_collector = _ServiceCollector()
+REGISTRY.register(_collector)
+
+
+def watch(
+    service: str,
+    worker=None,
+    caches: Optional[Dict[str, object]] = None,
+    batcher=None,
+    loader=None,
+) -> None:
+    """Expose a service's live objects on /metrics (anything with the matching counters/stats())."""
+    if worker is not None:
+        _collector.workers[service] = worker
+    for name, cache in (caches or {}).items():
+        _collector.caches[(service, name)] = cache
+    if batcher is not None:
+        _collector.batchers[service] = batcher
+    if loader is not None:
+        _collector.models[loader.name] = loader
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
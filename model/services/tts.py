@@ -1,19 +1,33 @@
 """FastAPI TTS service using local CosyVoice2 models."""
 
+import asyncio
 import os
+import struct
 import sys
+import threading
 import time
 import uuid
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Iterator, List, Optional, Tuple
 
 import numpy as np
 import soundfile as sf
 from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from model.services.utils import resolve_project_root
+from model.services.metrics import metered_route, metrics_response, watch
+from model.tracing import TraceMiddleware
+from model.services.utils import (
+    ArtifactCache,
+    DeadlineExceeded,
+    InferenceWorker,
+    ManagedModel,
+    release_accelerator_memory,
+    resolve_project_root,
+    wait_eager_loads,
+)
 
-router = APIRouter()
+router = APIRouter(route_class=metered_route("tts"))
 
 PROJECT_ROOT = resolve_project_root()
 COSYVOICE_ROOT = PROJECT_ROOT / "CosyVoice"
@@ -31,10 +45,31 @@ OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", PROJECT_ROOT / "data/audio"))
 ZERO_SHOT_AUDIO = PROJECT_ROOT / "CosyVoice" / "asset" / "zero_shot_prompt.wav"
 ZERO_SHOT_TEXT = "希望你以后能够做的比我还好呦。"
 ZERO_SHOT_ID = "zero_shot_demo"
+# Speaker for requests that name none; unset means the model's first speaker (known once it has loaded).
+DEFAULT_SPEAKER = os.getenv("TTS_DEFAULT_SPEAKER", "").strip() or None
+# Per-line narration cache; eviction by total size and/or entry count (0 = unbounded on that axis).
+CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", PROJECT_ROOT / "data/cache/audio"))
+CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "1024"))
+CACHE_MAX_ENTRIES = int(os.getenv("TTS_CACHE_MAX_ENTRIES", "0"))
+CACHE_ENABLED = os.getenv("TTS_CACHE", "1").strip().lower() in ("1", "true", "yes", "on")
 
 voice_model: Optional[CosyVoice2] = None
 default_speaker: Optional[str] = None
 available_speakers: List[str] = []
+audio_cache = ArtifactCache(
+    CACHE_DIR,
+    ".wav",
+    max_bytes=CACHE_MAX_MB * 1024 * 1024,
+    max_entries=CACHE_MAX_ENTRIES,
+    enabled=CACHE_ENABLED,
+)
+# CosyVoice inference runs on this thread, one line at a time; the event loop only does I/O.
+worker = InferenceWorker("tts")
+# eager | background | lazy (see ManagedModel); TTS_IDLE_UNLOAD seconds > 0 frees an unused model.
+LOAD_POLICY = os.getenv("TTS_LOAD_POLICY", os.getenv("MODEL_LOAD_POLICY", "background")).strip().lower()
+IDLE_UNLOAD = float(os.getenv("TTS_IDLE_UNLOAD", os.getenv("MODEL_IDLE_UNLOAD", "0")))
+# Expected resident size (CosyVoice2-0.5B) for MODEL_MEMORY_BUDGET_MB; refined by measurement after loading.
+MEMORY_MB = float(os.getenv("TTS_MEMORY_MB", "2000"))
 
 
 class Line(BaseModel):
@@ -47,6 +82,17 @@ class NarrationRequest(BaseModel):
     speaker: Optional[str] = Field(None, description="说话人/音色，如不指定使用默认")
     sample_rate: Optional[int] = Field(None, description="可选采样率，默认为模型采样率")
     speed: float = Field(1.0, ge=0.5, le=2.0)
+    deadline: Optional[float] = Field(None, description="Unix 时间戳（秒）；排队超过该时间的请求不再推理")
+
+
+class StreamRequest(BaseModel):
+    text: str
+    scene_id: Optional[str] = Field(None, description="用于输出文件命名")
+    speaker: Optional[str] = Field(None, description="说话人/音色，如不指定使用默认")
+    sample_rate: Optional[int] = Field(None, description="可选采样率，默认为模型采样率")
+    speed: float = Field(1.0, ge=0.5, le=2.0)
+    format: str = Field("wav", pattern="^(wav|pcm)$", description="wav：带流式 WAV 头；pcm：裸 16-bit 单声道 PCM")
+    deadline: Optional[float] = Field(None, description="Unix 时间戳（秒）；排队超过该时间的请求不再推理")
 
 
 class AudioItem(BaseModel):
@@ -104,6 +150,15 @@ def load_voice_model():
     default_speaker = spks[0] if spks else None
 
 
+def unload_voice_model():
+    global voice_model  # noqa: PLW0603
+    voice_model = None
+    release_accelerator_memory()
+
+
+loader = ManagedModel("tts", load_voice_model, unload_voice_model, worker, LOAD_POLICY, IDLE_UNLOAD, MEMORY_MB)
+
+
 def _slug(text: str) -> str:
     keep = []
     for ch in text:
@@ -116,26 +171,77 @@ def _slug(text: str) -> str:
 
 
 def synthesize(text: str, speaker: Optional[str], speed: float) -> (np.ndarray, int):
-    if voice_model is None:
-        raise RuntimeError("voice_model not loaded")
-    spk = speaker or default_speaker
+    audio, sr, _ = synthesize_checked(text, speaker, speed)
+    return audio, sr
+
+
+def _speaker(speaker: Optional[str]) -> str:
+    spk = speaker or DEFAULT_SPEAKER or default_speaker
     if spk is None:
         raise RuntimeError(
             f"No speaker available; please provide speaker id. "
             f"Available: {available_speakers or '[]'}"
         )
+    return spk
+
+
+def iter_speech(text: str, spk: str, speed: float, stream: bool = False) -> Iterator[np.ndarray]:
+    """Yield every chunk CosyVoice produces for `text` as a flat float32 array.
+
+    With stream=False there is one chunk per sentence CosyVoice splits the text into;
+    stream=True yields smaller pieces as soon as the vocoder emits them.
+    """
+    if voice_model is None:
+        raise RuntimeError("voice_model not loaded")
+    for out in voice_model.inference_sft(tts_text=text, spk_id=spk, stream=stream, speed=speed):
+        yield np.asarray(out["tts_speech"], dtype=np.float32).reshape(-1)
+
+
+def synthesize_checked(text: str, speaker: Optional[str], speed: float) -> Tuple[np.ndarray, int, bool]:
+    """Like synthesize, plus whether real speech came back (False for the silence fallback)."""
+    if voice_model is None:
+        raise RuntimeError("voice_model not loaded")
+    spk = _speaker(speaker)
     try:
-        gen = voice_model.inference_sft(tts_text=text, spk_id=spk, stream=False, speed=speed)
-        audio_np = None
-        for out in gen:
-            audio_np = out["tts_speech"]
-            break
-        if audio_np is None:
+        chunks = list(iter_speech(text, spk, speed))
+        if not chunks:
             raise RuntimeError("CosyVoice2 returned empty audio")
-        return audio_np.squeeze(), voice_model.sample_rate
+        return np.concatenate(chunks), voice_model.sample_rate, True
     except Exception as exc:  # noqa: BLE001
         print(f"[WARN] TTS synthesize fallback to silence for speaker={spk}: {exc}")
-        return generate_silence(0.2)
+        audio_np, sr = generate_silence(0.2)
+        return audio_np, sr, False
+
+
+def synthesize_stream(
+    text: str, speaker: Optional[str], speed: float, emit: Callable[[np.ndarray], None], stop: threading.Event
+) -> int:
+    """Runs on the inference thread: hand each chunk to `emit` as it is produced; returns the chunk count."""
+    spk = _speaker(speaker)
+    count = 0
+    for chunk in iter_speech(text, spk, speed, stream=True):
+        if stop.is_set():
+            break
+        emit(chunk)
+        count += 1
+    if not count and not stop.is_set():
+        raise RuntimeError("CosyVoice2 returned empty audio")
+    return count
+
+
+def pcm16(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def wav_header(sample_rate: int, data_bytes: int = 0xFFFFFFFF, channels: int = 1) -> bytes:
+    """16-bit PCM WAV header; the default sizes mark a stream of unknown length."""
+    riff_bytes = 0xFFFFFFFF if data_bytes == 0xFFFFFFFF else 36 + data_bytes
+    block_align = channels * 2
+    return (
+        struct.pack("<4sI4s", b"RIFF", riff_bytes, b"WAVE")
+        + struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16)
+        + struct.pack("<4sI", b"data", data_bytes)
+    )
 
 
 def generate_silence(duration_sec: float) -> (np.ndarray, int):
@@ -144,18 +250,63 @@ def generate_silence(duration_sec: float) -> (np.ndarray, int):
     return np.zeros(samples, dtype=np.float32), sr
 
 
-def save_audio(audio: np.ndarray, sample_rate: int, scene_id: str) -> str:
+def _audio_path(scene_id: str) -> Path:
     ensure_output_dir()
     base = _slug(scene_id) if scene_id else _slug(str(uuid.uuid4())[:8])
     ts = int(time.time())
-    filename = f"{base}_{ts}.wav"
-    path = OUTPUT_DIR / filename
+    return OUTPUT_DIR / f"{base}_{ts}.wav"
+
+
+def save_audio(audio: np.ndarray, sample_rate: int, scene_id: str) -> str:
+    path = _audio_path(scene_id)
     sf.write(path, audio, sample_rate)
     return str(path)
 
 
+def _cached_lines(lines: List, keys: List[Optional[str]]) -> List[Optional[AudioItem]]:
+    """Cache hits exported to fresh OUTPUT_DIR paths (eviction must not reach returned files); None per miss."""
+    hits: List[Optional[AudioItem]] = []
+    for line, key in zip(lines, keys):
+        cached = audio_cache.get(key) if key else None
+        if cached:
+            src, meta = cached
+            path = _audio_path(line.scene_id)
+            if audio_cache.export(src, path):
+                hits.append(AudioItem(scene_id=line.scene_id, audio=str(path), sample_rate=int(meta["sample_rate"])))
+                continue
+        hits.append(None)
+    return hits
+
+
+def _cached_pcm(key: str) -> Optional[Tuple[bytes, int]]:
+    """16-bit PCM of a cached line, or None on a miss (including an entry evicted mid-read)."""
+    cached = audio_cache.get(key)
+    if not cached:
+        return None
+    try:
+        data, sr = sf.read(str(cached[0]), dtype="int16")
+    except Exception:  # noqa: BLE001
+        return None
+    return data.astype("<i2").tobytes(), sr
+
+
+def line_cache_key(text: str, req) -> str:
+    # Independent of load state, so cached lines are served without loading CosyVoice. With no
+    # speaker requested or configured the key stands for "MODEL_ID's default speaker".
+    return ArtifactCache.make_key(text, req.speaker or DEFAULT_SPEAKER, req.speed, req.sample_rate, MODEL_ID)
+
+
 async def _startup():
-    load_voice_model()
+    loader.start()
+
+
+async def _shutdown():
+    loader.stop()
+
+
+@router.get("/ready")
+async def ready():
+    return JSONResponse(loader.status(), status_code=200 if loader.ready else 503)
 
 
 @router.get("/health")
@@ -165,8 +316,11 @@ async def health():
         "model": MODEL_ID,
         "device": DEVICE,
         "output_dir": str(OUTPUT_DIR),
-        "default_speaker": default_speaker,
+        "default_speaker": DEFAULT_SPEAKER or default_speaker,
         "available_speakers": available_speakers,
+        "cache": audio_cache.stats(),
+        "queue": worker.stats(),
+        "model_state": loader.status(),
     }
 
 
@@ -174,31 +328,153 @@ async def health():
 async def narration(req: NarrationRequest):
     if not req.lines:
         raise HTTPException(status_code=400, detail="lines is empty")
-    if voice_model is None:
-        load_voice_model()
+    keys = [line_cache_key(line.text, req) if (line.text or "").strip() else None for line in req.lines]
+    # Cache lookups hit the disk; keep them off the event loop.
+    hits = await asyncio.to_thread(_cached_lines, req.lines, keys)
+    # Blank lines become silence; only lines missing from the cache need the model.
+    if all(hit or not key for key, hit in zip(keys, hits)):
+        return {"audios": await _narrate(req, keys, hits)}
+    try:
+        await loader.acquire(req.deadline)
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail=str(exc)) from exc
+    try:
+        return {"audios": await _narrate(req, keys, hits)}
+    finally:
+        loader.release()
+
+
+async def _narrate(req: NarrationRequest, keys: List[Optional[str]], hits: List[Optional[AudioItem]]) -> List[AudioItem]:
     outputs: List[AudioItem] = []
-    for line in req.lines:
+    for line, key, cached in zip(req.lines, keys, hits):
         try:
             text = line.text or ""
+            if cached:
+                outputs.append(cached)
+                continue
+            synthesized = False
             if not text.strip():
                 audio, sr = generate_silence(0.2)
             else:
-                audio, sr = synthesize(text, req.speaker, req.speed)
-            path = save_audio(audio, sr, line.scene_id)
+                audio, sr, synthesized = await worker.submit(
+                    synthesize_checked, text, req.speaker, req.speed, deadline=req.deadline
+                )
+            path = await asyncio.to_thread(save_audio, audio, sr, line.scene_id)
+            if key and synthesized:
+                await asyncio.to_thread(audio_cache.put, key, Path(path), {"sample_rate": sr, "text": text})
             outputs.append(AudioItem(scene_id=line.scene_id, audio=path, sample_rate=sr))
+        except DeadlineExceeded as exc:
+            raise HTTPException(status_code=504, detail=f"TTS expired for {line.scene_id}: {exc}") from exc
         except Exception as exc:  # noqa: BLE001
             raise HTTPException(status_code=500, detail=f"TTS failed for {line.scene_id}: {exc}") from exc
-    return {"audios": outputs}
+    return outputs
+
+
+def _audio_response(body, sample_rate: int, fmt: str) -> StreamingResponse:
+    media_type = "audio/wav" if fmt == "wav" else f"audio/L16; rate={sample_rate}; channels=1"
+    return StreamingResponse(body, media_type=media_type, headers={"X-Sample-Rate": str(sample_rate)})
+
+
+@router.post("/narration/stream")
+async def narration_stream(req: StreamRequest):
+    """Synthesize one line and stream 16-bit PCM (optionally WAV-framed) while CosyVoice produces it.
+
+    The complete line is saved and cached afterwards, so a later /narration for the same
+    text is a cache hit.
+    """
+    text = req.text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="text is empty")
+    key = line_cache_key(req.text, req)
+    cached = await asyncio.to_thread(_cached_pcm, key)
+    if cached:
+        payload, sr = cached
+
+        async def replay():
+            if req.format == "wav":
+                yield wav_header(sr, len(payload))
+            for start in range(0, len(payload), 1 << 16):
+                yield payload[start : start + (1 << 16)]
+
+        return _audio_response(replay(), sr, req.format)
+
+    try:
+        await loader.acquire(req.deadline)
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail=str(exc)) from exc
+    loop = asyncio.get_running_loop()
+    chunks: "asyncio.Queue[Optional[np.ndarray]]" = asyncio.Queue()
+    stop = threading.Event()
+    job = asyncio.ensure_future(
+        worker.submit(
+            synthesize_stream,
+            req.text,
+            req.speaker,
+            req.speed,
+            lambda chunk: loop.call_soon_threadsafe(chunks.put_nowait, chunk),
+            stop,
+            deadline=req.deadline,
+        )
+    )
+    # Chunks are scheduled onto the loop before the job resolves, so None always comes last.
+    job.add_done_callback(lambda _: chunks.put_nowait(None))
+    # The model stays held until synthesis ends, even if the response body is never iterated.
+    job.add_done_callback(lambda _: loader.release())
+    sr = voice_model.sample_rate
+    first = await chunks.get()
+    if first is None:
+        try:
+            job.result()
+        except DeadlineExceeded as exc:
+            raise HTTPException(status_code=504, detail=f"TTS expired for {req.scene_id}: {exc}") from exc
+        except Exception as exc:  # noqa: BLE001
+            raise HTTPException(status_code=500, detail=f"TTS failed for {req.scene_id}: {exc}") from exc
+
+    async def body():
+        produced = [first]
+        try:
+            if req.format == "wav":
+                yield wav_header(sr)
+            chunk = first
+            while chunk is not None:
+                yield pcm16(chunk)
+                chunk = await chunks.get()
+                if chunk is not None:
+                    produced.append(chunk)
+            if job.exception() is not None:
+                print(f"[WARN] TTS stream for {req.scene_id} ended early: {job.exception()}")
+                return
+            audio = np.concatenate(produced)
+            path = await asyncio.to_thread(save_audio, audio, sr, req.scene_id or "")
+            await asyncio.to_thread(audio_cache.put, key, Path(path), {"sample_rate": sr, "text": req.text})
+        finally:
+            # Client went away (or we are done): stop the synthesis loop / drop it from the queue.
+            stop.set()
+            if not job.done():
+                job.cancel()
+
+    return _audio_response(body(), sr, req.format)
+
+
+watch("tts", worker=worker, caches={"audio": audio_cache}, loader=loader)
+
+
+@router.get("/metrics")
+async def metrics():
+    return metrics_response()
 
 
 def register_app(app: FastAPI, prefix: str = "") -> None:
     app.include_router(router, prefix=prefix)
     app.add_event_handler("startup", _startup)
+    app.add_event_handler("shutdown", _shutdown)
 
 
 def create_app() -> FastAPI:
     app = FastAPI(title="TTS Service (CosyVoice2 local)", version="0.2.0")
     register_app(app)
+    app.add_event_handler("startup", wait_eager_loads)
+    app.add_middleware(TraceMiddleware)
     return app
 
 
@@ -1,25 +1,96 @@
 """FastAPI text-to-image service using Stable Diffusion Turbo (diffusers)."""
 
+import asyncio
+import contextlib
 import os
+import random
 import time
 import uuid
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import torch
 from diffusers import AutoPipelineForText2Image
 from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
-from model.services.utils import resolve_project_root
-
-router = APIRouter()
+from model.services.metrics import metered_route, metrics_response, watch
+from model.tracing import TraceMiddleware
+from model.services.utils import (
+    ArtifactCache,
+    CancelRegistry,
+    DeadlineExceeded,
+    InferenceWorker,
+    JobCancelled,
+    ManagedModel,
+    MicroBatcher,
+    artifacts,
+    release_accelerator_memory,
+    resolve_project_root,
+    wait_eager_loads,
+)
+
+router = APIRouter(route_class=metered_route("txt2img"))
 
 PROJECT_ROOT = resolve_project_root()
 MODEL_ID = os.getenv("MODEL_ID", "stabilityai/sd-turbo")
-DEVICE = os.getenv("DEVICE", "cuda")
+# cuda: fp16 on the GPU (previous behaviour); cpu: the tuned CPU settings below; auto: cuda when available.
+PROFILE = os.getenv("TXT2IMG_PROFILE", "auto").strip().lower()
+if PROFILE not in ("cuda", "cpu"):
+    PROFILE = "cuda" if torch.cuda.is_available() else "cpu"
+DEVICE = os.getenv("DEVICE") or ("cuda" if PROFILE == "cuda" else "cpu")
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", PROJECT_ROOT / "data/frames"))
+# Content-addressed keyframe cache; TXT2IMG_CACHE_MAX_MB=0 disables it.
+CACHE_DIR = Path(os.getenv("TXT2IMG_CACHE_DIR", PROJECT_ROOT / "data/cache/frames"))
+CACHE_MAX_MB = int(os.getenv("TXT2IMG_CACHE_MAX_MB", "2048"))
+# Unseeded requests are re-sampled every time (regenerating a shot must give a new image); 1 caches them too.
+CACHE_UNSEEDED = os.getenv("TXT2IMG_CACHE_UNSEEDED", "0").strip().lower() in ("1", "true", "yes", "on")
+# Max prompts per pipeline call; larger batches are split into chunks.
+MAX_BATCH = max(1, int(os.getenv("TXT2IMG_MAX_BATCH", "8")))
+# How long the first request of a micro-batch waits for others with the same style (0 = same tick only).
+BATCH_WINDOW_MS = max(0.0, float(os.getenv("TXT2IMG_BATCH_WINDOW_MS", "10")))
 
 pipe = None  # lazy loaded
+frame_cache = ArtifactCache(CACHE_DIR, ".png", max_bytes=CACHE_MAX_MB * 1024 * 1024, enabled=CACHE_MAX_MB > 0)
+cancels = CancelRegistry()
+# All pipeline work runs on this thread, one call at a time; the event loop only does I/O.
+worker = InferenceWorker("txt2img")
+# eager | background | lazy (see ManagedModel); TXT2IMG_IDLE_UNLOAD seconds > 0 frees an unused model.
+LOAD_POLICY = os.getenv("TXT2IMG_LOAD_POLICY", os.getenv("MODEL_LOAD_POLICY", "background")).strip().lower()
+IDLE_UNLOAD = float(os.getenv("TXT2IMG_IDLE_UNLOAD", os.getenv("MODEL_IDLE_UNLOAD", "0")))
+# Expected resident size (SD-Turbo fp16 weights) for MODEL_MEMORY_BUDGET_MB; refined by measurement after loading.
+MEMORY_MB = float(os.getenv("TXT2IMG_MEMORY_MB", "2600"))
+# CPU profile knobs. TXT2IMG_CPU_THREADS=0 keeps torch's default; bf16 autocast defaults to "auto"
+# (on when the CPU has native bf16, i.e. AVX512-BF16/AMX); torch.compile pays a long first call.
+CPU_THREADS = max(0, int(os.getenv("TXT2IMG_CPU_THREADS", "0")))
+CPU_BF16 = os.getenv("TXT2IMG_CPU_BF16", "auto").strip().lower()
+CPU_CHANNELS_LAST = os.getenv("TXT2IMG_CHANNELS_LAST", "1").strip().lower() in ("1", "true", "yes", "on")
+CPU_COMPILE = os.getenv("TXT2IMG_COMPILE", "0").strip().lower() in ("1", "true", "yes", "on")
+# Decode in tiles when either side exceeds this many pixels (bounded VAE memory on large frames; 0 = never).
+VAE_TILING_SIZE = max(0, int(os.getenv("TXT2IMG_VAE_TILING_SIZE", "1024")))
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        flags = Path("/proc/cpuinfo").read_text(encoding="utf-8", errors="ignore")
+    except OSError:
+        return False
+    return any(flag in flags for flag in ("avx512_bf16", "amx_bf16"))
+
+
+class CpuSettings(NamedTuple):
+    threads: int = 0
+    bf16: bool = False
+    channels_last: bool = False
+    compile: bool = False
+
+
+CPU_SETTINGS = CpuSettings(
+    threads=CPU_THREADS,
+    bf16=cpu_supports_bf16() if CPU_BF16 == "auto" else CPU_BF16 in ("1", "true", "yes", "on"),
+    channels_last=CPU_CHANNELS_LAST,
+    compile=CPU_COMPILE,
+)
 
 
 class ImageStyle(BaseModel):
@@ -35,11 +106,40 @@ class GenerateRequest(BaseModel):
     seed: Optional[int] = None
     style: ImageStyle = Field(default_factory=ImageStyle)
     scene_id: Optional[str] = Field(None, description="用于输出文件命名")
+    job_id: Optional[str] = Field(None, description="网关任务 ID，用于 /cancel 中断")
+    deadline: Optional[float] = Field(None, description="Unix 时间戳（秒）；排队超过该时间的请求不再推理")
+
+
+class CancelRequest(BaseModel):
+    job_id: str
+
+
+class BatchItem(BaseModel):
+    prompt: str
+    negative_prompt: Optional[str] = None
+    seed: Optional[int] = None
+    scene_id: Optional[str] = Field(None, description="用于输出文件命名")
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1)
+    style: ImageStyle = Field(default_factory=ImageStyle)
+    job_id: Optional[str] = Field(None, description="网关任务 ID，用于 /cancel 中断")
+    deadline: Optional[float] = Field(None, description="Unix 时间戳（秒）；排队超过该时间的请求不再推理")
+
+
+class _Pending(NamedTuple):
+    item: BatchItem
+    job_id: Optional[str]
+    deadline: Optional[float]
+    cache_key: Optional[str]
 
 
 class GeneratedItem(BaseModel):
     path: str
     seed: int
+    scene_id: Optional[str] = None
+    artifact_id: Optional[str] = Field(None, description="同进程 img2vid 可直接解析的内存图像 ID")
 
 
 class GenerateResponse(BaseModel):
@@ -50,22 +150,49 @@ def ensure_output_dir():
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def build_pipeline(device: str, cpu: Optional[CpuSettings] = None):
+    """SD-Turbo pipeline for `device`; `cpu` applies the CPU profile (fp32 weights, bf16 via autocast)."""
+    if cpu is None:
+        dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    else:
+        dtype = torch.float32
+        if cpu.threads:
+            torch.set_num_threads(cpu.threads)
+    p = AutoPipelineForText2Image.from_pretrained(MODEL_ID, torch_dtype=dtype, variant="fp16")
+    if device:
+        p = p.to(device)
+    if cpu is not None:
+        if cpu.channels_last:
+            p.unet.to(memory_format=torch.channels_last)
+            p.vae.to(memory_format=torch.channels_last)
+        if cpu.compile:
+            try:
+                p.unet = torch.compile(p.unet)
+            except Exception as exc:  # noqa: BLE001
+                print(f"[WARN] torch.compile unavailable, running eager: {exc}")
+    else:
+        try:
+            p.enable_xformers_memory_efficient_attention()
+        except Exception:
+            pass
+    p.set_progress_bar_config(disable=True)
+    return p
+
+
 def load_pipeline():
     global pipe  # noqa: PLW0603
     if pipe is not None:
         return
-    dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-    model_kwargs = {"torch_dtype": dtype}
-    model_kwargs["variant"] = "fp16"
-    p = AutoPipelineForText2Image.from_pretrained(MODEL_ID, **model_kwargs)
-    if DEVICE:
-        p = p.to(DEVICE)
-    try:
-        p.enable_xformers_memory_efficient_attention()
-    except Exception:
-        pass
-    p.set_progress_bar_config(disable=True)
-    pipe = p
+    pipe = build_pipeline(DEVICE, CPU_SETTINGS if PROFILE == "cpu" else None)
+
+
+def unload_pipeline():
+    global pipe  # noqa: PLW0603
+    pipe = None
+    release_accelerator_memory()
+
+
+loader = ManagedModel("txt2img", load_pipeline, unload_pipeline, worker, LOAD_POLICY, IDLE_UNLOAD, MEMORY_MB)
 
 
 def _slug(text: str) -> str:
@@ -79,73 +206,302 @@ def _slug(text: str) -> str:
     return slug or "img"
 
 
-def save_image(image, scene_id: Optional[str], seed: int) -> str:
+def _image_path(scene_id: Optional[str], seed: int) -> Path:
     ensure_output_dir()
     base = scene_id or _slug(str(uuid.uuid4())[:8])
     ts = int(time.time())
-    filename = f"{base}_{seed}_{ts}.png"
-    path = OUTPUT_DIR / filename
+    return OUTPUT_DIR / f"{base}_{seed}_{ts}.png"
+
+
+def _store(image, path: Path, key: Optional[str], seed: int, prompt: str) -> None:
     image.save(path)
-    return str(path)
+    if key:
+        frame_cache.put(key, path, {"seed": seed, "prompt": prompt})
+
+
+async def _emit(image, item: BatchItem, seed: int, key: Optional[str]) -> GeneratedItem:
+    """Write the PNG (and cache entry) before returning its path; co-hosted img2vid also gets the image in memory."""
+    path = _image_path(item.scene_id, seed)
+    await asyncio.to_thread(_store, image, path, key, seed, item.prompt)
+    return GeneratedItem(path=str(path), seed=seed, scene_id=item.scene_id, artifact_id=artifacts.put(image))
+
+
+def _cached(item: BatchItem, key: str) -> Optional[GeneratedItem]:
+    """Cache hit exported to a fresh OUTPUT_DIR path, or None on a miss."""
+    cached = frame_cache.get(key)
+    if not cached:
+        return None
+    src, meta = cached
+    seed = int(meta.get("seed", item.seed or 0))
+    path = _image_path(item.scene_id, seed)
+    if not frame_cache.export(src, path):
+        return None
+    return GeneratedItem(path=str(path), seed=seed, scene_id=item.scene_id)
+
+
+def cache_key(item: BatchItem, style: ImageStyle) -> Optional[str]:
+    """Hash of everything that determines the pixels; None when the request must not be cached."""
+    if item.seed is None and not CACHE_UNSEEDED:
+        return None
+    return ArtifactCache.make_key(item.prompt, item.negative_prompt, style.dict(), item.seed, MODEL_ID)
+
+
+def _style_key(style: ImageStyle) -> Tuple[int, int, int, float]:
+    """Requests can share a pipeline call only when these match."""
+    return (style.width, style.height, style.num_inference_steps, style.guidance_scale)
+
+
+def _generator(seed: int):
+    try:
+        return torch.Generator(device=DEVICE).manual_seed(seed)
+    except Exception:
+        return torch.Generator().manual_seed(seed)
 
 
 async def _startup():
-    load_pipeline()
+    loader.start()
 
 
-@router.get("/health")
-async def health():
-    return {"status": "ok", "model": MODEL_ID, "device": DEVICE, "output_dir": str(OUTPUT_DIR)}
+async def _shutdown():
+    loader.stop()
 
 
-@router.post("/generate", response_model=GenerateResponse)
-async def generate(req: GenerateRequest):
-    if pipe is None:
-        load_pipeline()
-    gen = None
-    if req.seed is not None:
-        try:
-            gen = torch.Generator(device=DEVICE).manual_seed(int(req.seed))
-        except Exception:
-            gen = torch.Generator().manual_seed(int(req.seed))
+@router.get("/ready")
+async def ready():
+    return JSONResponse(loader.status(), status_code=200 if loader.ready else 503)
+
+
+@router.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "model": MODEL_ID,
+        "device": DEVICE,
+        "profile": PROFILE,
+        "cpu": CPU_SETTINGS._asdict() if PROFILE == "cpu" else None,
+        "output_dir": str(OUTPUT_DIR),
+        "cache": frame_cache.stats(),
+        "interrupted": cancels.interrupted,
+        "queue": worker.stats(),
+        "model_state": loader.status(),
+        "batcher": batcher.stats(),
+        "artifacts": artifacts.stats(),
+    }
+
+
+@router.post("/cancel")
+async def cancel(req: CancelRequest):
+    """Stop generation for a gateway job at the next denoising step."""
+    cancels.cancel(req.job_id)
+    return {"job_id": req.job_id, "cancelled": True}
+
+
+@router.delete("/cancel/{job_id}")
+async def uncancel(job_id: str):
+    """Forget a cancellation so a resumed job with the same id runs again."""
+    return {"job_id": job_id, "cleared": cancels.clear(job_id)}
+
+
+def _autocast(cpu: Optional[CpuSettings]):
+    if cpu is not None and cpu.bf16:
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def run_pipeline(p, prompts: List[str], kwargs: Dict, cpu: Optional[CpuSettings] = None):
+    """One pipeline call with per-size VAE tiling and, for the CPU profile, bf16 autocast."""
+    if hasattr(p, "enable_vae_tiling"):
+        if VAE_TILING_SIZE and max(kwargs["width"], kwargs["height"]) > VAE_TILING_SIZE:
+            p.enable_vae_tiling()
+        else:
+            p.disable_vae_tiling()
+    with _autocast(cpu):
+        return p(prompts, **kwargs)
+
+
+def _infer(prompts: List[str], kwargs: Dict, job_ids: List[Optional[str]]):
+    """Runs on the inference thread."""
+    if all(job_ids) and cancels.all_cancelled(job_ids):
+        raise JobCancelled(", ".join(dict.fromkeys(job_ids)))
+    return run_pipeline(pipe, prompts, kwargs, CPU_SETTINGS if PROFILE == "cpu" else None)
+
+
+async def _run_batch(key: Tuple[int, int, int, float], requests: List[_Pending]) -> List[GeneratedItem]:
+    """One batched pipeline call; every prompt gets its own generator so seeds stay per item.
+
+    `requests` may come from different callers (and gateway jobs) that share the style `key`.
+    """
+    width, height, steps, guidance = key
+    items = [req.item for req in requests]
+    job_ids = [req.job_id for req in requests]
+    deadlines = [req.deadline for req in requests]
+    # Drop the batch in the queue only once nobody could still use it.
+    deadline = None if None in deadlines else max(deadlines)
+    seeds = [item.seed if item.seed is not None else random.randrange(2**31) for item in items]
+    negatives = [item.negative_prompt for item in items]
+    kwargs = {
+        "negative_prompt": [neg or "" for neg in negatives] if any(negatives) else None,
+        "width": width,
+        "height": height,
+        "num_inference_steps": steps,
+        "guidance_scale": guidance,
+        "generator": [_generator(int(seed)) for seed in seeds],
+    }
+    callback = cancels.step_callback(*job_ids)
+    if callback:
+        kwargs["callback_on_step_end"] = callback
     try:
-        result = pipe(
-            req.prompt,
-            negative_prompt=req.negative_prompt,
-            width=req.style.width,
-            height=req.style.height,
-            num_inference_steps=req.style.num_inference_steps,
-            guidance_scale=req.style.guidance_scale,
-            generator=gen,
-        )
+        async with loader.use(deadline):
+            result = await worker.submit(_infer, [item.prompt for item in items], kwargs, job_ids, deadline=deadline)
+    except JobCancelled as exc:
+        raise HTTPException(status_code=409, detail=f"Job cancelled: {exc}") from exc
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail=str(exc)) from exc
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Generation failed: {exc}") from exc
     images = result.images if hasattr(result, "images") else []
-    if not images:
-        raise HTTPException(status_code=500, detail="No images generated")
-    items: List[GeneratedItem] = []
-    for idx, img in enumerate(images):
-        seed = req.seed if req.seed is not None else int(torch.seed())
-        path = save_image(img, req.scene_id or f"s{idx+1}", seed)
-        items.append(GeneratedItem(path=path, seed=seed))
-    return {"images": items}
+    if len(images) != len(items):
+        raise HTTPException(status_code=500, detail=f"Expected {len(items)} images, got {len(images)}")
+    return [await _emit(img, req.item, int(seed), req.cache_key) for req, img, seed in zip(requests, images, seeds)]
+
+
+# Concurrent misses with the same style (from /generate and /generate_batch alike) share pipeline
+# calls; while the model is busy, new arrivals keep collecting for the next pass.
+batcher = MicroBatcher(
+    _run_batch,
+    MAX_BATCH,
+    BATCH_WINDOW_MS / 1000,
+    hold=lambda: worker.busy or worker.depth() > 0,
+)
+
+
+async def _generate_items(
+    items: List[BatchItem], style: ImageStyle, job_id: Optional[str], deadline: Optional[float] = None
+) -> List[GeneratedItem]:
+    """Serve cache hits, micro-batch the misses, return results in request order."""
+    results: List[Optional[GeneratedItem]] = [None] * len(items)
+    keys = [cache_key(item, style) for item in items]
+    misses: List[int] = []
+    for idx, (item, key) in enumerate(zip(items, keys)):
+        cached = await asyncio.to_thread(_cached, item, key) if key else None
+        if cached:
+            results[idx] = cached
+        else:
+            misses.append(idx)
+    style_key = _style_key(style)
+    generated = await asyncio.gather(
+        *(batcher.submit(style_key, _Pending(items[idx], job_id, deadline, keys[idx])) for idx in misses)
+    )
+    for idx, item in zip(misses, generated):
+        results[idx] = item
+    return results
+
+
+@router.post("/generate", response_model=GenerateResponse)
+async def generate(req: GenerateRequest):
+    item = BatchItem(prompt=req.prompt, negative_prompt=req.negative_prompt, seed=req.seed, scene_id=req.scene_id)
+    return {"images": await _generate_items([item], req.style, req.job_id, req.deadline)}
+
+
+@router.post("/generate_batch", response_model=GenerateResponse)
+async def generate_batch(req: BatchRequest):
+    """Several prompts sharing one ImageStyle, run through the micro-batcher (up to MAX_BATCH per call)."""
+    return {"images": await _generate_items(req.items, req.style, req.job_id, req.deadline)}
+
+
+watch("txt2img", worker=worker, caches={"frame": frame_cache}, batcher=batcher, loader=loader)
+
+
+@router.get("/metrics")
+async def metrics():
+    return metrics_response()
 
 
 def register_app(app: FastAPI, prefix: str = "") -> None:
     app.include_router(router, prefix=prefix)
     app.add_event_handler("startup", _startup)
+    app.add_event_handler("shutdown", _shutdown)
 
 
 def create_app() -> FastAPI:
     app = FastAPI(title="TXT2IMG Service (SD Turbo)", version="0.1.0")
     register_app(app)
+    app.add_event_handler("startup", wait_eager_loads)
+    app.add_middleware(TraceMiddleware)
     return app
 
 
 app = create_app()
 
 
-if __name__ == "__main__":
-    import uvicorn
+def benchmark(
+    runs: int = 3,
+    width: int = 512,
+    height: int = 512,
+    steps: int = 4,
+    threads: int = 0,
+    compile_unet: bool = False,
+) -> List[Dict]:
+    """Seconds per image on the CPU for each setting of the CPU profile, applied cumulatively.
+
+    Every step builds a fresh pipeline, runs one untimed warm-up call, then `runs` timed calls.
+    """
+    threads = threads or CPU_THREADS or os.cpu_count() or 1
+    ladder = [("fp32 baseline", CpuSettings())]
+    current = CpuSettings(threads=threads)
+    ladder.append((f"threads={threads}", current))
+    current = current._replace(channels_last=True)
+    ladder.append(("+ channels_last", current))
+    if cpu_supports_bf16():
+        current = current._replace(bf16=True)
+        ladder.append(("+ bf16 autocast", current))
+    if compile_unet:
+        current = current._replace(compile=True)
+        ladder.append(("+ torch.compile", current))
+    kwargs = {"width": width, "height": height, "num_inference_steps": steps, "guidance_scale": 0.0}
+    results: List[Dict] = []
+    for label, settings in ladder:
+        p = build_pipeline("cpu", settings)
+        prompt = ["a lighthouse on a cliff at dusk"]
+        run_pipeline(p, prompt, {**kwargs, "generator": torch.Generator().manual_seed(0)}, settings)
+        timings = []
+        for _ in range(max(1, runs)):
+            started = time.perf_counter()
+            run_pipeline(p, prompt, {**kwargs, "generator": torch.Generator().manual_seed(0)}, settings)
+            timings.append(time.perf_counter() - started)
+        results.append(
+            {
+                "setting": label,
+                **settings._asdict(),
+                "torch_threads": torch.get_num_threads(),
+                "vae_tiling": bool(VAE_TILING_SIZE and max(width, height) > VAE_TILING_SIZE),
+                "seconds_per_image": round(sum(timings) / len(timings), 3),
+                "best": round(min(timings), 3),
+            }
+        )
+        print(f"{label}: {results[-1]['seconds_per_image']}s/image")
+        del p
+        release_accelerator_memory()
+    return results
 
-    uvicorn.run("model.services.txt2img:app", host="0.0.0.0", port=8002, reload=False)
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="TXT2IMG service (SD Turbo)")
+    parser.add_argument("--benchmark", action="store_true", help="CPU 配置基准测试（每张图秒数），不启动服务")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=0, help="默认 TXT2IMG_CPU_THREADS 或 CPU 核数")
+    parser.add_argument("--compile", action="store_true", help="同时测试 torch.compile（首次编译较慢）")
+    args = parser.parse_args()
+    if args.benchmark:
+        report = benchmark(args.runs, args.width, args.height, args.steps, args.threads, args.compile)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        import uvicorn
+
+        uvicorn.run("model.services.txt2img:app", host="0.0.0.0", port=8002, reload=False)
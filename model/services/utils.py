@@ -1,7 +1,24 @@
 """Shared helpers for model services."""
 
+import asyncio
+import hashlib
+import json
 import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from opentelemetry import context as otel_context
+
+from model.services.metrics import INFERENCE_SECONDS
+from model.tracing import setup as setup_tracing
+from model.tracing import tracer
 
 
 def resolve_project_root() -> Path:
@@ -23,3 +40,897 @@ def resolve_project_root() -> Path:
             if (parent / marker).exists():
                 return parent
     return here.parent
+
+
+class ArtifactCache:
+    """Content-addressed on-disk cache with LRU eviction.
+
+    Entries are files named `<sha256 key><suffix>` under `root`, each with an optional
+    `<key>.json` sidecar for metadata. Recency is tracked in memory and mirrored into
+    file mtimes so the LRU order survives a restart. A `max_bytes`/`max_entries` of 0
+    means unbounded on that axis; `enabled=False` turns every lookup into a miss.
+    """
+
+    def __init__(self, root: Path, suffix: str, max_bytes: int = 0, max_entries: int = 0, enabled: bool = True) -> None:
+        self.root = Path(root)
+        self.suffix = suffix
+        self.max_bytes = max(0, max_bytes)
+        self.max_entries = max(0, max_entries)
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        if self.enabled:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def file_digest(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}{self.suffix}"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def _load_index(self) -> None:
+        files = sorted(self.root.glob(f"*{self.suffix}"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._index[path.name[: -len(self.suffix)] if self.suffix else path.name] = size
+            self._bytes += size
+
+    def get(self, key: str) -> Optional[Tuple[Path, Dict]]:
+        """Return (path, metadata) on a hit and mark it most recently used."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            path = self._path(key)
+            if key not in self._index or not path.exists():
+                self._forget(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        meta_path = self._meta_path(key)
+        meta: Dict = {}
+        if meta_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                meta = {}
+        return path, meta
+
+    def put(self, key: str, src: Path, meta: Optional[Dict] = None) -> Optional[Path]:
+        """Store a copy (hard link when possible) of `src` under `key`; returns the cached path."""
+        if not self.enabled:
+            return None
+        dest = self._path(key)
+        try:
+            _link_or_copy(src, dest)
+            if meta is not None:
+                self._meta_path(key).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        except OSError as exc:
+            print(f"[WARN] cache store failed for {key}: {exc}")
+            return None
+        size = dest.stat().st_size
+        with self._lock:
+            self._forget(key)
+            self._index[key] = size
+            self._bytes += size
+            self._evict()
+        return dest
+
+    def export(self, path: Path, dest: Path) -> bool:
+        """Hard-link (or copy) a path returned by get() to `dest`, which the caller owns.
+
+        Entries can be evicted by any later put, so results handed to callers must never
+        point into the cache dir. False when the entry vanished in between (count it as a miss).
+        """
+        try:
+            _link_or_copy(path, dest)
+        except OSError:
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return False
+        return True
+
+    def _forget(self, key: str) -> None:
+        size = self._index.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+
+    def _evict(self) -> None:
+        while self._index and (
+            (self.max_bytes and self._bytes > self.max_bytes) or (self.max_entries and len(self._index) > self.max_entries)
+        ):
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            self._path(key).unlink(missing_ok=True)
+            self._meta_path(key).unlink(missing_ok=True)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "dir": str(self.root),
+            "entries": len(self._index),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    """Atomically place `src` at `dest`, sharing the inode when both are on one filesystem."""
+    tmp = dest.with_name(f".{dest.name}.{threading.get_ident()}.tmp")
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class ArtifactRegistry:
+    """In-process hand-off of generated objects (e.g. PIL keyframes) between services by id.
+
+    When txt2img and img2vid share a process (model/main.py), img2vid resolves an
+    artifact id straight to the in-memory object instead of decoding the file, which
+    the producer has already written (the path is handed to other processes too).
+    Entries expire LRU-first or after `ttl` seconds, after which consumers fall back
+    to the file on disk. Objects are only kept once a consumer has `attach`ed in this
+    process; `max_entries=0` disables it.
+    """
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self.consumers: List[str] = []
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and bool(self.consumers)
+
+    def attach(self, consumer: str) -> None:
+        """Called by a service that resolves artifact ids, once it is actually served in this process."""
+        if consumer not in self.consumers:
+            self.consumers.append(consumer)
+
+    def put(self, obj: Any) -> Optional[str]:
+        """Register `obj`; returns the artifact id (None when disabled)."""
+        if not self.enabled:
+            return None
+        artifact_id = uuid.uuid4().hex
+        with self._lock:
+            self._data[artifact_id] = (time.monotonic() + self.ttl, obj)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return artifact_id
+
+    def get(self, artifact_id: Optional[str]) -> Optional[Any]:
+        if not artifact_id:
+            return None
+        with self._lock:
+            entry = self._data.get(artifact_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(artifact_id, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(artifact_id)
+            self.hits += 1
+            return entry[1]
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "consumers": list(self.consumers),
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Every model service imports this module, so the node's trace export is set up here, once per process.
+setup_tracing("s2v-model-node")
+
+# Shared by every service module imported into the same process.
+artifacts = ArtifactRegistry(
+    int(os.getenv("ARTIFACT_REGISTRY_SIZE", "64")),
+    float(os.getenv("ARTIFACT_REGISTRY_TTL", "600")),
+)
+
+
+class SingleFlight:
+    """Coalesce concurrent async calls sharing a key: the first runs, the rest await its result."""
+
+    def __init__(self) -> None:
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting on the shared future; don't warn about unretrieved errors.
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = fut
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as exc:
+            fut.set_exception(exc)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+
+class TTLCache:
+    """Small in-memory LRU whose entries also expire `ttl` seconds after being stored."""
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: Any) -> None:
+        if not self.max_entries or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class JobCancelled(Exception):
+    """Raised from a diffusion step callback once the owning gateway job was cancelled."""
+
+
+class CancelRegistry:
+    """Job ids the gateway asked to stop (POST /cancel); entries expire after `ttl` seconds
+    or are cleared when the job is resumed (DELETE /cancel/{job_id})."""
+
+    def __init__(self, ttl: float = 600.0) -> None:
+        self.ttl = ttl
+        self.interrupted = 0
+        self._ids: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def cancel(self, job_id: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._ids = {key: exp for key, exp in self._ids.items() if exp > now}
+            self._ids[job_id] = now + self.ttl
+
+    def clear(self, job_id: str) -> bool:
+        with self._lock:
+            return self._ids.pop(job_id, None) is not None
+
+    def is_cancelled(self, job_id: Optional[str]) -> bool:
+        if not job_id:
+            return False
+        with self._lock:
+            expires = self._ids.get(job_id)
+        return expires is not None and expires > time.monotonic()
+
+    def all_cancelled(self, job_ids) -> bool:
+        job_ids = list(job_ids)
+        return bool(job_ids) and all(self.is_cancelled(job_id) for job_id in job_ids)
+
+    def step_callback(self, *job_ids: Optional[str]) -> Optional[Callable]:
+        """diffusers `callback_on_step_end` that aborts the pipeline once every job in `job_ids` is cancelled.
+
+        A batch mixing several jobs keeps running while any of them is still wanted; an
+        item without a job id can never be cancelled, so it disables the callback.
+        """
+        if not job_ids or not all(job_ids):
+            return None
+
+        def _check(pipeline, step, timestep, callback_kwargs):
+            if self.all_cancelled(job_ids):
+                self.interrupted += 1
+                raise JobCancelled(", ".join(dict.fromkeys(job_ids)))
+            return callback_kwargs
+
+        return _check
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before it reached the model."""
+
+
+def _resolve(fut: asyncio.Future, result: Any, exc: Optional[BaseException]) -> None:
+    if fut.cancelled():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+
+class InferenceWorker:
+    """Dedicated thread running blocking inference calls one at a time, in FIFO order.
+
+    `await submit(fn, ...)` keeps the event loop free while the model works, so /health
+    and other routes stay responsive. Jobs whose caller went away, or whose `deadline`
+    (unix seconds) has passed by the time they are dequeued, are dropped without running.
+    Each call runs in a `<name>.<fn>` span under the submitter's trace context.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.busy = False
+        self.processed = 0
+        self.failed = 0
+        self.expired = 0
+        self.abandoned = 0
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-inference", daemon=True)
+                self._thread.start()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, fn: Callable[..., Any], *args, deadline: Optional[float] = None, **kwargs) -> Any:
+        if deadline is not None and time.time() > deadline:
+            self.expired += 1
+            raise DeadlineExceeded(f"deadline passed before {self.name} request was queued")
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((fn, args, kwargs, deadline, fut, loop, otel_context.get_current(), time.perf_counter()))
+        return await fut
+
+    @staticmethod
+    def _deliver(loop: asyncio.AbstractEventLoop, fut: asyncio.Future, result: Any, exc: Optional[BaseException]) -> None:
+        try:
+            loop.call_soon_threadsafe(_resolve, fut, result, exc)
+        except RuntimeError:
+            pass  # event loop already closed (shutdown)
+
+    def _run(self) -> None:
+        while True:
+            fn, args, kwargs, deadline, fut, loop, ctx, queued = self._queue.get()
+            if fut.cancelled():
+                self.abandoned += 1
+                continue
+            if deadline is not None and time.time() > deadline:
+                self.expired += 1
+                self._deliver(loop, fut, None, DeadlineExceeded(f"{self.name} request expired after waiting in queue"))
+                continue
+            self.busy = True
+            started = time.perf_counter()
+            token = otel_context.attach(ctx)
+            try:
+                name = f"{self.name}.{getattr(fn, '__name__', 'call')}"
+                with tracer.start_as_current_span(name, attributes={"queue.wait_s": round(started - queued, 4)}):
+                    result = fn(*args, **kwargs)
+            except BaseException as exc:  # noqa: BLE001
+                self.failed += 1
+                self._deliver(loop, fut, None, exc)
+            else:
+                self.processed += 1
+                self._deliver(loop, fut, result, None)
+            finally:
+                self.busy = False
+                otel_context.detach(token)
+                INFERENCE_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self.depth(),
+            "busy": self.busy,
+            "processed": self.processed,
+            "failed": self.failed,
+            "expired": self.expired,
+            "abandoned": self.abandoned,
+        }
+
+
+class MicroBatcher:
+    """Collect concurrent submissions that share a key and run them as one batch.
+
+    The first item for a key opens a `window`-second collection window; the batch is
+    flushed when the window closes or as soon as it holds `max_batch` items. While
+    `hold()` is true (e.g. the model is still busy with the previous batch) a closed
+    window is extended, so requests arriving during a pass join the next one instead
+    of queueing behind it one by one. `run(key, items)` returns one result per item,
+    in order; an exception it raises is delivered to every submitter of that batch.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+        max_batch: int,
+        window: float,
+        hold: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self._run = run
+        self.max_batch = max(1, max_batch)
+        self.window = max(0.0, window)
+        self._hold = hold
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self.batches = 0
+        self.items = 0
+        self.full = 0
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, fut))
+        if len(batch) >= self.max_batch:
+            self.full += 1
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._expire, key)
+        return await fut
+
+    def _expire(self, key: Hashable) -> None:
+        if self._hold is not None and self._hold() and key in self._pending:
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(max(self.window, 0.005), self._expire, key)
+            return
+        self._flush(key)
+
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = [(item, fut) for item, fut in self._pending.pop(key, []) if not fut.cancelled()]
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        task = asyncio.ensure_future(self._execute(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        for _, fut in batch:
+            # Stop the batch when every submitter has gone away.
+            fut.add_done_callback(lambda _f, batch=batch, task=task: self._abandon(batch, task))
+
+    @staticmethod
+    def _abandon(batch: List[Tuple[Any, asyncio.Future]], task: asyncio.Future) -> None:
+        if not task.done() and all(fut.cancelled() for _, fut in batch):
+            task.cancel()
+
+    async def _execute(self, key: Hashable, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self._run(key, [item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, fut in batch:
+                fut.cancel()
+            raise
+        except BaseException as exc:  # noqa: BLE001
+            for _, fut in batch:
+                _resolve(fut, None, exc)
+            return
+        for (_, fut), result in zip(batch, results):
+            _resolve(fut, result, None)
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch": self.max_batch,
+            "window_ms": round(self.window * 1000, 3),
+            "pending": sum(len(batch) for batch in self._pending.values()),
+            "batches": self.batches,
+            "items": self.items,
+            "full_batches": self.full,
+            "avg_batch": round(self.items / self.batches, 3) if self.batches else 0.0,
+        }
+
+
+def release_accelerator_memory() -> None:
+    """Return freed model memory to the system after dropping the last reference to a pipeline."""
+    import gc
+
+    gc.collect()
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+def accelerator_allocated_mb() -> Optional[float]:
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            return torch.cuda.memory_allocated() / (1024 * 1024)
+    except ImportError:
+        pass
+    return None
+
+
+LOAD_POLICIES = ("eager", "lazy", "background")
+# Every ManagedModel by name; the node's /ready reports the ones that were started.
+models: Dict[str, "ManagedModel"] = {}
+
+
+class ManagedModel:
+    """Load policy, readiness and idle unloading for one service's model.
+
+    - eager: loading starts at startup and the app waits for it (see `wait_eager_loads`)
+    - background: loading starts at startup, requests are served meanwhile and wait if they need it
+    - lazy: loaded by the first request that needs it
+
+    Loads and unloads run on the service's InferenceWorker, so models of different services
+    load in parallel. With `idle_unload` > 0 a model unused for that many seconds is unloaded
+    and transparently reloaded by the next request. Callers hold the model with `use()`.
+    `memory_mb` is the expected resident size, used by `residency` to keep the node within
+    its memory budget (replaced by a measurement once the model has loaded on its own).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[], None],
+        unload: Callable[[], None],
+        worker: "InferenceWorker",
+        policy: str = "background",
+        idle_unload: float = 0.0,
+        memory_mb: float = 0.0,
+    ) -> None:
+        if policy not in LOAD_POLICIES:
+            print(f"[WARN] unknown load policy {policy!r} for {name}, using background")
+            policy = "background"
+        self.name = name
+        self.policy = policy
+        self.idle_unload = max(0.0, idle_unload)
+        self._load = load
+        self._unload = unload
+        self.worker = worker
+        self.state = "unloaded"
+        self.error: Optional[str] = None
+        self.started = False
+        self.active = 0
+        self.loads = 0
+        self.unloads = 0
+        self.load_seconds: Optional[float] = None
+        self.memory_mb = max(0.0, memory_mb)
+        self.measured_mb: Optional[float] = None
+        self.deferred = False
+        self.evictions = 0
+        self.swaps = 0
+        self.last_swap_seconds: Optional[float] = None
+        self.last_used = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self._warmup: Optional[asyncio.Future] = None
+        self._reaper: Optional[asyncio.Future] = None
+        models[name] = self
+
+    def _guard(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def ready(self) -> bool:
+        """Can serve requests now: a lazy model, or one that has loaded at least once (idle unloads and
+        warmups deferred by the memory budget don't count against it)."""
+        return self.state != "failed" and (self.policy == "lazy" or self.loads > 0 or self.deferred)
+
+    @property
+    def footprint_mb(self) -> float:
+        return self.measured_mb if self.measured_mb is not None else self.memory_mb
+
+    @property
+    def resident(self) -> bool:
+        return self.state in ("loading", "ready", "unloading")
+
+    def _measured_load(self) -> None:
+        """Runs on the worker thread; records the allocation delta when no other model was loading."""
+        before = accelerator_allocated_mb()
+        self._load()
+        after = accelerator_allocated_mb()
+        alone = sum(managed.state == "loading" for managed in models.values()) == 1
+        if before is not None and after is not None and alone and after > before:
+            self.measured_mb = round(after - before, 1)
+
+    async def _load_locked(self, deadline: Optional[float], demand: bool = True) -> bool:
+        """Load the model, first making room under the memory budget.
+
+        A warmup (`demand=False`) never evicts: when the model does not fit it is deferred to the
+        first request instead and False is returned.
+        """
+        started = time.monotonic()
+        if not await residency.reserve(self, evict=demand):
+            self.deferred = True
+            return False
+        self.state = "loading"
+        loaded_at = time.monotonic()
+        try:
+            await self.worker.submit(self._measured_load, deadline=deadline)
+        except (DeadlineExceeded, asyncio.CancelledError):
+            self.state = "unloaded"
+            residency.notify()
+            raise
+        except BaseException as exc:
+            self.state = "failed"
+            self.error = str(exc)
+            residency.notify()
+            raise
+        self.state = "ready"
+        self.error = None
+        self.deferred = False
+        self.loads += 1
+        now = time.monotonic()
+        self.load_seconds = round(now - loaded_at, 3)
+        if demand:
+            # Request-visible latency: waiting for room + evictions + the load itself.
+            self.swaps += 1
+            self.last_swap_seconds = round(now - started, 3)
+            residency.record_swap(now - started)
+        return True
+
+    async def acquire(self, deadline: Optional[float] = None) -> None:
+        """Make sure the model is loaded and keep it from being unloaded until `release()`."""
+        async with self._guard():
+            if self.state != "ready":
+                await self._load_locked(deadline)
+            self.active += 1
+        self.last_used = time.monotonic()
+
+    def release(self) -> None:
+        self.active = max(0, self.active - 1)
+        self.last_used = time.monotonic()
+        if not self.active:
+            residency.notify()
+
+    @asynccontextmanager
+    async def use(self, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        await self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def start(self) -> None:
+        """Startup hook: kick off loading according to the policy without blocking."""
+        self.started = True
+        if self.policy in ("eager", "background") and self._warmup is None:
+            self._warmup = asyncio.ensure_future(self._warm())
+        if self.idle_unload and self._reaper is None:
+            self._reaper = asyncio.ensure_future(self._reap())
+
+    async def _warm(self) -> None:
+        try:
+            async with self._guard():
+                if self.state == "ready":
+                    return
+                if not await self._load_locked(None, demand=False):
+                    print(f"[INFO] {self.name} model deferred: {self.footprint_mb:g}MB does not fit the memory budget")
+                    return
+            print(f"[INFO] {self.name} model loaded in {self.load_seconds}s")
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] {self.name} model load failed: {exc}")
+
+    async def wait_eager(self) -> None:
+        if self.policy == "eager" and self._warmup is not None:
+            await asyncio.shield(self._warmup)
+
+    def _idle(self) -> bool:
+        return self.state == "ready" and not self.active and time.monotonic() - self.last_used >= self.idle_unload
+
+    async def _unload_locked(self) -> None:
+        self.state = "unloading"
+        try:
+            await self.worker.submit(self._unload)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] {self.name} model unload failed: {exc}")
+        self.state = "unloaded"
+        self.unloads += 1
+        residency.notify()
+
+    async def evict(self) -> bool:
+        """Unload to make room for another model; refuses while the model is in use."""
+        async with self._guard():
+            if self.state != "ready" or self.active:
+                return False
+            await self._unload_locked()
+        self.evictions += 1
+        return True
+
+    async def _reap(self) -> None:
+        interval = min(max(self.idle_unload / 4, 1.0), 30.0)
+        while True:
+            await asyncio.sleep(interval)
+            if not self._idle():
+                continue
+            async with self._guard():
+                if not self._idle():
+                    continue
+                await self._unload_locked()
+                print(f"[INFO] {self.name} model unloaded after {self.idle_unload:g}s idle")
+
+    def stop(self) -> None:
+        for task in (self._warmup, self._reaper):
+            if task is not None and not task.done():
+                task.cancel()
+        self._warmup = self._reaper = None
+
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "policy": self.policy,
+            "error": self.error,
+            "active": self.active,
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "load_seconds": self.load_seconds,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "idle_unload": self.idle_unload,
+            "footprint_mb": self.footprint_mb,
+            "measured": self.measured_mb is not None,
+            "evictions": self.evictions,
+            "swaps": self.swaps,
+            "last_swap_seconds": self.last_swap_seconds,
+        }
+
+
+class ResidencyManager:
+    """Keeps the summed footprint of resident models within `budget_mb` (0 = unlimited).
+
+    Before a model loads on demand, idle resident models are evicted least-recently-used
+    first until it fits; if everything else is in use the load waits for a release. A model
+    larger than the whole budget still loads once nothing else is resident (with a warning).
+    """
+
+    def __init__(self, budget_mb: float) -> None:
+        self.budget_mb = max(0.0, budget_mb)
+        self.evictions = 0
+        self.waits = 0
+        self._swaps: "deque[float]" = deque(maxlen=256)
+        self.swap_total = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    @staticmethod
+    def resident_mb(exclude: Optional["ManagedModel"] = None) -> float:
+        return sum(m.footprint_mb for m in models.values() if m is not exclude and m.resident)
+
+    async def reserve(self, model: "ManagedModel", evict: bool = True) -> bool:
+        if not self.budget_mb:
+            return True
+        async with self._condition():
+            while self.resident_mb(model) + model.footprint_mb > self.budget_mb:
+                others = [m for m in models.values() if m is not model and m.resident]
+                if not others:
+                    print(f"[WARN] {model.name} needs {model.footprint_mb:g}MB, over the {self.budget_mb:g}MB budget")
+                    break
+                if not evict:
+                    return False
+                idle = sorted((m for m in others if m.state == "ready" and not m.active), key=lambda m: m.last_used)
+                if idle:
+                    if await idle[0].evict():
+                        self.evictions += 1
+                        print(f"[INFO] evicted {idle[0].name} to load {model.name}")
+                    continue
+                self.waits += 1
+                await self._condition().wait()
+        return True
+
+    def notify(self) -> None:
+        """Wake loads waiting for room (a model was released or unloaded)."""
+        if self._cond is None or not self.budget_mb:
+            return
+
+        async def _wake():
+            async with self._condition():
+                self._condition().notify_all()
+
+        asyncio.ensure_future(_wake())
+
+    def record_swap(self, seconds: float) -> None:
+        self._swaps.append(seconds)
+        self.swap_total += 1
+
+    def stats(self) -> Dict:
+        swaps = sorted(self._swaps)
+        return {
+            "budget_mb": self.budget_mb,
+            "resident_mb": round(self.resident_mb(), 1),
+            "resident": [m.name for m in models.values() if m.resident],
+            "evictions": self.evictions,
+            "waits": self.waits,
+            "swaps": self.swap_total,
+            "swap_seconds_avg": round(sum(swaps) / len(swaps), 3) if swaps else None,
+            "swap_seconds_p95": round(swaps[min(len(swaps) - 1, int(len(swaps) * 0.95))], 3) if swaps else None,
+            "swap_seconds_max": round(swaps[-1], 3) if swaps else None,
+        }
+
+
+residency = ResidencyManager(float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0")))
+
+
+async def wait_eager_loads() -> None:
+    """Startup hook added after every service registered: eager models load in parallel, then serving starts."""
+    await asyncio.gather(*(managed.wait_eager() for managed in models.values() if managed.started))
+
+
+def readiness() -> Tuple[bool, Dict[str, Dict]]:
+    started = {name: managed.status() for name, managed in models.items() if managed.started}
+    return all(status["ready"] for status in started.values()), started
@@ -0,0 +1,197 @@
+"""OpenTelemetry tracing shared by the gateway, the model node and the queue worker.
+
+W3C trace context in and out, spans to a local OTLP/JSON file. Each process calls `setup()` once
+with its service name; with TRACE_FILE set, each export appends one OTLP `ExportTraceServiceRequest`
+JSON object per line (the layout of the collector's otlpjsonfile receiver), so no collector has to
+run and every process can write to the same file. Without TRACE_FILE the no-op API tracer is used,
+though incoming `traceparent` headers are still forwarded downstream.
+
+The queue worker is deployed on its own and gets a generated copy of this file
+(`python -m model.scripts.sync_tracing`); edit this one.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Optional, Sequence
+
+from opentelemetry import context as otel_context
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.trace import SpanKind, Status, StatusCode, use_span  # noqa: F401  (re-exported)
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# Polling/scrape endpoints (last path segment) would drown the interesting spans.
+UNTRACED_ENDPOINTS = {"health", "metrics", "ready"}
+
+
+def _value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attrs) -> list:
+    return [{"key": key, "value": _value(value)} for key, value in (attrs or {}).items()]
+
+
+def _encode_span(span: ReadableSpan) -> Dict:
+    ctx = span.get_span_context()
+    out = {
+        "traceId": format(ctx.trace_id, "032x"),
+        "spanId": format(ctx.span_id, "016x"),
+        "name": span.name,
+        "kind": span.kind.value + 1,  # OTLP enum reserves 0 for UNSPECIFIED
+        "startTimeUnixNano": str(span.start_time),
+        "endTimeUnixNano": str(span.end_time),
+        "attributes": _attributes(span.attributes),
+        "events": [
+            {"timeUnixNano": str(e.timestamp), "name": e.name, "attributes": _attributes(e.attributes)}
+            for e in span.events
+        ],
+        "status": {"code": span.status.status_code.value},
+    }
+    if span.parent is not None:
+        out["parentSpanId"] = format(span.parent.span_id, "016x")
+    if span.status.description:
+        out["status"]["message"] = span.status.description
+    return out
+
+
+class OTLPJsonFileExporter(SpanExporter):
+    """Append each batch of finished spans to `path` as one OTLP/JSON line."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        grouped: Dict[tuple, Dict[str, list]] = {}
+        resources = {}
+        for span in spans:
+            key = tuple(sorted(span.resource.attributes.items()))
+            resources[key] = span.resource
+            scope = span.instrumentation_scope.name if span.instrumentation_scope else ""
+            grouped.setdefault(key, {}).setdefault(scope, []).append(_encode_span(span))
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _attributes(resources[key].attributes)},
+                    "scopeSpans": [{"scope": {"name": scope}, "spans": items} for scope, items in scopes.items()],
+                }
+                for key, scopes in grouped.items()
+            ]
+        }
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        except OSError as exc:
+            print(f"[WARN] trace export to {self.path} failed: {exc}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+_provider: Optional[TracerProvider] = None
+# Resolves to the provider installed by setup(), whenever that happens.
+tracer = trace.get_tracer("s2v")
+
+
+def setup(service_name: str) -> None:
+    """Record this process's spans to TRACE_FILE as `service_name` (OTEL_SERVICE_NAME overrides it).
+
+    Only the first call installs a provider; without TRACE_FILE it does nothing.
+    """
+    global _provider  # noqa: PLW0603
+    if _provider is not None or not TRACE_FILE:
+        return
+    name = os.getenv("OTEL_SERVICE_NAME", service_name)
+    _provider = TracerProvider(resource=Resource.create({"service.name": name}))
+    _provider.add_span_processor(BatchSpanProcessor(OTLPJsonFileExporter(TRACE_FILE)))
+    trace.set_tracer_provider(_provider)
+
+
+def inject(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Headers carrying the current span as W3C `traceparent`/`tracestate`."""
+    headers = dict(headers or {})
+    propagate.inject(headers)
+    return headers
+
+
+def extract(carrier: Optional[Dict[str, str]]) -> otel_context.Context:
+    return propagate.extract(carrier or {})
+
+
+def flush() -> None:
+    """Write out buffered spans (uvicorn re-raises SIGTERM after shutdown, so atexit hooks never run)."""
+    if _provider is not None:
+        _provider.force_flush()
+
+
+def mark_error(span: trace.Span, exc: BaseException) -> None:
+    span.record_exception(exc)
+    span.set_status(Status(StatusCode.ERROR, str(exc)))
+
+
+class TraceMiddleware:
+    """ASGI middleware: one SERVER span per HTTP request, parented on the caller's `traceparent`.
+
+    The app only returns once the body is sent, so streamed responses (SSE, audio) are timed in full.
+    Add it once per app (not per router), so an app aggregating several routers doesn't nest spans.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.app(scope, receive, self._flush_on_shutdown(send))
+            return
+        if scope["type"] != "http" or scope["path"].rstrip("/").rsplit("/", 1)[-1] in UNTRACED_ENDPOINTS:
+            await self.app(scope, receive, send)
+            return
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        method = scope["method"]
+        span = tracer.start_span(method, context=extract(headers), kind=SpanKind.SERVER)
+        token = otel_context.attach(trace.set_span_in_context(span))
+
+        async def _send(message) -> None:
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.set_status(Status(StatusCode.ERROR))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as exc:
+            mark_error(span, exc)
+            raise
+        finally:
+            # Label by route template once routing has run, like the request metrics.
+            route = getattr(scope.get("route"), "path", None)
+            span.update_name(f"{method} {route or scope['path']}")
+            span.end()
+            otel_context.detach(token)
+
+    @staticmethod
+    def _flush_on_shutdown(send):
+        async def _send(message) -> None:
+            if message["type"] == "lifespan.shutdown.complete":
+                flush()
+            await send(message)
+
+        return _send